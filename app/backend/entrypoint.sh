@@ -9,8 +9,8 @@ until PGPASSWORD=$POSTGRES_PASSWORD psql -h $POSTGRES_HOST -U $POSTGRES_USER -d
   sleep 1
 done
 
-echo "PostgreSQL is up - executing migration"
-python migrate_to_postgres.py
+echo "PostgreSQL is up - applying schema migrations"
+python -m migrations upgrade
 
 # Start the application
 echo "Starting application"
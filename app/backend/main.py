@@ -2,12 +2,13 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from database import engine
-import models
+from metrics import Gauge, MetricsMiddleware, metrics_response
+
 from routers import trips, preferences, locations, auth
 from routers.microservice_routers import map_router, itinerary_router
 
-# Create database tables
-models.Base.metadata.create_all(bind=engine)
+# Tables are created by the shared schema migrations (python -m migrations upgrade),
+# run once before the server starts rather than on every import
 
 app = FastAPI(
     title="Travel Planner API",
@@ -21,6 +22,7 @@ origins = [
     "http://localhost:3000",  # For React frontend
 ]
 
+app.add_middleware(MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -37,6 +39,16 @@ app.include_router(locations.router, prefix="/api")
 app.include_router(map_router, prefix="/api")
 app.include_router(itinerary_router, prefix="/api")
 
+# SQLAlchemy connection pool, read at scrape time
+Gauge("db_pool_connections", "SQLAlchemy pool connections by state", ("state",),
+      function=lambda: {"checked_out": engine.pool.checkedout(), "idle": engine.pool.checkedin(),
+                        "overflow": max(engine.pool.overflow(), 0), "size": engine.pool.size()})
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    return await metrics_response()
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to Travel Planner API. See /docs for API documentation."}
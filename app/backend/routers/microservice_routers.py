@@ -1,5 +1,5 @@
 from fastapi import APIRouter, HTTPException, Request, Path, Body
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import httpx
 import os
 from typing import Optional, Any, Dict
@@ -102,6 +102,34 @@ async def generate_trip_itinerary(
         logger.error(f"Error calling itinerary generation service: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error calling itinerary generation service: {str(e)}")
 
+@itinerary_router.post("/regenerate/{trip_id}/day/{day_number}")
+async def regenerate_itinerary_day(
+    trip_id: str = Path(..., description="Trip whose itinerary has a bad day"),
+    day_number: int = Path(..., description="Day to regenerate (1-based)"),
+    request_data: Optional[Dict[str, Any]] = Body(None, description="Trip data including destination and dates")
+):
+    """Regenerate a single day of a completed itinerary"""
+    try:
+        url = f"{ITINERARY_SERVICE_URL}/regenerate/{trip_id}/day/{day_number}"
+        await log_request("POST", url, json=request_data)
+        
+        async with httpx.AsyncClient() as client:
+            response = await client.post(
+                url,
+                json=request_data,
+                timeout=60.0
+            )
+            
+            await log_response(url, response)
+            
+            return JSONResponse(
+                content=response.json(),
+                status_code=response.status_code
+            )
+    except Exception as e:
+        logger.error(f"Error regenerating itinerary day: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error regenerating itinerary day: {str(e)}")
+
 @itinerary_router.get("/status/{trip_id}")
 async def check_itinerary_status(
     trip_id: str = Path(..., description="Trip ID to check status for")
@@ -128,20 +156,71 @@ async def check_itinerary_status(
         raise HTTPException(status_code=500, detail=f"Error checking itinerary status: {str(e)}")
 
 
+@itinerary_router.get("/status/{trip_id}/events")
+async def stream_itinerary_status(
+    trip_id: str = Path(..., description="Trip ID to follow")
+):
+    """Relay the itinerary service's server-sent status events (replaces status polling)"""
+    url = f"{ITINERARY_SERVICE_URL}/status/{trip_id}/events"
+    await log_request("GET", url)
+    
+    client = httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=None))
+    try:
+        upstream = await client.send(client.build_request("GET", url), stream=True)
+    except Exception as e:
+        await client.aclose()
+        logger.error(f"Error opening itinerary status stream: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error opening itinerary status stream: {str(e)}")
+    
+    if upstream.status_code != 200:
+        body = await upstream.aread()
+        await upstream.aclose()
+        await client.aclose()
+        try:
+            content = json.loads(body)
+        except ValueError:
+            content = {"detail": body.decode(errors="replace")}
+        return JSONResponse(content=content, status_code=upstream.status_code)
+    
+    async def relay():
+        try:
+            async for chunk in upstream.aiter_raw():
+                yield chunk
+        finally:
+            await upstream.aclose()
+            await client.aclose()
+    
+    return StreamingResponse(
+        relay(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @itinerary_router.get("/itinerary/{trip_id}")
-async def get_trip_itinerary(trip_id: str):
-    """Alternative endpoint to match frontend request pattern"""
+async def get_trip_itinerary(trip_id: str, request: Request):
+    """Alternative endpoint to match frontend request pattern
+
+    The itinerary body is relayed as bytes, without decoding it, and the
+    ETag / If-None-Match pair is passed through so unchanged itineraries
+    come back as 304.
+    """
     try:
         url = f"{ITINERARY_SERVICE_URL}/itinerary/itinerary/{trip_id}"
         await log_request("GET", url)
         
+        headers = {}
+        if request.headers.get("if-none-match"):
+            headers["If-None-Match"] = request.headers["if-none-match"]
+        
         async with httpx.AsyncClient() as client:
             response = await client.get(
                 url,
+                headers=headers,
                 timeout=10.0
             )
             
-            await log_response(url, response)
+            logger.info(f"RESPONSE FROM {url}: Status {response.status_code}, {len(response.content)} bytes")
             
             if response.status_code == 202:
                 # Still processing
@@ -150,18 +229,23 @@ async def get_trip_itinerary(trip_id: str):
                     status_code=202
                 )
             
+            cache_headers = {name: response.headers[name] for name in ("etag", "cache-control") if name in response.headers}
+            if response.status_code == 304:
+                return Response(status_code=304, headers=cache_headers)
+            
             # Forward the response regardless of status code
-            try:
-                return JSONResponse(
-                    content=response.json(),
-                    status_code=response.status_code
-                )
-            except ValueError:
-                # If response is not JSON, return the text
-                return JSONResponse(
-                    content={"error": "Invalid response format", "detail": response.text},
-                    status_code=500
+            if response.headers.get("content-type", "").startswith("application/json"):
+                return Response(
+                    content=response.content,
+                    status_code=response.status_code,
+                    media_type="application/json",
+                    headers=cache_headers
                 )
+            # If response is not JSON, return the text
+            return JSONResponse(
+                content={"error": "Invalid response format", "detail": response.text},
+                status_code=500
+            )
     except Exception as e:
         logger.error(f"Error retrieving itinerary: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error retrieving itinerary: {str(e)}")
\ No newline at end of file
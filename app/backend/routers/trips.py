@@ -232,6 +232,7 @@ def update_trip(
 @router.delete("/{trip_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_trip(
     trip_id: int, 
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: models.DBUser = Depends(get_current_active_user)
 ):
@@ -246,6 +247,8 @@ def delete_trip(
         
         db.delete(db_trip)
         db.commit()
+        # Stop its generation; the itinerary service's writes are keyed on the (now gone) trip row anyway
+        background_tasks.add_task(itinerary_service.cancel_generation, trip_id)
         return None
         
     except HTTPException:
@@ -91,4 +91,16 @@ class ItineraryService:
                     "message": "Itinerary generation in progress"
                 }
                 
-            return response.status_code, response.json() if response.status_code == 200 else {}
\ No newline at end of file
+            return response.status_code, response.json() if response.status_code == 200 else {}
+    
+    async def cancel_generation(self, trip_id: int) -> bool:
+        """Stop any queued or running generation for a deleted trip (best effort)"""
+        async with httpx.AsyncClient() as client:
+            try:
+                response = await client.delete(
+                    f"{self.base_url}/generation/{trip_id}",
+                    timeout=5.0
+                )
+                return response.status_code < 400
+            except Exception:
+                return False
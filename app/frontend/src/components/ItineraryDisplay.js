@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import {
   Calendar,
   Clock,
@@ -236,6 +236,49 @@ const ItineraryDisplay = ({ tripId }) => {
   const [error, setError] = useState(null);
   const [status, setStatus] = useState(null);
   const [pollInterval, setPollInterval] = useState(null);
+  const statusSource = useRef(null);
+
+  // Stop listening for pushed status updates
+  const stopWatching = () => {
+    if (statusSource.current) {
+      statusSource.current.close();
+      statusSource.current = null;
+    }
+  };
+
+  // Follow generation status via server-sent events, falling back to polling
+  const startWatching = () => {
+    if (!window.EventSource) {
+      startPolling();
+      return;
+    }
+    stopWatching();
+
+    const source = new EventSource(`/api/itinerary/status/${tripId}/events`);
+    statusSource.current = source;
+
+    source.addEventListener("status", (event) => {
+      const statusData = JSON.parse(event.data);
+      setStatus(statusData);
+
+      if (statusData.status === "completed") {
+        stopWatching();
+        fetchItinerary();
+      } else if (statusData.status === "failed") {
+        stopWatching();
+        setError(`Generation failed: ${statusData.message}`);
+        setLoading(false);
+      }
+    });
+
+    source.onerror = () => {
+      // Stream closed or unavailable; finish (or keep waiting) by polling
+      if (statusSource.current === source) {
+        stopWatching();
+        startPolling();
+      }
+    };
+  };
 
   // Start polling
   const startPolling = () => {
@@ -265,7 +308,7 @@ const ItineraryDisplay = ({ tripId }) => {
           status: "processing",
           message: "Itinerary generation in progress",
         });
-        startPolling();
+        startWatching();
         return;
       }
 
@@ -338,8 +381,8 @@ const ItineraryDisplay = ({ tripId }) => {
         throw new Error("Failed to start itinerary generation");
       }
 
-      // Start polling for status
-      startPolling();
+      // Follow status updates
+      startWatching();
     } catch (err) {
       console.error("Error generating itinerary:", err);
       setError(err.message);
@@ -353,6 +396,7 @@ const ItineraryDisplay = ({ tripId }) => {
       fetchItinerary();
     }
     return () => {
+      stopWatching();
       if (pollInterval) {
         clearInterval(pollInterval);
       }
@@ -244,6 +244,15 @@ const getActivityCoordinatesEnhanced = async (
   const currentDistrictCoords = districtCoords[district];
 
   try {
+    // Strategy 0: Coordinates already stored with the itinerary
+    if (hasStoredCoordinates(activity)) {
+      return {
+        lat: activity.lat,
+        lng: activity.lng,
+        searchMethod: "stored",
+      };
+    }
+
     // Strategy 1: Use address if available
     if (address && address.length > 5) {
       const coords = await getCoordinatesFromAddress(
@@ -395,6 +404,8 @@ const extractActivities = (dayData) => {
             type: typeof activity === "object" ? activity.type : "attraction",
             location: typeof activity === "object" ? activity.location : null,
             address: typeof activity === "object" ? activity.address : null,
+            lat: typeof activity === "object" ? activity.lat : undefined,
+            lng: typeof activity === "object" ? activity.lng : undefined,
           };
         });
 
@@ -404,6 +415,10 @@ const extractActivities = (dayData) => {
   return [];
 };
 
+// Coordinates added by the itinerary service's geocoding stage
+const hasStoredCoordinates = (activity) =>
+  Number.isFinite(activity.lat) && Number.isFinite(activity.lng);
+
 const extractDate = (dayData) => {
   if (typeof dayData === "object" && dayData.date) return dayData.date;
   return new Date().toISOString().split("T")[0];
@@ -436,7 +451,6 @@ const guessActivityType = (activityName) => {
 
 // Main enrichment function with generic validation
 const enrichItineraryWithCoordinates = async (rawItinerary, destination) => {
-  const destinationCoords = await getDestinationCoords(destination);
   const enriched = {};
 
   // Handle the wrapper format {itinerary: {...}}
@@ -445,11 +459,25 @@ const enrichItineraryWithCoordinates = async (rawItinerary, destination) => {
     itineraryData = rawItinerary.itinerary;
   }
 
+  // Fully geocoded itineraries need no lookups: center on the activities themselves
+  const allActivities = Object.entries(itineraryData)
+    .filter(([dayKey]) => dayKey.toLowerCase().includes("day"))
+    .flatMap(([, dayData]) => extractActivities(dayData));
+  const allStored =
+    allActivities.length > 0 && allActivities.every(hasStoredCoordinates);
+  const destinationCoords = allStored
+    ? {
+        lat: allActivities.reduce((sum, a) => sum + a.lat, 0) / allActivities.length,
+        lng: allActivities.reduce((sum, a) => sum + a.lng, 0) / allActivities.length,
+        cityName: destination,
+      }
+    : await getDestinationCoords(destination);
+
   // Extract unique districts from itinerary data
   const uniqueDistricts = new Set();
   Object.values(itineraryData).forEach((dayData) => {
     const district = extractLocation(dayData);
-    if (district && district !== destination) {
+    if (!allStored && district && district !== destination) {
       uniqueDistricts.add(district);
     }
   });
@@ -561,7 +589,7 @@ const enrichItineraryWithCoordinates = async (rawItinerary, destination) => {
         });
 
         // Delay between searches
-        if (i < activities.length - 1) {
+        if (i < activities.length - 1 && coords.searchMethod !== "stored") {
           await new Promise((resolve) => setTimeout(resolve, 300));
         }
       } catch (error) {
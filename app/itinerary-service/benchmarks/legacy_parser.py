@@ -0,0 +1,148 @@
+"""Frozen copy of the regex-cascade parser that itinerary_parser.py replaced.
+
+Only parse_bench.py uses it, as the baseline column, so speedups and
+regressions are always measured against the same reference. Its log calls
+are kept (their f-strings were part of the cost) but go to a disabled logger.
+"""
+import json
+import logging
+import re
+
+logger = logging.getLogger("legacy-parser")
+logger.disabled = True
+
+
+def legacy_clean_and_parse_json(llm_response: str) -> dict:
+    """clean_and_parse_json as it was before itinerary_parser.py"""
+    
+    try:
+        # Strategy 1: Try parsing as-is first
+        return json.loads(llm_response.strip())
+    except:
+        pass
+    
+    try:
+        # Strategy 2: Extract from code blocks
+        cleaned_response = llm_response.strip()
+        
+        if "```json" in cleaned_response:
+            logger.info("Extracting JSON from code block with json tag")
+            json_str = cleaned_response.split("```json", 1)[1].split("```", 1)[0].strip()
+            cleaned_response = json_str
+        elif "```" in cleaned_response and cleaned_response.count("```") >= 2:
+            logger.info("Extracting JSON from generic code block")
+            json_str = cleaned_response.split("```", 1)[1].split("```", 1)[0].strip()
+            cleaned_response = json_str
+        
+        # Strategy 3: Find JSON boundaries
+        if '{' in cleaned_response:
+            start_pos = cleaned_response.find('{')
+            cleaned_response = cleaned_response[start_pos:]
+        
+        # Strategy 4: Fix malformed keys (Day 1 vs "Day 1")
+        cleaned_response = re.sub(r'"Day\s*(\d+)"', r'"Day \1"', cleaned_response)
+        cleaned_response = re.sub(r'{\s*"(\d+)":', r'{"Day \1":', cleaned_response)
+        
+        # Strategy 5: Handle truncated JSON by finding last complete day
+        if not cleaned_response.endswith('}'):
+            logger.info("JSON appears truncated, attempting to fix")
+            # Find the last properly closed brace for a complete entry
+            brace_count = 0
+            last_valid_pos = 0
+            
+            for i, char in enumerate(cleaned_response):
+                if char == '{':
+                    brace_count += 1
+                elif char == '}':
+                    brace_count -= 1
+                    if brace_count == 1:  # Back to main object level
+                        last_valid_pos = i
+            
+            if last_valid_pos > 0:
+                cleaned_response = cleaned_response[:last_valid_pos + 1] + '}'
+        
+        if '}' in cleaned_response and not cleaned_response.endswith('}'):
+            end_pos = cleaned_response.rfind('}') + 1
+            cleaned_response = cleaned_response[:end_pos]
+        
+        # Strategy 6: Fix trailing commas
+        cleaned_response = re.sub(r',\s*}', '}', cleaned_response)
+        cleaned_response = re.sub(r',\s*]', ']', cleaned_response)
+        
+        logger.info(f"Attempting to parse cleaned JSON: {cleaned_response[:200]}...")
+        return json.loads(cleaned_response)
+        
+    except Exception as e:
+        logger.error(f"JSON cleaning failed: {e}")
+        logger.error(f"Problematic JSON: {cleaned_response[:500]}...")
+    
+    # Strategy 7: Smart content extraction - preserve real data from response
+    try:
+        logger.info("Attempting smart content extraction from malformed response")
+        result = {}
+        
+        # Extract any districts/neighborhoods mentioned
+        district_matches = re.findall(r'"district":\s*"([^"]*)"', llm_response)
+        
+        # Extract any place names mentioned  
+        title_matches = re.findall(r'"title":\s*"([^"]*)"', llm_response)
+        
+        # Extract addresses
+        address_matches = re.findall(r'"address":\s*"([^"]*)"', llm_response)
+        
+        # Extract dates
+        date_matches = re.findall(r'"date":\s*"([^"]*)"', llm_response)
+        
+        # Try to group by days using any day indicators
+        day_indicators = re.findall(r'(?:"Day (\d+)"|"(\d+)"|Day (\d+))', llm_response)
+        
+        # Flatten day numbers and get unique ones
+        day_numbers = []
+        for match in day_indicators:
+            for num in match:
+                if num and num not in day_numbers:
+                    day_numbers.append(num)
+        
+        if district_matches and title_matches and len(day_numbers) > 0:
+            logger.info(f"Found {len(district_matches)} districts, {len(title_matches)} places, {len(address_matches)} addresses, {len(day_numbers)} days")
+            
+            for i, day_num in enumerate(day_numbers):
+                day_key = f"Day {day_num}"
+                
+                # Get district for this day
+                district_idx = min(i, len(district_matches) - 1)
+                district = district_matches[district_idx] if district_matches else "City Center"
+                
+                # Get date for this day  
+                date_idx = min(i, len(date_matches) - 1)
+                date = date_matches[date_idx] if date_matches else ""
+                
+                # Get titles for this day (5 activities per day)
+                start_title_idx = i * 5
+                day_titles = title_matches[start_title_idx:start_title_idx + 5]
+                day_addresses = address_matches[start_title_idx:start_title_idx + 5] if address_matches else []
+                
+                while len(day_titles) < 5:
+                    day_titles.append(f"Local activity in {district}")
+                while len(day_addresses) < 5:
+                    day_addresses.append(f"{district}, nearby")
+                
+                result[day_key] = {
+                    "date": date,
+                    "district": district,
+                    "09:00": {"type": "breakfast", "title": day_titles[0], "location": district, "address": day_addresses[0]},
+                    "11:00": {"type": "sightseeing", "title": day_titles[1], "location": district, "address": day_addresses[1]},
+                    "13:00": {"type": "lunch", "title": day_titles[2], "location": district, "address": day_addresses[2]},
+                    "15:30": {"type": "activity", "title": day_titles[3], "location": district, "address": day_addresses[3]},
+                    "19:00": {"type": "dinner", "title": day_titles[4], "location": district, "address": day_addresses[4]}
+                }
+            
+            if result:
+                logger.info(f"Smart extraction created {len(result)} days with real place names and addresses")
+                return result
+                
+    except Exception as e:
+        logger.error(f"Smart content extraction failed: {e}")
+    
+    # Strategy 8: Return None to trigger fallback
+    return None
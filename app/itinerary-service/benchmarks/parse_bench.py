@@ -0,0 +1,196 @@
+"""Offline benchmark for the LLM response parser.
+
+Runs every case in benchmarks/corpus through parse_itinerary_response (what
+clean_and_parse_json uses), through the smart-extraction fallback on its
+own and through the legacy regex-cascade parser (legacy_parser.py, the
+baseline), then reports latency percentiles, the speedup over the baseline,
+allocations and how many days each strategy salvaged. No Groq key or
+network access is needed.
+
+    python benchmarks/parse_bench.py                 # table
+    python benchmarks/parse_bench.py --json out.json # also write raw numbers
+    python benchmarks/parse_bench.py --check         # exit 1 if a case lost days
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Any, Callable, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = os.path.join(BENCH_DIR, "corpus")
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from itinerary_parser import extract_itinerary_fields, parse_itinerary_response  # noqa: E402
+from legacy_parser import legacy_clean_and_parse_json  # noqa: E402
+
+
+def load_corpus(corpus_dir: str = CORPUS_DIR) -> List[Dict[str, Any]]:
+    """Manifest entries with the raw response text attached"""
+    with open(os.path.join(corpus_dir, "manifest.json"), encoding="utf-8") as f:
+        cases = json.load(f)["cases"]
+    for case in cases:
+        with open(os.path.join(corpus_dir, case["file"]), encoding="utf-8") as f:
+            case["text"] = f.read()
+    return cases
+
+
+def count_days(result: Any) -> int:
+    """Days that carry at least one slot with an address"""
+    if not isinstance(result, dict):
+        return 0
+    days = 0
+    for day in result.values():
+        if isinstance(day, dict) and any(isinstance(slot, dict) and slot.get("address") for slot in day.values()):
+            days += 1
+    return days
+
+
+def percentile(samples: List[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def time_call(fn: Callable[[str], Any], text: str, iterations: int) -> List[float]:
+    """Per-call latencies in microseconds"""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter_ns()
+        fn(text)
+        samples.append((time.perf_counter_ns() - start) / 1000.0)
+    return samples
+
+
+def measure_allocations(fn: Callable[[str], Any], text: str) -> Dict[str, int]:
+    """Peak traced memory and number of live blocks allocated by one call"""
+    fn(text)  # warm regex caches so they are not charged to the parse
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        result = fn(text)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    del result
+    return {"peak_bytes": peak, "blocks": blocks}
+
+
+def bench_case(case: Dict[str, Any], iterations: int) -> Dict[str, Any]:
+    text = case["text"]
+    result, strategy = parse_itinerary_response(text)
+    extracted = extract_itinerary_fields(text)
+
+    parse_samples = time_call(parse_itinerary_response, text, iterations)
+    extract_samples = time_call(extract_itinerary_fields, text, iterations)
+    legacy_samples = time_call(legacy_clean_and_parse_json, text, iterations)
+    parse_p50 = percentile(parse_samples, 0.5)
+    legacy_p50 = percentile(legacy_samples, 0.5)
+
+    return {
+        "file": case["file"],
+        "category": case["category"],
+        "bytes": len(text.encode("utf-8")),
+        "strategy": strategy or "failed",
+        "expected_days": case["expected_days"],
+        "recovered_days": count_days(result),
+        "extraction_days": count_days(extracted),
+        "parse_p50_us": parse_p50,
+        "parse_p95_us": percentile(parse_samples, 0.95),
+        "parse_p99_us": percentile(parse_samples, 0.99),
+        "extract_p50_us": percentile(extract_samples, 0.5),
+        "extract_p95_us": percentile(extract_samples, 0.95),
+        "legacy_p50_us": legacy_p50,
+        "speedup": round(legacy_p50 / parse_p50, 2) if parse_p50 else 0.0,
+        "parse_alloc": measure_allocations(parse_itinerary_response, text),
+        "extract_alloc": measure_allocations(extract_itinerary_fields, text),
+    }
+
+
+def summarize(rows: List[Dict[str, Any]], key: str) -> List[Dict[str, Any]]:
+    groups: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for row in rows:
+        groups[row[key]].append(row)
+
+    summary = []
+    for name, members in sorted(groups.items()):
+        expected = sum(row["expected_days"] for row in members)
+        recovered = sum(min(row["recovered_days"], row["expected_days"]) for row in members)
+        summary.append({
+            key: name,
+            "cases": len(members),
+            "days_expected": expected,
+            "days_recovered": recovered,
+            "recovery_rate": round(recovered / expected, 4) if expected else 0.0,
+            "parse_p50_us": percentile([row["parse_p50_us"] for row in members], 0.5),
+            "parse_p95_us": max(row["parse_p95_us"] for row in members),
+            "legacy_p50_us": percentile([row["legacy_p50_us"] for row in members], 0.5),
+            "peak_kib": round(max(row["parse_alloc"]["peak_bytes"] for row in members) / 1024, 1),
+        })
+    return summary
+
+
+def print_table(title: str, rows: List[Dict[str, Any]], columns: List[str]):
+    print(f"\n{title}")
+    widths = [max(len(col), *(len(_fmt(row[col])) for row in rows)) for col in columns]
+    print("  ".join(col.ljust(width) for col, width in zip(columns, widths)))
+    print("  ".join("-" * width for width in widths))
+    for row in rows:
+        print("  ".join(_fmt(row[col]).ljust(width) for col, width in zip(columns, widths)))
+
+
+def _fmt(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:.1f}"
+    return str(value)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark itinerary response parsing on the checked-in corpus")
+    parser.add_argument("--iterations", type=int, default=200, help="timed calls per case (default 200)")
+    parser.add_argument("--corpus", default=CORPUS_DIR, help="corpus directory containing manifest.json")
+    parser.add_argument("--json", dest="json_path", help="write the raw results to this file")
+    parser.add_argument("--check", action="store_true", help="exit non-zero if any case recovers fewer days than expected")
+    args = parser.parse_args(argv)
+
+    rows = [bench_case(case, args.iterations) for case in load_corpus(args.corpus)]
+    for row in rows:
+        row["peak_kib"] = round(row["parse_alloc"]["peak_bytes"] / 1024, 1)
+        row["blocks"] = row["parse_alloc"]["blocks"]
+        row["days"] = f"{row['recovered_days']}/{row['expected_days']}"
+
+    print_table("Per case", rows, ["file", "strategy", "days", "parse_p50_us", "parse_p95_us", "legacy_p50_us",
+                                  "speedup", "peak_kib", "blocks", "extraction_days", "extract_p50_us"])
+    by_strategy = summarize(rows, "strategy")
+    by_category = summarize(rows, "category")
+    summary_columns = ["cases", "days_recovered", "days_expected", "recovery_rate", "parse_p50_us", "parse_p95_us",
+                       "legacy_p50_us", "peak_kib"]
+    print_table("By strategy", by_strategy, ["strategy"] + summary_columns)
+    print_table("By category", by_category, ["category"] + summary_columns)
+
+    total_expected = sum(row["expected_days"] for row in rows)
+    total_recovered = sum(min(row["recovered_days"], row["expected_days"]) for row in rows)
+    print(f"\nOverall recovery: {total_recovered}/{total_expected} days "
+          f"({100.0 * total_recovered / total_expected:.1f}%) over {len(rows)} cases")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"iterations": args.iterations, "cases": rows,
+                       "by_strategy": by_strategy, "by_category": by_category}, f, indent=2)
+
+    if args.check:
+        regressions = [row["file"] for row in rows if row["recovered_days"] < row["expected_days"]]
+        if regressions:
+            print(f"Recovery regressed for: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
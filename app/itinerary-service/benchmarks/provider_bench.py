@@ -0,0 +1,144 @@
+"""Compare LLM providers on latency and answer quality.
+
+Sends the same set of itinerary prompts (compact mode, one per start date)
+to each provider through the service's provider layer and reports time to
+first day / total latency percentiles, failures and how many days the
+parser recovered. Keys come from the usual environment variables.
+
+    python stub_llm.py --ttft lognormal:0.8,0.5 &        # local, no tokens spent
+    python benchmarks/provider_bench.py --provider stub --requests 40 --concurrency 8
+    python benchmarks/provider_bench.py --provider stub --provider groq --requests 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, SERVICE_DIR)
+sys.path.insert(0, os.path.dirname(SERVICE_DIR))
+
+from http_pool import PooledHTTPClient  # noqa: E402
+from itinerary_parser import IncrementalDayParser, parse_itinerary_response  # noqa: E402
+from llm_providers import provider_from_env  # noqa: E402
+from main import ItineraryRequest, create_compact_prompt  # noqa: E402
+from parse_bench import count_days, percentile, print_table  # noqa: E402
+from token_budget import choose_max_tokens, estimate_chat_tokens  # noqa: E402
+
+SYSTEM_PROMPT = "You are a local travel expert. Always include real, specific addresses in your recommendations."
+
+
+def build_prompts(count: int, destination: str, days: int) -> List[str]:
+    """One prompt per request, each starting a day later so answers differ"""
+    prompts = []
+    first = datetime(2025, 6, 1)
+    for i in range(count):
+        start = first + timedelta(days=i)
+        request = ItineraryRequest(destination=destination, start_date=start.date().isoformat(),
+                                   end_date=(start + timedelta(days=days - 1)).date().isoformat(),
+                                   preferences=[{"category": "Food", "value": "Local food", "weight": 8}])
+        prompts.append(create_compact_prompt(request, start, start + timedelta(days=days - 1), days))
+    return prompts
+
+
+async def run_one(provider, prompt: str, days: int, stream: bool) -> Dict[str, Any]:
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+    max_tokens = choose_max_tokens(estimate_chat_tokens(SYSTEM_PROMPT, prompt), days,
+                                   context_window=provider.context_window)
+    parser = IncrementalDayParser()
+    first_day: Optional[float] = None
+    started = time.perf_counter()
+
+    async def on_delta(delta: str):
+        nonlocal first_day
+        if parser.feed(delta) and first_day is None:
+            first_day = time.perf_counter() - started
+
+    try:
+        if stream:
+            completion = await provider.stream(messages, max_tokens, 0.3, on_delta)
+        else:
+            completion = await provider.complete(messages, max_tokens, 0.3)
+    except Exception as e:
+        return {"ok": False, "error": str(e), "seconds": time.perf_counter() - started}
+
+    seconds = time.perf_counter() - started
+    if completion is None:
+        return {"ok": False, "error": "no completion", "seconds": seconds}
+    result, strategy = parse_itinerary_response(completion.text)
+    return {"ok": True, "seconds": seconds, "first_day_seconds": first_day, "strategy": strategy or "failed",
+            "finish_reason": completion.finish_reason, "days": min(count_days(result), days)}
+
+
+async def bench_provider(name: str, prompts: List[str], days: int, concurrency: int, stream: bool) -> Dict[str, Any]:
+    client = PooledHTTPClient.from_env("GROQ_HTTP")
+    provider = provider_from_env(client, name)
+    if not provider.is_configured:
+        raise SystemExit(f"Provider '{name}' has no API key configured")
+    gate = asyncio.Semaphore(concurrency)
+
+    async def limited(prompt: str):
+        async with gate:
+            return await run_one(provider, prompt, days, stream)
+
+    started = time.perf_counter()
+    try:
+        results = await asyncio.gather(*(limited(prompt) for prompt in prompts))
+    finally:
+        await client.close()
+    elapsed = time.perf_counter() - started
+
+    ok = [result for result in results if result["ok"]]
+    totals = [result["seconds"] for result in ok] or [0.0]
+    first_days = [result["first_day_seconds"] for result in ok if result.get("first_day_seconds") is not None]
+    days_recovered = sum(result["days"] for result in ok)
+    return {
+        "provider": name,
+        "model": provider.model,
+        "requests": len(results),
+        "failed": len(results) - len(ok),
+        "truncated": sum(1 for result in ok if result["finish_reason"] == "length"),
+        "total_p50_s": percentile(totals, 0.5),
+        "total_p95_s": percentile(totals, 0.95),
+        "first_day_p50_s": percentile(first_days, 0.5) if first_days else None,
+        "first_day_p95_s": percentile(first_days, 0.95) if first_days else None,
+        "day_recovery": round(days_recovered / (days * len(results)), 4),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "results": results,
+    }
+
+
+async def run(args) -> List[Dict[str, Any]]:
+    prompts = build_prompts(args.requests, args.destination, args.days)
+    return [await bench_provider(name, prompts, args.days, args.concurrency, not args.no_stream)
+            for name in args.provider or ["stub"]]
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare LLM providers on itinerary generation latency")
+    parser.add_argument("--provider", action="append", help="groq, openai or stub (repeatable, default stub)")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--days", type=int, default=3, help="trip length per request")
+    parser.add_argument("--destination", default="Rome")
+    parser.add_argument("--no-stream", action="store_true", help="use non-streaming completions")
+    parser.add_argument("--json", dest="json_path", help="write the raw results to this file")
+    args = parser.parse_args(argv)
+
+    rows = asyncio.run(run(args))
+    print_table("By provider", rows, ["provider", "model", "requests", "failed", "truncated", "total_p50_s",
+                                      "total_p95_s", "first_day_p50_s", "first_day_p95_s", "day_recovery",
+                                      "throughput_rps"])
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("itinerary-service")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised by CircuitBreaker.call() while calls are being short-circuited"""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"circuit open, next probe in {retry_in:.1f}s")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Failure- and latency-rate circuit breaker for the LLM provider.
+
+    Closed: outcomes of the last `window` calls are kept; once `min_calls`
+    are in, the circuit opens when the share of failures reaches
+    `failure_rate` or the share of calls slower than `slow_call_seconds`
+    reaches `slow_call_rate`. Open: calls are rejected immediately for
+    `open_seconds`. Half-open: up to `half_open_probes` calls go through;
+    a fast success closes the circuit, a failure or slow call re-opens it.
+    """
+
+    def __init__(self,
+                 window: int = 20,
+                 min_calls: int = 5,
+                 failure_rate: float = 0.5,
+                 slow_call_seconds: float = 20.0,
+                 slow_call_rate: float = 0.8,
+                 open_seconds: float = 30.0,
+                 half_open_probes: int = 1,
+                 name: str = "llm"):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.name = name
+
+        self.state = CLOSED
+        self._outcomes: deque = deque(maxlen=window)  # (failed, slow)
+        self._opened_at = 0.0
+        self._probes = 0
+        self._epoch = 0
+
+        self.calls_rejected = 0
+        self.times_opened = 0
+        self.last_trip_reason: Optional[str] = None
+
+    def _transition(self, state: str, reason: str = ""):
+        if state == self.state:
+            return
+        logger.warning(f"Circuit '{self.name}' {self.state} -> {state}{f' ({reason})' if reason else ''}")
+        self.state = state
+        self._epoch += 1
+        self._probes = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self.times_opened += 1
+            self.last_trip_reason = reason or None
+        elif state == CLOSED:
+            self._outcomes.clear()
+
+    def _admit(self) -> Optional[int]:
+        """Epoch of the half-open probe taken, None for an ordinary call; raises when rejected"""
+        if self.state == OPEN:
+            waited = time.monotonic() - self._opened_at
+            if waited < self.open_seconds:
+                self.calls_rejected += 1
+                raise CircuitOpenError(self.open_seconds - waited)
+            self._transition(HALF_OPEN, "cool-down elapsed")
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_probes:
+                self.calls_rejected += 1
+                raise CircuitOpenError(0.0)
+            self._probes += 1
+            return self._epoch
+        return None
+
+    @contextmanager
+    def call(self):
+        """with breaker.call(): ... - raises CircuitOpenError instead of entering when rejected"""
+        probe_epoch = self._admit()
+        try:
+            yield
+        finally:
+            if probe_epoch is not None and probe_epoch == self._epoch and self._probes > 0:
+                self._probes -= 1
+
+    @property
+    def allows_extra_load(self) -> bool:
+        """Whether optional extra calls (hedges) are welcome: only while fully closed"""
+        return self.state == CLOSED
+
+    def record_success(self, seconds: float):
+        slow = seconds >= self.slow_call_seconds
+        if self.state == HALF_OPEN:
+            if slow:
+                self._transition(OPEN, f"probe took {seconds:.1f}s")
+            else:
+                self._transition(CLOSED, "probe succeeded")
+            return
+        if self.state == CLOSED:
+            self._outcomes.append((False, slow))
+            self._evaluate()
+
+    def record_failure(self, seconds: float = 0.0):
+        if self.state == HALF_OPEN:
+            self._transition(OPEN, "probe failed")
+            return
+        if self.state == CLOSED:
+            self._outcomes.append((True, seconds >= self.slow_call_seconds))
+            self._evaluate()
+
+    def _evaluate(self):
+        calls = len(self._outcomes)
+        if calls < self.min_calls:
+            return
+        failures = sum(1 for failed, _ in self._outcomes if failed)
+        slow = sum(1 for _, is_slow in self._outcomes if is_slow)
+        if failures / calls >= self.failure_rate:
+            self._transition(OPEN, f"{failures}/{calls} recent calls failed")
+        elif slow / calls >= self.slow_call_rate:
+            self._transition(OPEN, f"{slow}/{calls} recent calls slower than {self.slow_call_seconds:.0f}s")
+
+    def stats(self) -> Dict[str, Any]:
+        calls = len(self._outcomes)
+        return {
+            "state": self.state,
+            "recent_calls": calls,
+            "recent_failure_rate": round(sum(1 for failed, _ in self._outcomes if failed) / calls, 3) if calls else 0.0,
+            "recent_slow_rate": round(sum(1 for _, slow in self._outcomes if slow) / calls, 3) if calls else 0.0,
+            "times_opened": self.times_opened,
+            "calls_rejected": self.calls_rejected,
+            "last_trip_reason": self.last_trip_reason,
+        }
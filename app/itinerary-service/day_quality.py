@@ -0,0 +1,56 @@
+import re
+from typing import Any, Dict, List
+
+# Titles produced by the smart-extraction padding and the fallback template, or
+# schema text echoed back from the prompt instead of a real place
+_PLACEHOLDER_TITLE_RE = re.compile(
+    r"^(local activity in |local breakfast caf[eé] in |main attraction in |traditional restaurant in |"
+    r"cultural activity in |dinner restaurant in |real [a-z/ ]+name$)",
+    re.IGNORECASE,
+)
+_PLACEHOLDER_ADDRESS_RE = re.compile(r"(, nearby$|^full street address)", re.IGNORECASE)
+_PLACEHOLDER_DISTRICT_RE = re.compile(r"^(real .* neighborhood name|same district)$", re.IGNORECASE)
+_SLOT_RE = re.compile(r"^\d{2}:\d{2}$")
+
+MIN_ACTIVITIES = 5
+MIN_ADDRESS_LENGTH = 8
+
+
+def day_issues(day_data: Any) -> List[str]:
+    """What is wrong with one day of an itinerary (empty when it looks usable)"""
+    if not isinstance(day_data, dict):
+        return ["not a day object"]
+
+    issues = []
+    district = str(day_data.get("district") or "").strip()
+    if not district or _PLACEHOLDER_DISTRICT_RE.match(district):
+        issues.append("missing district")
+
+    activities = [(slot, value) for slot, value in day_data.items() if _SLOT_RE.match(slot) and isinstance(value, dict)]
+    if len(activities) < MIN_ACTIVITIES:
+        issues.append(f"{len(activities)}/{MIN_ACTIVITIES} activities")
+
+    titles = []
+    for slot, activity in activities:
+        title = str(activity.get("title") or "").strip()
+        address = str(activity.get("address") or "").strip()
+        if not title or _PLACEHOLDER_TITLE_RE.match(title):
+            issues.append(f"{slot}: placeholder title")
+        if len(address) < MIN_ADDRESS_LENGTH or _PLACEHOLDER_ADDRESS_RE.search(address):
+            issues.append(f"{slot}: missing address")
+        titles.append(title.lower())
+    if len(set(titles)) < len(titles):
+        issues.append("repeated activity")
+    return issues
+
+
+def low_quality_days(itinerary: Dict[str, Any]) -> Dict[str, List[str]]:
+    """{day key: issues} for every "Day N" entry that should be regenerated"""
+    report = {}
+    for day_key, day_data in itinerary.items():
+        if not day_key.startswith("Day "):
+            continue
+        issues = day_issues(day_data)
+        if issues:
+            report[day_key] = issues
+    return report
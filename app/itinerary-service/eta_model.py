@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger("itinerary-service")
+
+# Only generations that actually waited on the LLM say anything about latency
+MODELLED_OUTCOMES = ("generated", "shared")
+
+
+class GenerationTiming:
+    """Measurements for one generation, filled in as its LLM calls complete"""
+
+    def __init__(self, days_count: int, effective_days: int):
+        self.days_count = days_count
+        self.effective_days = effective_days
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_calls = 0
+        self.outcome: Optional[str] = None
+        self._started = time.monotonic()
+
+    def add_call(self, prompt_tokens: int, completion_tokens: int = 0):
+        self.llm_calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+    @property
+    def wall_seconds(self) -> float:
+        return time.monotonic() - self._started
+
+
+class EtaModel:
+    """Online estimate of generation wall time from recorded timings.
+
+    Fits seconds = intercept + per_day * effective_days by least squares over
+    the last `window` generations, weighting each sample by recency (halving
+    every `half_life` samples) so a change in provider latency shows up
+    quickly. The fit is scaled by the `quantile` of recent actual/fitted
+    ratios. Until `min_samples` timings exist the prior line is used.
+    Other processes' timings arrive through refresh() from the table.
+    """
+
+    def __init__(self,
+                 window: int = 500,
+                 half_life: float = 50.0,
+                 min_samples: int = 5,
+                 quantile: float = 0.5,
+                 prior_intercept: float = 8.0,
+                 prior_per_day: float = 2.5):
+        self.window = window
+        self.half_life = half_life
+        self.min_samples = min_samples
+        self.quantile = quantile
+        self.prior_intercept = prior_intercept
+        self.prior_per_day = prior_per_day
+        self.pool = None
+
+        self._samples: deque = deque(maxlen=window)
+        self._fit: Optional[Tuple[float, float, float]] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+        self.recorded = 0
+        self.refreshed_at: Optional[float] = None
+
+    def attach_pool(self, pool):
+        self.pool = pool
+
+    def observe(self, effective_days: float, wall_seconds: float):
+        """Add one finished generation (newest last)"""
+        if effective_days > 0 and wall_seconds > 0:
+            self._samples.append((float(effective_days), float(wall_seconds)))
+            self._fit = None
+
+    def load(self, samples: Iterable[Tuple[float, float]]):
+        """Replace the samples with (effective_days, wall_seconds) pairs, oldest first"""
+        self._samples.clear()
+        for effective_days, wall_seconds in samples:
+            self.observe(effective_days, wall_seconds)
+        self._fit = None
+
+    def _compute_fit(self) -> Tuple[float, float, float]:
+        samples = list(self._samples)
+        if len(samples) < self.min_samples:
+            return self.prior_intercept, self.prior_per_day, 1.0
+
+        total_w = sum_x = sum_y = sum_xx = sum_xy = 0.0
+        newest = len(samples) - 1
+        for index, (x, y) in enumerate(samples):
+            w = 0.5 ** ((newest - index) / self.half_life)
+            total_w += w
+            sum_x += w * x
+            sum_y += w * y
+            sum_xx += w * x * x
+            sum_xy += w * x * y
+
+        mean_x, mean_y = sum_x / total_w, sum_y / total_w
+        variance = sum_xx / total_w - mean_x * mean_x
+        if variance > 1e-9:
+            per_day = (sum_xy / total_w - mean_x * mean_y) / variance
+            intercept = mean_y - per_day * mean_x
+        else:
+            # Every sample has the same length: keep the prior's shape, rescaled
+            scale = mean_y / (self.prior_intercept + self.prior_per_day * mean_x)
+            intercept, per_day = self.prior_intercept * scale, self.prior_per_day * scale
+        if per_day < 0:
+            intercept, per_day = mean_y, 0.0
+        if intercept < 0:
+            intercept, per_day = 0.0, sum_xy / sum_xx
+
+        ratios = sorted(y / max(intercept + per_day * x, 1e-6) for x, y in samples[-100:])
+        ratio = ratios[min(len(ratios) - 1, int(self.quantile * len(ratios)))]
+        return intercept, per_day, ratio
+
+    def expected_seconds(self, effective_days: float) -> float:
+        """Estimated total wall time of a generation"""
+        if self._fit is None:
+            self._fit = self._compute_fit()
+        intercept, per_day, ratio = self._fit
+        return (intercept + per_day * effective_days) * ratio
+
+    def remaining_seconds(self, effective_days: float, elapsed: float, days_completed: int = 0,
+                          days_total: Optional[int] = None) -> int:
+        """ETA in whole seconds, blending the model with streamed-day progress when there is some"""
+        remaining = self.expected_seconds(effective_days) - elapsed
+        if days_completed and days_total and days_completed < days_total and elapsed > 0:
+            by_progress = elapsed * (days_total - days_completed) / days_completed
+            remaining = by_progress if remaining <= 0 else (remaining + by_progress) / 2
+        return max(1, int(math.ceil(remaining)))
+
+    async def record(self, trip_id: int, generation_id: Optional[str], timing: GenerationTiming):
+        """Store a finished generation's timing and learn from it"""
+        wall_seconds = timing.wall_seconds
+        if timing.outcome in MODELLED_OUTCOMES:
+            self.observe(timing.effective_days, wall_seconds)
+        self.recorded += 1
+        if self.pool is None:
+            return
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """INSERT INTO generation_timings (trip_id, generation_id, days_count, effective_days, prompt_tokens,
+                                                   completion_tokens, llm_calls, wall_seconds, outcome)
+                   VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)""",
+                trip_id, generation_id, timing.days_count, timing.effective_days, timing.prompt_tokens,
+                timing.completion_tokens, timing.llm_calls, wall_seconds, timing.outcome or "unknown"
+            )
+
+    async def refresh(self):
+        """Reload the newest `window` modelled timings from every process"""
+        if self.pool is None:
+            return
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                """SELECT effective_days, wall_seconds FROM generation_timings
+                   WHERE outcome = ANY($1::text[])
+                   ORDER BY created_at DESC, id DESC
+                   LIMIT $2""",
+                list(MODELLED_OUTCOMES), self.window
+            )
+        self.load((row["effective_days"], row["wall_seconds"]) for row in reversed(rows))
+        self.refreshed_at = time.time()
+
+    async def _refresh_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Failed to refresh ETA model: {e}")
+
+    async def start(self, interval: float = 60.0):
+        """Load the model now and keep refreshing it every `interval` seconds"""
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"Failed to load ETA model: {e}")
+        if self._refresh_task is None and interval > 0:
+            self._refresh_task = asyncio.create_task(self._refresh_loop(interval))
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        if self._fit is None:
+            self._fit = self._compute_fit()
+        intercept, per_day, ratio = self._fit
+        return {
+            "samples": len(self._samples),
+            "using_prior": len(self._samples) < self.min_samples,
+            "intercept_seconds": round(intercept, 2),
+            "seconds_per_day": round(per_day, 2),
+            "quantile_ratio": round(ratio, 3),
+            "recorded": self.recorded,
+            "refreshed_at": self.refreshed_at,
+        }
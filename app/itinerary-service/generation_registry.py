@@ -0,0 +1,167 @@
+import asyncio
+import json
+import logging
+from typing import Any, Awaitable, Dict, Optional
+
+import asyncpg
+
+logger = logging.getLogger("itinerary-service")
+
+CANCEL_CHANNEL = "generation_cancel"
+
+
+class GenerationCancelled(Exception):
+    """The generation was cancelled because its trip was cleared or deleted"""
+
+    def __init__(self, trip_id: int, generation_id: str):
+        super().__init__(f"generation {generation_id} for trip {trip_id} was cancelled")
+        self.trip_id = trip_id
+        self.generation_id = generation_id
+
+
+class _Running:
+    __slots__ = ("trip_id", "task", "cancelled")
+
+    def __init__(self, trip_id: int, task: asyncio.Task):
+        self.trip_id = trip_id
+        self.task = task
+        self.cancelled = False
+
+
+class GenerationRegistry:
+    """Running generations by generation_id, so clearing or deleting a trip stops its work.
+
+    Each generation runs in its own task; cancelling it unwinds every await
+    inside, which closes the in-flight LLM HTTP request rather than letting
+    it finish. Cancellations are published on the generation_cancel channel
+    (see notify_cancel) and every process with a LISTEN connection applies
+    them, so a clear handled by one API process stops a worker elsewhere.
+    """
+
+    def __init__(self, dsn: Optional[str] = None, reconnect_delay: float = 1.0, reconnect_max: float = 30.0):
+        self.dsn = dsn
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max = reconnect_max
+
+        self._running: Dict[str, _Running] = {}
+        self._conn: Optional[asyncpg.Connection] = None
+        self._supervisor: Optional[asyncio.Task] = None
+        self._lost = asyncio.Event()
+
+        self.generations_cancelled = 0
+        self.notifications_received = 0
+
+    async def run(self, trip_id: int, generation_id: str, coro: Awaitable[Any]) -> Any:
+        """Await coro as a cancellable generation; raises GenerationCancelled if it was cancelled"""
+        task = asyncio.ensure_future(coro)
+        entry = _Running(trip_id, task)
+        self._running[generation_id] = entry
+        try:
+            return await task
+        except asyncio.CancelledError:
+            # Our own cancellation (shutdown) propagates; a cancelled generation doesn't
+            if not entry.cancelled or asyncio.current_task().cancelling():
+                raise
+            raise GenerationCancelled(trip_id, generation_id) from None
+        finally:
+            if self._running.get(generation_id) is entry:
+                del self._running[generation_id]
+
+    def cancel(self, trip_id: Optional[int] = None, generation_id: Optional[str] = None) -> int:
+        """Cancel running generations matching the trip and/or generation (both None: all); returns how many"""
+        cancelled = 0
+        for running_id, entry in list(self._running.items()):
+            if trip_id is not None and entry.trip_id != trip_id:
+                continue
+            if generation_id is not None and running_id != generation_id:
+                continue
+            if entry.cancelled or entry.task.done():
+                continue
+            entry.cancelled = True
+            entry.task.cancel()
+            cancelled += 1
+            logger.info(f"Cancelled generation {running_id} for trip {entry.trip_id}")
+        self.generations_cancelled += cancelled
+        return cancelled
+
+    def is_running(self, generation_id: str) -> bool:
+        return generation_id in self._running
+
+    @property
+    def is_listening(self) -> bool:
+        return self._conn is not None and not self._conn.is_closed()
+
+    async def _connect(self):
+        conn = await asyncpg.connect(self.dsn)
+        conn.add_termination_listener(lambda _conn: self._lost.set())
+        await conn.add_listener(CANCEL_CHANNEL, self._on_notify)
+        self._conn = conn
+        self._lost.clear()
+        logger.info(f"Listening for '{CANCEL_CHANNEL}' notifications")
+
+    async def _supervise(self):
+        delay = self.reconnect_delay
+        while True:
+            await self._lost.wait()
+            self._conn = None
+            logger.warning("Cancel LISTEN connection lost, reconnecting")
+            while True:
+                try:
+                    await self._connect()
+                    break
+                except Exception as e:
+                    logger.error(f"Failed to re-establish cancel LISTEN connection: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(self.reconnect_max, delay * 2)
+            delay = self.reconnect_delay
+
+    async def start(self):
+        """Open the LISTEN connection (retried in the background if it fails)"""
+        if self._supervisor is not None:
+            return
+        try:
+            await self._connect()
+        except Exception as e:
+            logger.error(f"Failed to open cancel LISTEN connection: {e}")
+            self._lost.set()
+        self._supervisor = asyncio.create_task(self._supervise())
+
+    async def stop(self):
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            await asyncio.gather(self._supervisor, return_exceptions=True)
+            self._supervisor = None
+        if self._conn is not None:
+            try:
+                await self._conn.close()
+            except Exception as e:
+                logger.error(f"Error closing cancel LISTEN connection: {e}")
+            self._conn = None
+
+    def _on_notify(self, connection, pid, channel, payload: str):
+        try:
+            event = json.loads(payload)
+            trip_id = event.get("trip_id")
+            generation_id = event.get("generation_id")
+            trip_id = int(trip_id) if trip_id is not None else None
+        except (ValueError, AttributeError, TypeError) as e:
+            logger.error(f"Ignoring malformed cancel notification {payload!r}: {e}")
+            return
+        self.notifications_received += 1
+        self.cancel(trip_id, generation_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "listening": self.is_listening,
+            "running": len(self._running),
+            "generations_cancelled": self.generations_cancelled,
+            "notifications_received": self.notifications_received,
+        }
+
+
+async def notify_cancel(conn, trip_id: Optional[int] = None, generation_id: Optional[str] = None):
+    """Publish a cancellation on conn; inside a transaction it is delivered only on commit"""
+    await conn.execute(
+        "SELECT pg_notify($1, json_build_object('trip_id', $2::int, 'generation_id', $3::text)::text)",
+        CANCEL_CHANNEL, trip_id, generation_id
+    )
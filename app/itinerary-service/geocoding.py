@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("itinerary-service")
+
+MIN_ADDRESS_LENGTH = 5
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def iter_addressed_activities(itinerary: Dict[str, Any]):
+    """Every activity dict with a usable "address", across all days"""
+    for day_data in itinerary.values():
+        if not isinstance(day_data, dict):
+            continue
+        for activity in day_data.values():
+            if isinstance(activity, dict):
+                address = activity.get("address")
+                if isinstance(address, str) and len(address.strip()) >= MIN_ADDRESS_LENGTH:
+                    yield activity
+
+
+class ActivityGeocoder:
+    """Post-generation stage that stores lat/lng in every activity with an address.
+
+    Addresses are deduplicated across the whole itinerary and checked against
+    an in-process LRU first; the rest go to the map service in batches of
+    `batch_size` (POST /geocode/batch), which has its own shared cache in
+    front of Nominatim. The stage has a total time budget of `timeout`
+    seconds and never fails a generation: unresolved activities are simply
+    left without coordinates for the frontend to look up.
+    """
+
+    def __init__(self, base_url: str, client, max_entries: int = 5000, batch_size: int = 50, timeout: float = 20.0):
+        self.base_url = base_url.rstrip("/")
+        self.client = client
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self.timeout = timeout
+
+        self._cache: "OrderedDict[Tuple[str, str], Optional[Tuple[float, float]]]" = OrderedDict()
+
+        self.itineraries = 0
+        self.activities_geocoded = 0
+        self.cache_hits = 0
+        self.requested = 0
+        self.not_found = 0
+        self.errors = 0
+
+    def _cache_put(self, key: Tuple[str, str], coords: Optional[Tuple[float, float]]):
+        self._cache[key] = coords
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def _fetch(self, addresses: List[str], destination: str, budget: float) -> Dict[str, Optional[Tuple[float, float]]]:
+        response = await self.client.post(f"{self.base_url}/geocode/batch",
+                                          json={"addresses": addresses, "near": destination},
+                                          timeout=budget)
+        response.raise_for_status()
+        found = {}
+        for result in response.json()["results"]:
+            lat, lng = result.get("lat"), result.get("lng")
+            found[result["address"]] = (round(lat, 6), round(lng, 6)) if lat is not None and lng is not None else None
+        return found
+
+    async def annotate(self, itinerary: Dict[str, Any], destination: str) -> int:
+        """Add "lat"/"lng" to the itinerary's activities in place; returns how many got coordinates"""
+        activities = [activity for activity in iter_addressed_activities(itinerary)
+                      if activity.get("lat") is None or activity.get("lng") is None]
+        if not activities:
+            return 0
+        self.itineraries += 1
+        destination_key = _normalize(destination or "")
+
+        coords: Dict[str, Optional[Tuple[float, float]]] = {}
+        missing: Dict[str, str] = {}  # normalized address -> address as written
+        for activity in activities:
+            key = _normalize(activity["address"])
+            if key in coords or key in missing:
+                continue
+            cache_key = (key, destination_key)
+            if cache_key in self._cache:
+                self._cache.move_to_end(cache_key)
+                coords[key] = self._cache[cache_key]
+                self.cache_hits += 1
+            else:
+                missing[key] = activity["address"]
+
+        deadline = time.monotonic() + self.timeout
+        pending = list(missing.items())
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            budget = deadline - time.monotonic()
+            if budget <= 0:
+                logger.warning(f"Geocoding budget spent, {len(pending) - start} addresses left for the frontend")
+                break
+            self.requested += len(batch)
+            try:
+                found = await self._fetch([address for _, address in batch], destination, budget)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Batch geocoding of {len(batch)} addresses failed: {e}")
+                break
+            for key, address in batch:
+                if address not in found:
+                    continue
+                coords[key] = found[address]
+                self._cache_put((key, destination_key), found[address])
+                if found[address] is None:
+                    self.not_found += 1
+
+        geocoded = 0
+        for activity in activities:
+            point = coords.get(_normalize(activity["address"]))
+            if point is not None:
+                activity["lat"], activity["lng"] = point
+                geocoded += 1
+        self.activities_geocoded += geocoded
+        logger.info(f"Geocoded {geocoded}/{len(activities)} activities "
+                    f"({len(missing)} addresses sent to the map service)")
+        return geocoded
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "itineraries": self.itineraries,
+            "activities_geocoded": self.activities_geocoded,
+            "cached_addresses": len(self._cache),
+            "cache_hits": self.cache_hits,
+            "addresses_requested": self.requested,
+            "not_found": self.not_found,
+            "errors": self.errors,
+        }
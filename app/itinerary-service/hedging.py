@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger("itinerary-service")
+
+
+class HedgePolicy:
+    """When to send a backup request, from recent latencies.
+
+    The hedge delay is the `quantile` of the last `window` latencies of the
+    same kind (time to first streamed token, or whole call), never below
+    `min_delay`; `default_delay` is used until `min_samples` exist. At most
+    `max_ratio` of calls may be hedged, so a slow provider can't make us
+    double our own load.
+    """
+
+    def __init__(self,
+                 quantile: float = 0.95,
+                 window: int = 200,
+                 min_samples: int = 20,
+                 default_delay: float = 10.0,
+                 min_delay: float = 0.5,
+                 max_ratio: float = 0.1):
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+        self._latencies: Dict[str, deque] = {}
+        self._window = window
+
+        self.calls = 0
+        self.hedges_sent = 0
+        self.hedges_won = 0
+        self.hedges_denied = 0
+
+    def observe(self, kind: str, seconds: float):
+        self._latencies.setdefault(kind, deque(maxlen=self._window)).append(seconds)
+
+    def delay(self, kind: str) -> float:
+        samples = self._latencies.get(kind)
+        if not samples or len(samples) < self.min_samples:
+            return self.default_delay
+        ordered = sorted(samples)
+        return max(self.min_delay, ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))])
+
+    def try_hedge(self) -> bool:
+        """Take a hedge from the budget if there is one"""
+        if self.hedges_sent + 1 > self.max_ratio * max(self.calls, 1):
+            self.hedges_denied += 1
+            return False
+        self.hedges_sent += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "hedges_sent": self.hedges_sent,
+            "hedges_won": self.hedges_won,
+            "hedges_denied": self.hedges_denied,
+            "delays": {kind: round(self.delay(kind), 3) for kind in self._latencies},
+        }
+
+
+async def run_hedged(attempt: Callable[[int, Callable[[], bool]], Awaitable[Any]],
+                     delay: float,
+                     may_hedge: Callable[[], bool]) -> Optional[Any]:
+    """Run attempt(0, claim), and attempt(1, claim) too if the first hasn't answered after `delay`
+
+    The first non-None result wins and the other attempt is cancelled. A
+    streaming attempt calls claim() when its first output arrives: the
+    first caller gets True and the other attempt is cancelled right away,
+    so only one of them ever forwards output. Returns (result, winner index);
+    an exception is re-raised only if no attempt produced a result.
+    """
+    tasks: Dict[int, asyncio.Task] = {}
+    winner: Optional[int] = None
+
+    def claimer(index: int) -> Callable[[], bool]:
+        def claim() -> bool:
+            nonlocal winner
+            if winner is None:
+                winner = index
+                for other, task in tasks.items():
+                    if other != index:
+                        task.cancel()
+            return winner == index
+        return claim
+
+    tasks[0] = asyncio.create_task(attempt(0, claimer(0)))
+    try:
+        done, _ = await asyncio.wait({tasks[0]}, timeout=delay)
+        if not done and winner is None and may_hedge():
+            logger.info(f"No answer after {delay:.1f}s, sending hedged LLM request")
+            tasks[1] = asyncio.create_task(attempt(1, claimer(1)))
+
+        error: Optional[BaseException] = None
+        pending = set(tasks.values())
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.cancelled():
+                    continue
+                if task.exception() is not None:
+                    error = error or task.exception()
+                    continue
+                index = next(i for i, t in tasks.items() if t is task)
+                if task.result() is not None and winner in (None, index):
+                    return task.result(), index
+        if error is not None:
+            raise error
+        return None, None
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger("itinerary-service")
+
+
+def _env_int(name: str, default: Optional[int]) -> Optional[int]:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return int(value)
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return float(value)
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+class _RequestTrace:
+    """httpcore trace hook for one request: feeds the pool's counters and remembers if it connected"""
+
+    def __init__(self, client: "PooledHTTPClient"):
+        self.client = client
+        self.connected = False
+
+    async def __call__(self, event_name: str, info: Dict[str, Any]):
+        # httpcore only emits connect/TLS events when a brand-new connection
+        # is opened, so a request that saw none of them reused one.
+        if event_name == "connection.connect_tcp.complete":
+            self.client.connections_opened += 1
+            self.connected = True
+        elif event_name == "connection.start_tls.complete":
+            self.client.tls_handshakes += 1
+
+
+class PooledHTTPClient:
+    """App-lifetime httpx client with keep-alive pooling and reuse counters.
+
+    One instance is created at service startup and shared by every outbound
+    call, so connections (and their TLS sessions) are reused across jobs
+    instead of being re-established for each generation.
+    """
+
+    def __init__(self,
+                 max_connections: int = 20,
+                 max_keepalive_connections: int = 10,
+                 keepalive_expiry: float = 30.0,
+                 max_connections_per_host: Optional[int] = None,
+                 http2: bool = False,
+                 timeout: float = 45.0):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.max_connections_per_host = max_connections_per_host
+        self.http2 = http2
+        self.timeout = timeout
+        # What the running pool negotiates: http2 only if the 'h2' package is installed
+        self.http2_enabled = False
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+
+        self.requests_total = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+        self.connections_reused = 0
+        self.errors_total = 0
+
+    @classmethod
+    def from_env(cls, prefix: str = "GROQ_HTTP") -> "PooledHTTPClient":
+        """Build a client from <prefix>_* environment variables"""
+        return cls(
+            max_connections=_env_int(f"{prefix}_MAX_CONNECTIONS", 20),
+            max_keepalive_connections=_env_int(f"{prefix}_MAX_KEEPALIVE", 10),
+            keepalive_expiry=_env_float(f"{prefix}_KEEPALIVE_EXPIRY", 30.0),
+            max_connections_per_host=_env_int(f"{prefix}_MAX_PER_HOST", None),
+            http2=_env_bool(f"{prefix}_HTTP2", False),
+            timeout=_env_float(f"{prefix}_TIMEOUT", 45.0),
+        )
+
+    async def start(self):
+        """Open the underlying connection pool"""
+        if self._client is not None:
+            return
+
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("HTTP/2 requested but the 'h2' package is not installed - falling back to HTTP/1.1")
+                http2 = False
+        self.http2_enabled = http2
+
+        self._client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            timeout=self.timeout,
+        )
+        logger.info(
+            f"HTTP pool started (max_connections={self.max_connections}, "
+            f"max_keepalive={self.max_keepalive_connections}, per_host={self.max_connections_per_host}, http2={http2})"
+        )
+
+    async def close(self):
+        """Close the pool and every idle connection it holds"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            logger.info("HTTP pool closed")
+
+    @property
+    def is_started(self) -> bool:
+        return self._client is not None
+
+    def _host_slot(self, url: str) -> Optional[asyncio.Semaphore]:
+        if not self.max_connections_per_host:
+            return None
+        host = urlsplit(url).netloc
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = asyncio.Semaphore(self.max_connections_per_host)
+            self._host_slots[host] = slot
+        return slot
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request over the shared pool"""
+        if self._client is None:
+            await self.start()
+
+        trace = _RequestTrace(self)
+        extensions = dict(kwargs.pop("extensions", None) or {})
+        extensions["trace"] = trace
+
+        slot = self._host_slot(url)
+        self.requests_total += 1
+        try:
+            if slot is None:
+                response = await self._client.request(method, url, extensions=extensions, **kwargs)
+            else:
+                async with slot:
+                    response = await self._client.request(method, url, extensions=extensions, **kwargs)
+        except Exception:
+            self.errors_total += 1
+            raise
+        if not trace.connected:
+            self.connections_reused += 1
+        return response
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs):
+        """Send a request over the shared pool and yield the unread response"""
+        if self._client is None:
+            await self.start()
+
+        trace = _RequestTrace(self)
+        extensions = dict(kwargs.pop("extensions", None) or {})
+        extensions["trace"] = trace
+
+        slot = self._host_slot(url)
+        self.requests_total += 1
+        try:
+            if slot is not None:
+                await slot.acquire()
+            try:
+                async with self._client.stream(method, url, extensions=extensions, **kwargs) as response:
+                    yield response
+            finally:
+                if slot is not None:
+                    slot.release()
+        except Exception:
+            self.errors_total += 1
+            raise
+        if not trace.connected:
+            self.connections_reused += 1
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """Connection reuse counters for the stats endpoint
+
+        connections_reused counts requests that got a response over an
+        already open connection; failed requests are only in errors_total.
+        """
+        succeeded = self.requests_total - self.errors_total
+        return {
+            "started": self.is_started,
+            "http2": self.http2_enabled,
+            "max_connections": self.max_connections,
+            "max_keepalive_connections": self.max_keepalive_connections,
+            "max_connections_per_host": self.max_connections_per_host,
+            "requests_total": self.requests_total,
+            "connections_opened": self.connections_opened,
+            "tls_handshakes": self.tls_handshakes,
+            "connections_reused": self.connections_reused,
+            "reuse_ratio": round(self.connections_reused / succeeded, 4) if succeeded > 0 else 0.0,
+            "errors_total": self.errors_total,
+        }
@@ -0,0 +1,37 @@
+import hashlib
+from typing import Any, List, Optional, Tuple
+
+import orjson
+
+# Itineraries only ever have string keys, but a stray int key must not fail a save
+_DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def dumps(content: Any) -> str:
+    """JSON text for the trips.itinerary JSONB parameter"""
+    return orjson.dumps(content, option=_DUMPS_OPTIONS).decode("utf-8")
+
+
+def serialize_itinerary(content: Any) -> Tuple[bytes, str]:
+    """The exact GET /itinerary response body and its content hash"""
+    body = orjson.dumps({"itinerary": content}, option=_DUMPS_OPTIONS)
+    return body, hashlib.sha256(body).hexdigest()
+
+
+def make_etag(content_hash: str) -> str:
+    return f'"{content_hash}"'
+
+
+def parse_if_none_match(header: Optional[str]) -> List[str]:
+    """Content hashes named by an If-None-Match header (weak validators included)"""
+    if not header:
+        return []
+    hashes = []
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        if tag and tag != "*":
+            hashes.append(tag)
+    return hashes
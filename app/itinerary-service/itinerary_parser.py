@@ -0,0 +1,302 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+_DAY_KEY_RE = re.compile(r"^\s*(?:day)?\s*(\d+)\s*$", re.IGNORECASE)
+_TRAILING_COMMA_RE = re.compile(r",\s*+[}\]]")
+_DECODER = json.JSONDecoder()
+
+
+def normalize_day_key(key: str) -> str:
+    """Map "Day1", "day 1" and "1" onto the canonical "Day 1" form"""
+    match = _DAY_KEY_RE.match(key)
+    if match:
+        return f"Day {int(match.group(1))}"
+    return key
+
+
+def _drop_trailing_commas(text: str) -> Optional[str]:
+    """text (starting outside a string) without its trailing commas; None if it has none or one may be in a string
+
+    A comma is inside a string when an odd number of unescaped quotes
+    precede it. The quotes are counted segment by segment with str.count,
+    so this costs far less than a character scan; text with escaped
+    backslashes is left to the scanner.
+    """
+    positions = [match.start() for match in _TRAILING_COMMA_RE.finditer(text)]
+    if not positions or "\\\\" in text:
+        return None
+    pieces = []
+    last = 0
+    quotes = 0
+    for pos in positions:
+        quotes += text.count('"', last, pos) - text.count('\\"', last, pos)
+        if quotes % 2:
+            return None
+        pieces.append(text[last:pos])
+        last = pos + 1
+    pieces.append(text[last:])
+    return "".join(pieces)
+
+
+def _loads_day(text: str) -> Optional[Dict[str, Any]]:
+    try:
+        value = json.loads(_drop_trailing_commas(text) or text)
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+class IncrementalDayParser:
+    """Emits each top-level "Day N" object of a streamed itinerary once it closes.
+
+    Text is fed in arbitrary chunks (e.g. SSE deltas). The parser tracks
+    string/escape state and nesting depth across chunks, so every character
+    is looked at once; anything before the first "{" (code fences, prose)
+    is ignored.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = -1
+        self._key: Optional[str] = None
+        self._value_start = -1
+        self.days: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    def feed(self, chunk: str) -> List[Tuple[str, Dict[str, Any]]]:
+        """Consume a chunk and return the days completed by it"""
+        if not chunk:
+            return []
+        self._text += chunk
+        text = self._text
+        completed = []
+
+        for i in range(self._pos, len(text)):
+            char = text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._key = text[self._string_start + 1:i]
+                continue
+
+            if char == '"':
+                if self._depth >= 1:
+                    self._in_string = True
+                    self._string_start = i
+            elif char == "{" or char == "[":
+                self._depth += 1
+                if self._depth == 2 and char == "{":
+                    self._value_start = i
+            elif char == "}" or char == "]":
+                if self._depth == 2 and char == "}" and self._value_start >= 0:
+                    day = _loads_day(text[self._value_start:i + 1])
+                    if day is not None and self._key is not None:
+                        day_key = normalize_day_key(self._key)
+                        self.days[day_key] = day
+                        completed.append((day_key, day))
+                    self._value_start = -1
+                    self._key = None
+                if self._depth > 0:
+                    self._depth -= 1
+
+        self._pos = len(text)
+        return completed
+
+
+def complete_days(text: str) -> Dict[str, Dict[str, Any]]:
+    """The "Day N" objects of an answer that closed, in the order written; a cut-off tail is dropped"""
+    parser = IncrementalDayParser()
+    parser.feed(text)
+    return parser.days
+
+
+# One match per bracket outside strings: the leading part skips plain text
+# and complete strings inside the regex engine, then the bracket (or a lone
+# quote opening an unterminated string, or the end of the text) is captured.
+# The scan stays linear and the Python loop only runs once per bracket.
+_EVENT_RE = re.compile(r'[^"{}\[\]]*+(?:"[^"\\]*+(?:\\.[^"\\]*+)*+"[^"{}\[\]]*+)*+([{}\[\]"]|\Z)', re.S)
+_KEY_TAIL_RE = re.compile(r'\s*:\s*')
+_WHITESPACE = " \t\r\n"
+
+
+def _normalize_day_keys(result: Any) -> Any:
+    if isinstance(result, dict) and not all(key.startswith("Day ") for key in result):
+        return {normalize_day_key(key): value for key, value in result.items()}
+    return result
+
+
+def _strip_fences(text: str) -> str:
+    if "```json" in text:
+        return text.split("```json", 1)[1].split("```", 1)[0].strip()
+    if "```" in text and text.count("```") >= 2:
+        return text.split("```", 1)[1].split("```", 1)[0].strip()
+    return text
+
+
+def repair_itinerary_json(text: str) -> Tuple[Optional[str], bool]:
+    """Rewrite an almost-JSON LLM answer into loadable JSON in one scan.
+
+    Strips code fences and any prose around the top-level object, renames
+    top-level day keys ("1", "Day1") to "Day N", drops trailing commas, and
+    if the object is cut off, keeps everything up to the last complete
+    top-level entry. Returns (json_text, truncated) or (None, False).
+    """
+    text = _strip_fences(text.strip())
+    start = text.find("{")
+    if start < 0:
+        return None, False
+
+    pieces: List[str] = []
+    last = start
+    depth = 0
+    checkpoint = None
+    end = -1
+
+    for match in _EVENT_RE.finditer(text, start):
+        char = match.group(1)
+        pos = match.start(1)
+
+        if char == "{" or char == "[":
+            if depth == 1:
+                # The key of a top-level entry sits right before its value
+                key_end = text.rfind('"', start, pos)
+                key_start = text.rfind('"', start, key_end)
+                if key_start >= 0 and _KEY_TAIL_RE.fullmatch(text, key_end + 1, pos):
+                    key = text[key_start + 1:key_end]
+                    day_match = _DAY_KEY_RE.match(key)
+                    if day_match and key != f"Day {int(day_match.group(1))}":
+                        pieces.append(text[last:key_start + 1])
+                        pieces.append(f"Day {int(day_match.group(1))}")
+                        last = key_end
+            depth += 1
+        elif char == "}" or char == "]":
+            # A comma followed only by whitespace before a bracket is trailing;
+            # it can't be inside a string since the bracket itself is not
+            before = pos - 1
+            while before > last and text[before] in _WHITESPACE:
+                before -= 1
+            if text[before] == "," and before >= last:
+                pieces.append(text[last:before])
+                last = before + 1
+            depth -= 1
+            if depth == 1 and char == "}":
+                checkpoint = (len(pieces), last, pos + 1)
+            elif depth == 0:
+                end = pos + 1
+                break
+        else:
+            break  # end of text or an unterminated string: the answer was cut off
+
+    if end >= 0:
+        pieces.append(text[last:end])
+        return "".join(pieces), False
+
+    if checkpoint is None:
+        return None, False
+    count, last, cut = checkpoint
+    return "".join(pieces[:count]) + text[last:cut] + "}", True
+
+
+def parse_itinerary_response(llm_response: str) -> Tuple[Optional[Any], Optional[str]]:
+    """Parse an LLM itinerary answer; returns (result, strategy).
+
+    strategy is "direct" (valid JSON), "repaired" (fences/keys/commas fixed),
+    "truncated" (cut back to the last complete day), "extracted" (fields
+    pulled out of unparseable text) or None when nothing could be recovered.
+    """
+    stripped = llm_response.strip()
+    try:
+        return _normalize_day_keys(json.loads(stripped)), "direct"
+    except ValueError:
+        pass
+
+    # Most failures are only wrapped (fences, prose): the C decoder reads the
+    # object and stops at its closing brace without touching what follows.
+    # Trailing commas are dropped the same way when none of them is inside a string.
+    body = _strip_fences(stripped)
+    start = body.find("{")
+    if start >= 0:
+        body = body[start:]
+        for candidate in (_drop_trailing_commas(body), body):
+            if candidate is None:
+                continue
+            try:
+                result, _ = _DECODER.raw_decode(candidate)
+            except ValueError:
+                continue
+            return _normalize_day_keys(result), "repaired"
+
+    repaired, truncated = repair_itinerary_json(llm_response)
+    if repaired is not None:
+        try:
+            return json.loads(repaired), "truncated" if truncated else "repaired"
+        except ValueError:
+            pass
+
+    extracted = extract_itinerary_fields(llm_response)
+    if extracted:
+        return extracted, "extracted"
+    return None, None
+
+
+_DISTRICT_RE = re.compile(r'"district":\s*"([^"]*)"')
+_TITLE_RE = re.compile(r'"title":\s*"([^"]*)"')
+_ADDRESS_RE = re.compile(r'"address":\s*"([^"]*)"')
+_DATE_FIELD_RE = re.compile(r'"date":\s*"([^"]*)"')
+_DAY_INDICATOR_RE = re.compile(r'(?:"Day (\d+)"|"(\d+)"|Day (\d+))')
+
+
+def extract_itinerary_fields(llm_response: str) -> Optional[Dict[str, Any]]:
+    """Smart content extraction: rebuild days from the fields of a malformed response"""
+    district_matches = _DISTRICT_RE.findall(llm_response)
+    title_matches = _TITLE_RE.findall(llm_response)
+    address_matches = _ADDRESS_RE.findall(llm_response)
+    date_matches = _DATE_FIELD_RE.findall(llm_response)
+
+    # Flatten day numbers and get unique ones
+    day_numbers = []
+    for match in _DAY_INDICATOR_RE.findall(llm_response):
+        for num in match:
+            if num and num not in day_numbers:
+                day_numbers.append(num)
+
+    if not (district_matches and title_matches and day_numbers):
+        return None
+
+    result = {}
+    for i, day_num in enumerate(day_numbers):
+        district = district_matches[min(i, len(district_matches) - 1)]
+        date = date_matches[min(i, len(date_matches) - 1)] if date_matches else ""
+
+        # 5 activities per day
+        day_titles = title_matches[i * 5:i * 5 + 5]
+        day_addresses = address_matches[i * 5:i * 5 + 5]
+        while len(day_titles) < 5:
+            day_titles.append(f"Local activity in {district}")
+        while len(day_addresses) < 5:
+            day_addresses.append(f"{district}, nearby")
+
+        result[f"Day {day_num}"] = {
+            "date": date,
+            "district": district,
+            "09:00": {"type": "breakfast", "title": day_titles[0], "location": district, "address": day_addresses[0]},
+            "11:00": {"type": "sightseeing", "title": day_titles[1], "location": district, "address": day_addresses[1]},
+            "13:00": {"type": "lunch", "title": day_titles[2], "location": district, "address": day_addresses[2]},
+            "15:30": {"type": "activity", "title": day_titles[3], "location": district, "address": day_addresses[3]},
+            "19:00": {"type": "dinner", "title": day_titles[4], "location": district, "address": day_addresses[4]}
+        }
+    return result
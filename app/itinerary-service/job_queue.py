@@ -0,0 +1,352 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("itinerary-service")
+
+EXPIRED_ERROR = "Worker stopped responding and the job has no attempts left"
+
+
+class GenerationJob:
+    """A claimed row of the generation_jobs table"""
+
+    def __init__(self, row):
+        self.id = row["id"]
+        self.trip_id = row["trip_id"]
+        self.generation_id = str(row["generation_id"])
+        self.payload = json.loads(row["payload"]) if isinstance(row["payload"], str) else row["payload"]
+        self.attempts = row["attempts"]
+        self.max_attempts = row["max_attempts"]
+
+
+class JobQueue:
+    """Durable Postgres-backed queue of itinerary generations.
+
+    Workers claim one job at a time with SELECT ... FOR UPDATE SKIP LOCKED,
+    so any number of workers (in the API process or in `python -m worker`)
+    can share the table. A claimed job is invisible to other workers until
+    its visibility timeout lapses; the owning worker keeps extending it while
+    the handler runs, so a job whose worker died is picked up again.
+    Failures are retried with exponential backoff up to max_attempts.
+    Higher-priority jobs are claimed first; within a priority, oldest first.
+    """
+
+    def __init__(self,
+                 handler: Callable[[GenerationJob], Awaitable[None]],
+                 on_give_up: Optional[Callable[[GenerationJob, str], Awaitable[None]]] = None,
+                 concurrency: int = 2,
+                 max_attempts: int = 3,
+                 visibility_timeout: float = 120.0,
+                 backoff_base: float = 5.0,
+                 backoff_max: float = 300.0,
+                 poll_interval: float = 1.0):
+        self.handler = handler
+        self.on_give_up = on_give_up
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.visibility_timeout = visibility_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.worker_name = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.pool = None
+
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[int, GenerationJob] = {}
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+        self.jobs_claimed = 0
+        self.jobs_succeeded = 0
+        self.jobs_retried = 0
+        self.jobs_failed = 0
+        self.jobs_drained = 0
+        self.jobs_released = 0
+        self.in_flight = 0
+
+    def attach_pool(self, pool):
+        self.pool = pool
+
+    async def enqueue(self, trip_id: int, generation_id: str, payload: Dict[str, Any], priority: int = 0,
+                      conn=None) -> int:
+        """Add a job and wake a local worker
+
+        Pass conn to enqueue inside the caller's transaction (see enqueue_many).
+        """
+        query = """INSERT INTO generation_jobs (trip_id, generation_id, payload, max_attempts, priority)
+                   VALUES ($1, $2, $3, $4, $5)
+                   RETURNING id"""
+        args = (trip_id, generation_id, json.dumps(payload), self.max_attempts, priority)
+        if conn is None:
+            async with self.pool.acquire() as conn:
+                job_id = await conn.fetchval(query, *args)
+        else:
+            job_id = await conn.fetchval(query, *args)
+        self._wakeup.set()
+        logger.info(f"Enqueued generation job {job_id} for trip {trip_id}")
+        return job_id
+
+    async def enqueue_many(self, jobs: List[Tuple[int, str, Dict[str, Any]]], priority: int = 0, conn=None) -> List[int]:
+        """Add (trip_id, generation_id, payload) jobs in one INSERT
+
+        Pass conn to enqueue inside the caller's transaction; workers are
+        woken right away, so commit promptly (unseen rows are just retried
+        on the next poll).
+        """
+        if not jobs:
+            return []
+        trip_ids, generation_ids, payloads = zip(*((t, g, json.dumps(p)) for t, g, p in jobs))
+        query = """INSERT INTO generation_jobs (trip_id, generation_id, payload, max_attempts, priority)
+                   SELECT b.trip_id, b.generation_id, b.payload, $4, $5
+                   FROM UNNEST($1::int[], $2::uuid[], $3::jsonb[]) AS b(trip_id, generation_id, payload)
+                   RETURNING id"""
+        args = (list(trip_ids), list(generation_ids), list(payloads), self.max_attempts, priority)
+        if conn is None:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(query, *args)
+        else:
+            rows = await conn.fetch(query, *args)
+        self._wakeup.set()
+        logger.info(f"Enqueued {len(rows)} generation jobs")
+        return [row["id"] for row in rows]
+
+    async def claim(self) -> Optional[GenerationJob]:
+        """Claim the next runnable job (queued, or running with a lapsed lock and attempts left)
+
+        The same statement fails running jobs whose lock lapsed on their last
+        attempt; they are given up instead of being run again.
+        """
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                """WITH expired AS (
+                       UPDATE generation_jobs
+                       SET status = 'failed', locked_until = NULL, last_error = $3, updated_at = NOW()
+                       WHERE id IN (
+                           SELECT id FROM generation_jobs
+                           WHERE status = 'running' AND locked_until < NOW() AND attempts >= max_attempts
+                           FOR UPDATE SKIP LOCKED
+                       )
+                       RETURNING id, trip_id, generation_id, payload, attempts, max_attempts, FALSE AS claimed
+                   ),
+                   claimed AS (
+                       UPDATE generation_jobs
+                       SET status = 'running', attempts = attempts + 1, locked_by = $2,
+                           locked_until = NOW() + make_interval(secs => $1), updated_at = NOW()
+                       WHERE id = (
+                           SELECT id FROM generation_jobs
+                           WHERE (status = 'queued' AND run_after <= NOW())
+                              OR (status = 'running' AND locked_until < NOW() AND attempts < max_attempts)
+                           ORDER BY priority DESC, run_after, id
+                           FOR UPDATE SKIP LOCKED
+                           LIMIT 1
+                       )
+                       RETURNING id, trip_id, generation_id, payload, attempts, max_attempts, TRUE AS claimed
+                   )
+                   SELECT * FROM expired UNION ALL SELECT * FROM claimed""",
+                float(self.visibility_timeout), self.worker_name, EXPIRED_ERROR
+            )
+        job = None
+        for row in rows:
+            if row["claimed"]:
+                job = GenerationJob(row)
+                self.jobs_claimed += 1
+                continue
+            try:
+                await self._give_up(GenerationJob(row), EXPIRED_ERROR)
+            except Exception as e:
+                logger.error(f"Failed to give up expired job {row['id']}: {e}")
+        return job
+
+    async def _extend_lock(self, job: GenerationJob):
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 3)
+            try:
+                async with self.pool.acquire() as conn:
+                    await conn.execute(
+                        """UPDATE generation_jobs
+                           SET locked_until = NOW() + make_interval(secs => $2), updated_at = NOW()
+                           WHERE id = $1 AND locked_by = $3""",
+                        job.id, float(self.visibility_timeout), self.worker_name
+                    )
+            except Exception as e:
+                logger.error(f"Failed to extend lock on job {job.id}: {e}")
+
+    async def _complete(self, job: GenerationJob):
+        # Rows cancelled while running (trip cleared or deleted) keep their status, and
+        # a job re-claimed by another worker after our lock lapsed is that worker's to record
+        async with self.pool.acquire() as conn:
+            result = await conn.execute(
+                """UPDATE generation_jobs
+                   SET status = 'done', locked_until = NULL, updated_at = NOW()
+                   WHERE id = $1 AND status = 'running' AND locked_by = $2""",
+                job.id, self.worker_name
+            )
+        if result == "UPDATE 0":
+            logger.warning(f"Job {job.id} finished but was cancelled or re-claimed meanwhile, not marking it done")
+            return
+        self.jobs_succeeded += 1
+
+    async def _fail(self, job: GenerationJob, error: str):
+        if job.attempts < job.max_attempts:
+            delay = min(self.backoff_max, self.backoff_base * (2 ** (job.attempts - 1)))
+            delay *= random.uniform(0.8, 1.2)
+            async with self.pool.acquire() as conn:
+                result = await conn.execute(
+                    """UPDATE generation_jobs
+                       SET status = 'queued', locked_until = NULL, locked_by = NULL, last_error = $2,
+                           run_after = NOW() + make_interval(secs => $3), updated_at = NOW()
+                       WHERE id = $1 AND status = 'running' AND locked_by = $4""",
+                    job.id, error, float(delay), self.worker_name
+                )
+            if result == "UPDATE 0":
+                logger.warning(f"Job {job.id} failed but was cancelled or re-claimed meanwhile, not retrying it: {error}")
+                return
+            self.jobs_retried += 1
+            logger.warning(f"Job {job.id} failed (attempt {job.attempts}/{job.max_attempts}), retrying in {delay:.1f}s: {error}")
+            return
+
+        async with self.pool.acquire() as conn:
+            result = await conn.execute(
+                """UPDATE generation_jobs
+                   SET status = 'failed', locked_until = NULL, last_error = $2, updated_at = NOW()
+                   WHERE id = $1 AND status = 'running' AND locked_by = $3""",
+                job.id, error, self.worker_name
+            )
+        if result == "UPDATE 0":
+            logger.warning(f"Job {job.id} failed but was cancelled or re-claimed meanwhile, not giving it up: {error}")
+            return
+        await self._give_up(job, error)
+
+    async def _give_up(self, job: GenerationJob, error: str):
+        # The row is already 'failed'; tell the owner
+        self.jobs_failed += 1
+        logger.error(f"Job {job.id} for trip {job.trip_id} failed permanently: {error}")
+        if self.on_give_up is not None:
+            await self.on_give_up(job, error)
+
+    async def run_job(self, job: GenerationJob):
+        """Run the handler for a claimed job and record the outcome"""
+        self.in_flight += 1
+        self._running[job.id] = job
+        heartbeat = asyncio.create_task(self._extend_lock(job))
+        try:
+            await self.handler(job)
+        except asyncio.CancelledError:
+            # Leave the row 'running': stop() releases it, or it becomes claimable once the lock lapses
+            raise
+        except Exception as e:
+            heartbeat.cancel()
+            await self._fail(job, str(e)[:1000])
+        else:
+            heartbeat.cancel()
+            await self._complete(job)
+        finally:
+            heartbeat.cancel()
+            del self._running[job.id]
+            self.in_flight -= 1
+
+    async def _worker_loop(self, index: int):
+        while not self._stopping:
+            try:
+                job = await self.claim()
+            except Exception as e:
+                logger.error(f"Worker {index} failed to claim a job: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval * random.uniform(0.5, 1.5))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            logger.info(f"Worker {index} running job {job.id} for trip {job.trip_id} (attempt {job.attempts})")
+            try:
+                await self.run_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Worker {index} failed to record job {job.id}: {e}")
+
+    def start(self, concurrency: Optional[int] = None):
+        """Start the worker pool in the running event loop"""
+        if concurrency is not None:
+            self.concurrency = concurrency
+        self._stopping = False
+        for index in range(self.concurrency):
+            self._workers.append(asyncio.create_task(self._worker_loop(index)))
+        if self.concurrency:
+            logger.info(f"Started {self.concurrency} generation workers ({self.worker_name})")
+
+    async def _release(self, jobs: List[GenerationJob]):
+        """Put interrupted jobs straight back in the queue without spending an attempt"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                """UPDATE generation_jobs
+                   SET status = 'queued', attempts = GREATEST(attempts - 1, 0), locked_until = NULL,
+                       locked_by = NULL, run_after = NOW(), last_error = 'interrupted by shutdown', updated_at = NOW()
+                   WHERE id = ANY($1::bigint[]) AND status = 'running' AND locked_by = $2
+                   RETURNING id""",
+                [job.id for job in jobs], self.worker_name
+            )
+        self.jobs_released += len(rows)
+        logger.info(f"Released {len(rows)} interrupted generation jobs back to the queue")
+
+    async def stop(self, drain_timeout: float = 0.0):
+        """Stop the worker pool: no new claims, running jobs get drain_timeout seconds to finish
+
+        Jobs still running after that are interrupted (cancelling their LLM
+        calls) and released back to the queue in one UPDATE, so another
+        worker resumes them right away instead of after the lock lapses.
+        """
+        self._stopping = True
+        self._wakeup.set()
+        if self._running and self._workers and drain_timeout > 0:
+            busy = len(self._running)
+            logger.info(f"Draining {busy} running generation jobs (up to {drain_timeout:.0f}s)")
+            # Idle workers exit on their own; busy ones exit after their current job
+            await asyncio.wait(self._workers, timeout=drain_timeout)
+            self.jobs_drained += max(0, busy - len(self._running))
+
+        interrupted = list(self._running.values())
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if interrupted and self.pool is not None:
+            try:
+                await self._release(interrupted)
+            except Exception as e:
+                logger.error(f"Failed to release interrupted jobs, they resume once their lock lapses: {e}")
+
+    async def stats(self) -> Dict[str, Any]:
+        stats = {
+            "worker": self.worker_name,
+            "workers": len(self._workers),
+            "in_flight": self.in_flight,
+            "jobs_claimed": self.jobs_claimed,
+            "jobs_succeeded": self.jobs_succeeded,
+            "jobs_retried": self.jobs_retried,
+            "jobs_failed": self.jobs_failed,
+            "jobs_drained": self.jobs_drained,
+            "jobs_released": self.jobs_released,
+        }
+        if self.pool is not None:
+            try:
+                async with self.pool.acquire() as conn:
+                    rows = await conn.fetch(
+                        """SELECT status, COUNT(*) AS count FROM generation_jobs
+                           WHERE status IN ('queued', 'running') GROUP BY status"""
+                    )
+                counts = {row["status"]: row["count"] for row in rows}
+                stats["queue_depth"] = counts.get("queued", 0)
+                stats["running"] = counts.get("running", 0)
+            except Exception as e:
+                logger.error(f"Failed to read queue depth: {e}")
+        return stats
@@ -0,0 +1,216 @@
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from rate_limiter import parse_retry_after
+
+logger = logging.getLogger("itinerary-service")
+
+# Every provider below speaks the OpenAI chat completions protocol; they only
+# differ in endpoint, credentials, model and context window
+PROVIDER_PRESETS: Dict[str, Dict[str, Any]] = {
+    "groq": {
+        "base_url": "https://api.groq.com/openai/v1",
+        "model": "llama3-70b-8192",
+        "api_key_env": "GROQ_API_KEY",
+        "context_window": 8192,
+    },
+    "openai": {
+        "base_url": "https://api.openai.com/v1",
+        "model": "gpt-4o-mini",
+        "api_key_env": "OPENAI_API_KEY",
+        "context_window": 128000,
+    },
+    # The bundled deterministic server (python stub_llm.py); no key needed
+    "stub": {
+        "base_url": "http://localhost:8099/v1",
+        "model": "stub-itinerary",
+        "api_key_env": None,
+        "context_window": 8192,
+    },
+}
+
+
+# finish_reason of a stream that broke part way: the text is what arrived before the error
+FINISH_ERROR = "error"
+
+
+class Completion:
+    """Text and accounting of one finished (or cut short) chat completion"""
+
+    def __init__(self, text: str, completion_tokens: Optional[int] = None, total_tokens: Optional[int] = None,
+                 finish_reason: Optional[str] = None):
+        self.text = text
+        self.completion_tokens = completion_tokens
+        self.total_tokens = total_tokens
+        self.finish_reason = finish_reason
+
+
+class LLMProvider(ABC):
+    """Interface the generation pipeline talks to.
+
+    complete() and stream() return None when there is nothing usable; a
+    rate-limited call records the throttle on `slot` so the caller can
+    re-queue it. stream() awaits on_delta(text) for every content delta and
+    returns whatever arrived, with finish_reason FINISH_ERROR, if the stream
+    breaks part way.
+    """
+
+    name = "base"
+    model = ""
+    context_window = 8192
+
+    @property
+    def is_configured(self) -> bool:
+        return True
+
+    @abstractmethod
+    async def complete(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float,
+                       slot=None) -> Optional[Completion]:
+        ...
+
+    @abstractmethod
+    async def stream(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float,
+                     on_delta: Callable[[str], Awaitable[None]], slot=None) -> Optional[Completion]:
+        ...
+
+    def describe(self) -> Dict[str, Any]:
+        return {"name": self.name, "model": self.model, "context_window": self.context_window}
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    """Chat completions over any OpenAI-compatible HTTP API (Groq, OpenAI, vLLM, the stub)"""
+
+    def __init__(self, name: str, base_url: str, model: str, client, api_key: Optional[str] = None,
+                 context_window: int = 8192, timeout: float = 45.0, requires_key: bool = True):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.url = f"{self.base_url}/chat/completions"
+        self.model = model
+        self.client = client
+        self.api_key = api_key
+        self.context_window = context_window
+        self.timeout = timeout
+        self.requires_key = requires_key
+
+    @property
+    def is_configured(self) -> bool:
+        return bool(self.api_key) or not self.requires_key
+
+    def _headers(self) -> Dict[str, str]:
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def _payload(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> Dict[str, Any]:
+        return {"model": self.model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+
+    async def complete(self, messages, max_tokens, temperature, slot=None):
+        response = await self.client.post(
+            self.url,
+            headers=self._headers(),
+            json=self._payload(messages, max_tokens, temperature),
+            timeout=self.timeout
+        )
+        logger.info(f"{self.name} API response status: {response.status_code}")
+        if response.status_code == 429 and slot is not None:
+            slot.record_throttle(parse_retry_after(response.headers.get("retry-after")))
+            return None
+        if response.status_code != 200:
+            logger.error(f"{self.name} API error: {response.status_code} - {response.text}")
+            return None
+
+        result = response.json()
+        usage = result.get("usage") or {}
+        if slot is not None:
+            slot.record_usage(usage.get("total_tokens"))
+        choice = result["choices"][0]
+        return Completion(choice["message"]["content"], usage.get("completion_tokens"), usage.get("total_tokens"),
+                          choice.get("finish_reason"))
+
+    async def stream(self, messages, max_tokens, temperature, on_delta, slot=None):
+        parts: List[str] = []
+        usage: Dict[str, Any] = {}
+        finish_reason = None
+        try:
+            async with self.client.stream(
+                "POST",
+                self.url,
+                headers=self._headers(),
+                json={**self._payload(messages, max_tokens, temperature), "stream": True},
+                timeout=self.timeout
+            ) as response:
+                logger.info(f"{self.name} API streaming response status: {response.status_code}")
+                if response.status_code == 429 and slot is not None:
+                    slot.record_throttle(parse_retry_after(response.headers.get("retry-after")))
+                    return None
+                if response.status_code != 200:
+                    body = await response.aread()
+                    logger.error(f"{self.name} API error: {response.status_code} - {body.decode(errors='replace')}")
+                    return None
+
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+
+                    chunk = json.loads(data)
+                    # Groq reports usage under x_groq on the last chunk
+                    chunk_usage = (chunk.get("x_groq") or {}).get("usage") or chunk.get("usage")
+                    if chunk_usage:
+                        usage = chunk_usage
+                        if slot is not None:
+                            slot.record_usage(usage.get("total_tokens"))
+
+                    choices = chunk.get("choices") or []
+                    if choices and choices[0].get("finish_reason"):
+                        finish_reason = choices[0]["finish_reason"]
+                    delta = choices[0].get("delta", {}).get("content") if choices else None
+                    if not delta:
+                        continue
+                    parts.append(delta)
+                    await on_delta(delta)
+
+        except Exception as e:
+            logger.error(f"{self.name} streaming error: {e}")
+            if not parts:
+                return None
+            # Keep what arrived so the truncation repair can salvage complete days
+            logger.info("Returning partial streamed response")
+            finish_reason = FINISH_ERROR
+
+        if not parts:
+            return None
+        return Completion("".join(parts), usage.get("completion_tokens"), usage.get("total_tokens"), finish_reason)
+
+    def describe(self) -> Dict[str, Any]:
+        return {**super().describe(), "base_url": self.base_url, "configured": self.is_configured}
+
+
+def provider_from_env(client, name: Optional[str] = None) -> LLMProvider:
+    """Build the provider selected by LLM_PROVIDER (groq, openai or stub).
+
+    LLM_BASE_URL, LLM_MODEL, LLM_API_KEY and LLM_CONTEXT_WINDOW override the
+    preset, so any other OpenAI-compatible server can be used as well.
+    """
+    name = (name or os.getenv("LLM_PROVIDER", "groq")).lower()
+    if name not in PROVIDER_PRESETS:
+        raise ValueError(f"Unknown LLM_PROVIDER '{name}' (expected one of {', '.join(PROVIDER_PRESETS)})")
+    preset = PROVIDER_PRESETS[name]
+    api_key_env = preset["api_key_env"]
+    api_key = os.getenv("LLM_API_KEY") or (os.getenv(api_key_env) if api_key_env else None)
+    return OpenAICompatibleProvider(
+        name=name,
+        base_url=os.getenv("LLM_BASE_URL") or preset["base_url"],
+        model=os.getenv("LLM_MODEL") or preset["model"],
+        client=client,
+        api_key=api_key,
+        context_window=int(os.getenv("LLM_CONTEXT_WINDOW") or preset["context_window"]),
+        timeout=float(os.getenv("LLM_TIMEOUT", "45")),
+        requires_key=api_key_env is not None,
+    )
@@ -1,5 +1,6 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, Header, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 import httpx
@@ -10,8 +11,30 @@ import re
 from datetime import datetime, timedelta
 import logging
 import asyncpg
+import asyncio
 import uuid
 
+from http_pool import PooledHTTPClient
+from result_cache import ItineraryCache, make_cache_key, redate_itinerary
+from singleflight import SingleFlight
+from itinerary_parser import IncrementalDayParser, complete_days, parse_itinerary_response
+from job_queue import JobQueue
+from rate_limiter import AdaptiveRateLimiter
+from llm_providers import FINISH_ERROR, Completion, provider_from_env
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from hedging import HedgePolicy, run_hedged
+from geocoding import ActivityGeocoder
+from route_optimizer import RouteOptimizer
+from generation_registry import GenerationCancelled, GenerationRegistry, notify_cancel
+from day_quality import day_issues, low_quality_days
+from stuck_sweeper import StuckGenerationSweeper
+from token_budget import choose_max_tokens, estimate_chat_tokens, estimate_tokens
+from status_events import NOTIFY_PAYLOAD_SQL, RESYNC, StatusBroadcaster
+from eta_model import EtaModel, GenerationTiming
+from migrations import ensure_schema
+from metrics import Counter, Gauge, Histogram, MetricsMiddleware, metrics_response
+from itinerary_body import dumps as dumps_json, make_etag, parse_if_none_match, serialize_itinerary
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, 
                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -19,10 +42,11 @@ logger = logging.getLogger("itinerary-service")
 
 app = FastAPI(
     title="Itinerary Generator Service",
-    description="AI-powered trip itinerary generation service using Groq with address coordinates",
+    description="AI-powered trip itinerary generation service (Groq or any OpenAI-compatible LLM) with address coordinates",
     version="1.0.0",
 )
 
+app.add_middleware(MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -40,9 +64,176 @@ app.add_middleware(
 
 # Database configuration
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Startup only reads schema_migrations; pending migrations are applied under an
+# advisory lock when enabled, otherwise run `python -m migrations upgrade` first
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() == "true"
+MIGRATION_LOCK_TIMEOUT = os.getenv("MIGRATION_LOCK_TIMEOUT", "10s")
+
+# LLM provider: LLM_PROVIDER=groq|openai|stub (see llm_providers.py);
+# GROQ_STREAMING and GROQ_MAX_TOKENS are still read when the LLM_* names are unset
+LLM_STREAMING = os.getenv("LLM_STREAMING", os.getenv("GROQ_STREAMING", "true")).lower() == "true"
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.3"))
+
+# "compact" describes the day schema once; "full" spells out every day
+PROMPT_MODE = os.getenv("PROMPT_MODE", "compact").lower()
+# max_tokens is sized to the expected answer, capped by LLM_MAX_TOKENS and the model context window
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", os.getenv("GROQ_MAX_TOKENS", "6000")))
+COMPLETION_TOKEN_MARGIN = float(os.getenv("COMPLETION_TOKEN_MARGIN", "0.3"))
+# Answers cut off at max_tokens are finished by up to this many follow-up calls (0 disables)
+LLM_MAX_CONTINUATIONS = int(os.getenv("LLM_MAX_CONTINUATIONS", "3"))
+
+# Concurrent generations with the same prompt fingerprint share one upstream call
+llm_single_flight = SingleFlight()
+
+# Provider rate limits (0 disables a bucket); concurrency adapts between 1 and GROQ_MAX_CONCURRENCY
+GROQ_RATE_LIMIT_RETRIES = int(os.getenv("GROQ_RATE_LIMIT_RETRIES", "5"))
+llm_rate_limiter = AdaptiveRateLimiter(
+    rpm=float(os.getenv("GROQ_RPM", "30")),
+    tpm=float(os.getenv("GROQ_TPM", "0")),
+    max_concurrency=int(os.getenv("GROQ_MAX_CONCURRENCY", "8")),
+)
+
+# Trips longer than GENERATION_CHUNK_DAYS are generated as concurrent windows (0 disables)
+GENERATION_CHUNK_DAYS = int(os.getenv("GENERATION_CHUNK_DAYS", "4"))
+GENERATION_CHUNK_CONCURRENCY = int(os.getenv("GENERATION_CHUNK_CONCURRENCY", "4"))
+
+# Generation job queue: in-process workers (0 = enqueue only, run `python -m worker` separately)
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "2"))
+GENERATION_MAX_ATTEMPTS = int(os.getenv("GENERATION_MAX_ATTEMPTS", "3"))
+GENERATION_VISIBILITY_TIMEOUT = float(os.getenv("GENERATION_VISIBILITY_TIMEOUT", "120"))
+GENERATION_RETRY_BACKOFF = float(os.getenv("GENERATION_RETRY_BACKOFF", "5"))
+# On shutdown, running jobs get this long to finish before they are interrupted and requeued
+GENERATION_DRAIN_SECONDS = float(os.getenv("GENERATION_DRAIN_SECONDS", "30"))
+# /generate/batch: max trips per call, and queue priority relative to single requests (0)
+GENERATION_BATCH_MAX = int(os.getenv("GENERATION_BATCH_MAX", "200"))
+GENERATION_BATCH_PRIORITY = int(os.getenv("GENERATION_BATCH_PRIORITY", "-1"))
+
+# Circuit breaker around provider calls: opens on error rate or slow-call rate (slow = time to
+# first streamed token, or the whole call when not streaming); while open, generations use the fallback
+llm_breaker = CircuitBreaker(
+    window=int(os.getenv("LLM_BREAKER_WINDOW", "20")),
+    min_calls=int(os.getenv("LLM_BREAKER_MIN_CALLS", "5")),
+    failure_rate=float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5")),
+    slow_call_seconds=float(os.getenv("LLM_BREAKER_SLOW_SECONDS", "20")),
+    slow_call_rate=float(os.getenv("LLM_BREAKER_SLOW_RATE", "0.8")),
+    open_seconds=float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30")),
+    half_open_probes=int(os.getenv("LLM_BREAKER_HALF_OPEN_PROBES", "1")),
+)
+
+# Hedged requests for interactive generations (single /generate calls, not batches)
+LLM_HEDGING = os.getenv("LLM_HEDGING", "false").lower() == "true"
+llm_hedge_policy = HedgePolicy(
+    quantile=float(os.getenv("LLM_HEDGE_QUANTILE", "0.95")),
+    default_delay=float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "10")),
+    min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5")),
+    max_ratio=float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1")),
+)
+
+# Shared HTTP client for LLM calls (created on startup, closed on shutdown); tuned by GROQ_HTTP_* variables
+llm_client = PooledHTTPClient.from_env("GROQ_HTTP")
+llm_provider = provider_from_env(llm_client)
+
+# Prometheus metrics for GET /metrics. Hot paths update these in place; the
+# function= gauges and counters read existing state only when scraped.
+LLM_LATENCY = Histogram("llm_request_duration_seconds", "LLM provider call latency",
+                        ("provider", "mode", "outcome"))
+LLM_FIRST_TOKEN = Histogram("llm_time_to_first_token_seconds", "Time to the first streamed token", ("provider",))
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens of successful LLM calls (prompt tokens are estimated)",
+                     ("provider", "type"))
+PARSE_OUTCOMES = Counter("itinerary_parse_total", "LLM answers by parse strategy", ("strategy",))
+GENERATION_LATENCY = Histogram("itinerary_generation_duration_seconds", "Wall time of generations by outcome",
+                               ("outcome",))
+LLM_CONTINUATIONS = Counter("llm_continuations_total", "Follow-up calls for answers cut off at max_tokens, by result",
+                            ("result",))
+DAY_REGENERATIONS = Counter("itinerary_days_regenerated_total", "Single days regenerated, by trigger and result",
+                            ("trigger", "result"))
+
+def db_pool_usage() -> dict:
+    if db_pool is None:
+        return {}
+    size, idle = db_pool.get_size(), db_pool.get_idle_size()
+    return {"in_use": size - idle, "idle": idle, "max": db_pool.get_max_size()}
+
+async def generation_queue_depth() -> dict:
+    stats = await job_queue.stats()
+    return {"queued": stats.get("queue_depth"), "running": stats.get("running"), "in_flight_here": stats["in_flight"]}
+
+Gauge("db_pool_connections", "asyncpg pool connections by state", ("state",), function=db_pool_usage)
+Gauge("generation_jobs", "Generation jobs by state", ("state",), function=generation_queue_depth)
+Counter("itinerary_cache_lookups_total", "Itinerary cache lookups by result", ("result",),
+        function=lambda: {"memory_hit": itinerary_cache.memory_hits, "db_hit": itinerary_cache.db_hits,
+                          "miss": itinerary_cache.misses})
+Gauge("itinerary_cache_hit_ratio", "Share of itinerary cache lookups that hit",
+      function=lambda: itinerary_cache.stats()["hit_ratio"])
+Gauge("llm_rate_limiter_waiting", "LLM calls queued for a rate limit slot",
+      function=lambda: llm_rate_limiter.stats()["queue_depth"])
+Gauge("llm_circuit_state", "LLM circuit breaker state (0 closed, 1 half-open, 2 open)",
+      function=lambda: {"closed": 0, "half_open": 1, "open": 2}[llm_breaker.state])
+Counter("llm_calls_rejected_total", "LLM calls short-circuited by the breaker",
+        function=lambda: llm_breaker.calls_rejected)
+Counter("llm_hedges_total", "Hedged LLM requests", ("result",),
+        function=lambda: {"sent": llm_hedge_policy.hedges_sent, "won": llm_hedge_policy.hedges_won,
+                          "denied": llm_hedge_policy.hedges_denied})
+Counter("single_flight_shared_total", "Generations that shared an identical in-flight call",
+        function=lambda: llm_single_flight.shared)
+Gauge("status_stream_subscribers", "Open SSE/WebSocket status subscriptions",
+      function=lambda: status_broadcaster.stats()["subscribers"])
+
+# Cache of parsed LLM itineraries keyed by normalized prompt
+ITINERARY_CACHE_ENABLED = os.getenv("ITINERARY_CACHE_ENABLED", "true").lower() == "true"
+itinerary_cache = ItineraryCache(
+    max_entries=int(os.getenv("ITINERARY_CACHE_MAX_ENTRIES", "256")),
+    ttl_seconds=int(float(os.getenv("ITINERARY_CACHE_TTL_HOURS", "168")) * 3600),
+)
+
+# Status changes are pushed over one shared LISTEN connection to SSE/WebSocket clients
+status_broadcaster = StatusBroadcaster(DATABASE_URL)
+STATUS_STREAM_HEARTBEAT = float(os.getenv("STATUS_STREAM_HEARTBEAT", "15"))
 
-# Configuration for Groq
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+# Running generations, cancelled when their trip is cleared or deleted (in any process)
+generation_registry = GenerationRegistry(DATABASE_URL)
+Counter("generations_cancelled_total", "Generations stopped because their trip was cleared or deleted",
+        function=lambda: generation_registry.generations_cancelled)
+
+# ETA for in-progress generations, learned from recorded generation timings
+eta_model = EtaModel(
+    window=int(os.getenv("ETA_WINDOW", "500")),
+    quantile=float(os.getenv("ETA_QUANTILE", "0.5")),
+)
+ETA_REFRESH_SECONDS = float(os.getenv("ETA_REFRESH_SECONDS", "60"))
+
+# Trips 'processing' for STUCK_GENERATION_DEADLINE seconds without progress or a live job are
+# requeued or failed; every process sweeps, an advisory lock lets one replica through per round
+stuck_sweeper = StuckGenerationSweeper(
+    deadline=float(os.getenv("STUCK_GENERATION_DEADLINE", "900")),
+    batch_size=int(os.getenv("STUCK_SWEEP_BATCH", "500")),
+)
+STUCK_SWEEP_INTERVAL = float(os.getenv("STUCK_SWEEP_INTERVAL", "60"))
+Counter("generations_recovered_total", "Stuck generations recovered by the sweeper, by action", ("action",),
+        function=lambda: {"requeued": stuck_sweeper.requeued, "failed": stuck_sweeper.failed})
+
+# Optional post-generation stage: batch-geocode activity addresses through the map service
+GEOCODE_ACTIVITIES = os.getenv("GEOCODE_ACTIVITIES", "false").lower() == "true"
+map_client = PooledHTTPClient.from_env("MAP_HTTP")
+activity_geocoder = ActivityGeocoder(
+    os.getenv("MAP_SERVICE_URL", "http://map-service:8002"),
+    map_client,
+    max_entries=int(os.getenv("GEOCODE_CACHE_SIZE", "5000")),
+    batch_size=int(os.getenv("GEOCODE_BATCH_SIZE", "50")),
+    timeout=float(os.getenv("GEOCODE_TIMEOUT", "20")),
+)
+Counter("activity_geocodes_total", "Activities given coordinates by the geocoding stage",
+        function=lambda: activity_geocoder.activities_geocoded)
+
+# Days failing the quality check are re-asked one by one, unless more than this many failed
+# (then a per-day re-ask would cost about as much as the whole trip); 0 disables it
+QUALITY_REASK_MAX_DAYS = int(os.getenv("QUALITY_REASK_MAX_DAYS", "2"))
+
+# Reorder each day's geocoded activities into the shortest walk (meals keep their slots)
+OPTIMIZE_ROUTES = os.getenv("OPTIMIZE_ROUTES", "true").lower() == "true"
+route_optimizer = RouteOptimizer(max_free_stops=int(os.getenv("ROUTE_MAX_FREE_STOPS", "7")))
+Counter("route_distance_saved_meters_total", "Walking distance removed by route ordering",
+        function=lambda: route_optimizer.meters_saved)
 
 class ItineraryRequest(BaseModel):
     destination: str
@@ -51,6 +242,12 @@ class ItineraryRequest(BaseModel):
     preferences: Optional[List[Dict[str, Any]]] = []
     budget: Optional[float] = None
 
+class BatchTripRequest(ItineraryRequest):
+    trip_id: int
+
+class BatchGenerateRequest(BaseModel):
+    trips: List[BatchTripRequest]
+
 class ItineraryResponse(BaseModel):
     itinerary: Dict[str, Any]
 
@@ -58,6 +255,8 @@ class StatusResponse(BaseModel):
     status: str
     message: str
     eta: Optional[int] = None
+    days_completed: Optional[int] = None
+    days_total: Optional[int] = None
 
 # Database connection pool
 db_pool = None
@@ -70,17 +269,13 @@ async def init_db_pool():
         logger.info("Database pool initialized")
         
         async with db_pool.acquire() as conn:
-            await conn.execute("""
-                ALTER TABLE trips 
-                ADD COLUMN IF NOT EXISTS generation_status VARCHAR(20) DEFAULT 'pending',
-                ADD COLUMN IF NOT EXISTS generation_id UUID,
-                ADD COLUMN IF NOT EXISTS generation_started_at TIMESTAMP,
-                ADD COLUMN IF NOT EXISTS generation_updated_at TIMESTAMP;
-                
-                CREATE INDEX IF NOT EXISTS idx_trips_generation_id ON trips(generation_id);
-                CREATE INDEX IF NOT EXISTS idx_trips_generation_status ON trips(generation_status);
-            """)
-            logger.info("Itineraries table ready")
+            version = await ensure_schema(conn, apply=MIGRATE_ON_STARTUP, lock_timeout=MIGRATION_LOCK_TIMEOUT)
+            logger.info(f"Database schema at version {version}")
+        
+        itinerary_cache.attach_pool(db_pool)
+        job_queue.attach_pool(db_pool)
+        eta_model.attach_pool(db_pool)
+        stuck_sweeper.attach_pool(db_pool)
             
     except Exception as e:
         logger.error(f"Failed to initialize database pool: {e}")
@@ -95,234 +290,464 @@ async def close_db_pool():
 @app.on_event("startup")
 async def startup_event():
     await init_db_pool()
+    await status_broadcaster.start()
+    await generation_registry.start()
+    await eta_model.start(ETA_REFRESH_SECONDS)
+    await stuck_sweeper.start(STUCK_SWEEP_INTERVAL)
+    await llm_client.start()
+    if GEOCODE_ACTIVITIES:
+        await map_client.start()
+    if GENERATION_WORKERS > 0:
+        job_queue.start(GENERATION_WORKERS)
 
 @app.on_event("shutdown") 
 async def shutdown_event():
+    await job_queue.stop(GENERATION_DRAIN_SECONDS)
+    await stuck_sweeper.stop()
+    await eta_model.stop()
+    await llm_client.close()
+    await map_client.close()
+    await generation_registry.stop()
+    await status_broadcaster.stop()
     await close_db_pool()
 
 @app.get("/")
 async def read_root():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "itinerary-generator", "ai_provider": "groq"}
+    return {"status": "healthy", "service": "itinerary-generator", "ai_provider": llm_provider.name}
+
+@app.get("/stats")
+async def get_service_stats():
+    """Runtime counters (connection reuse etc.) for load testing"""
+    return {
+        "llm_provider": llm_provider.describe(),
+        "http_pool": llm_client.stats(),
+        "itinerary_cache": itinerary_cache.stats(),
+        "rate_limiter": llm_rate_limiter.stats(),
+        "circuit_breaker": llm_breaker.stats(),
+        "hedging": llm_hedge_policy.stats(),
+        "single_flight": llm_single_flight.stats(),
+        "job_queue": await job_queue.stats(),
+        "status_events": status_broadcaster.stats(),
+        "generation_registry": generation_registry.stats(),
+        "stuck_sweeper": stuck_sweeper.stats(),
+        "eta_model": eta_model.stats(),
+        "geocoding": activity_geocoder.stats() if GEOCODE_ACTIVITIES else None,
+        "route_optimizer": route_optimizer.stats(),
+    }
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    return await metrics_response()
 
 async def get_itinerary_from_db(trip_id: int):
-    """Get itinerary from database using trips table"""
+    """Get a trip's generation state from the trips table (the itinerary itself is read by load_itinerary_body)"""
     async with db_pool.acquire() as conn:
         row = await conn.fetchrow(
-            "SELECT itinerary, generation_status, generation_id, generation_started_at FROM trips WHERE id = $1",
+            """SELECT generation_status, generation_id, generation_started_at,
+                      generation_days_completed, generation_days_total
+               FROM trips WHERE id = $1""",
             trip_id
         )
         return row
 
-async def save_itinerary_to_db(trip_id: int, content: dict, status: str = "completed", generation_id: str = None):
-    """Save itinerary to trips table"""
+async def load_itinerary_body(trip_id: int, known_hashes: List[str]):
+    """Generation state plus the pre-serialized response body, or None if the trip doesn't exist
+
+    The body is only transferred when its hash isn't one the client already
+    has; the JSONB itinerary only for rows saved before bodies were stored,
+    which get their body filled in here once completed.
+    """
     async with db_pool.acquire() as conn:
-        await conn.execute(
-            """UPDATE trips 
-               SET itinerary = $1, generation_status = $2, generation_updated_at = NOW() 
-               WHERE id = $3""",
-            json.dumps(content), status, trip_id
+        row = await conn.fetchrow(
+            """SELECT generation_status, generation_days_completed, itinerary_hash,
+                      CASE WHEN itinerary_hash = ANY($2::text[]) THEN NULL ELSE itinerary_body END AS body,
+                      CASE WHEN itinerary_hash IS NULL THEN itinerary END AS itinerary
+               FROM trips WHERE id = $1""",
+            trip_id, known_hashes
         )
+        if row is None:
+            return None
+        result = dict(row)
+        if result["itinerary_hash"] is None and result["itinerary"] is not None:
+            content = result["itinerary"]
+            if isinstance(content, str):
+                content = json.loads(content)
+            result["body"], result["itinerary_hash"] = serialize_itinerary(content)
+            if result["generation_status"] == "completed":
+                await conn.execute(
+                    """UPDATE trips SET itinerary_body = $2, itinerary_hash = $3
+                       WHERE id = $1 AND itinerary_hash IS NULL AND generation_status = 'completed'""",
+                    trip_id, result["body"], result["itinerary_hash"]
+                )
+        return result
 
-async def create_generation_record(trip_id: int):
-    """Create a generation record and return generation ID"""
-    generation_id = str(uuid.uuid4())
+def count_itinerary_days(content: dict) -> int:
+    """Number of "Day N" entries in an itinerary"""
+    if not isinstance(content, dict):
+        return 0
+    return sum(1 for key in content if key.startswith("Day "))
+
+async def save_itinerary_to_db(trip_id: int, content: dict, status: str = "completed", generation_id: str = None,
+                               days_total: int = None, expected_hash: str = None) -> bool:
+    """Save itinerary to trips table (status 'processing' stores a partial result)
+
+    The response body for GET /itinerary is serialized here once, with its
+    hash as the ETag, so reads never re-encode it.
+    Listeners on the generation_status channel are notified when it commits.
+    With a generation_id the write is a compare-and-set: it only lands while
+    that generation still owns the trip, so a cleared, deleted or restarted
+    trip is never overwritten by a stale worker. With expected_hash it also
+    requires the stored itinerary to be unchanged. Returns whether it landed.
+    """
+    body, content_hash = serialize_itinerary(content)
     async with db_pool.acquire() as conn:
-        await conn.execute(
-            """UPDATE trips 
-               SET generation_status = $1, generation_id = $2, generation_started_at = NOW()
-               WHERE id = $3""",
-            "processing", generation_id, trip_id
+        saved = await conn.fetchval(
+            f"""WITH u AS (
+                   UPDATE trips 
+                   SET itinerary = $1, generation_status = $2, generation_updated_at = NOW(),
+                       generation_days_completed = $4,
+                       generation_days_total = COALESCE($5, generation_days_total),
+                       itinerary_body = $6, itinerary_hash = $7
+                   WHERE id = $3 AND ($8::uuid IS NULL OR generation_id = $8::uuid)
+                     AND ($9::text IS NULL OR itinerary_hash = $9::text)
+                   RETURNING id, generation_status, generation_id, generation_started_at,
+                             generation_days_completed, generation_days_total
+               )
+               SELECT u.id, {NOTIFY_PAYLOAD_SQL} FROM u""",
+            dumps_json(content), status, trip_id, count_itinerary_days(content), days_total, body, content_hash,
+            generation_id, expected_hash
         )
-    return generation_id
+    if saved is None and (generation_id is not None or expected_hash is not None):
+        logger.info(f"Discarded {status} write for trip {trip_id}: superseded since generation {generation_id} read it")
+    return saved is not None
 
-async def generate_with_groq(prompt):
-    """Generate text using Groq API - fast and intelligent"""
-    if not GROQ_API_KEY:
-        logger.error("GROQ_API_KEY not set - check environment variables")
-        return None
-        
-    try:
-        logger.info(f"Calling Groq API with prompt length: {len(prompt)}")
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.groq.com/openai/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {GROQ_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "llama3-70b-8192",  # Much smarter than local models
-                    "messages": [
-                        {"role": "system", "content": "You are a local travel expert with detailed knowledge of specific addresses and locations. You know the exact addresses of popular restaurants, attractions, and landmarks. Always include real, specific addresses in your recommendations."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    "temperature": 0.3,
-                    "max_tokens": 6000  
-                },
-                timeout=45.0 
-            )
+async def save_itineraries_bulk(entries: List[tuple], status: str = "completed"):
+    """Save many (trip_id, content, generation_id) entries in one UNNEST-based UPDATE, notifying listeners per trip
+
+    Each row is a compare-and-set on its generation_id, as in save_itinerary_to_db.
+    """
+    if not entries:
+        return
+    trip_ids = [trip_id for trip_id, _, _ in entries]
+    contents = [dumps_json(content) for _, content, _ in entries]
+    days = [count_itinerary_days(content) for _, content, _ in entries]
+    generation_ids = [generation_id for _, _, generation_id in entries]
+    bodies, hashes = zip(*(serialize_itinerary(content) for _, content, _ in entries))
+    async with db_pool.acquire() as conn:
+        saved = await conn.fetch(
+            f"""WITH u AS (
+                   UPDATE trips AS t
+                   SET itinerary = b.itinerary, generation_status = $4, generation_updated_at = NOW(),
+                       generation_days_completed = b.days_completed,
+                       itinerary_body = b.body, itinerary_hash = b.hash
+                   FROM UNNEST($1::int[], $2::jsonb[], $3::int[], $5::bytea[], $6::text[], $7::uuid[])
+                        AS b(id, itinerary, days_completed, body, hash, generation_id)
+                   WHERE t.id = b.id AND (b.generation_id IS NULL OR t.generation_id = b.generation_id)
+                   RETURNING t.id, t.generation_status, t.generation_id, t.generation_started_at,
+                             t.generation_days_completed, t.generation_days_total
+               )
+               SELECT u.id, {NOTIFY_PAYLOAD_SQL} FROM u""",
+            trip_ids, contents, days, status, list(bodies), list(hashes), generation_ids
+        )
+    if len(saved) < len(entries):
+        logger.info(f"Discarded {len(entries) - len(saved)} stale {status} writes in bulk save")
+
+async def create_generation_record(trip_id: int, days_total: int = None, conn=None) -> Optional[str]:
+    """Atomically claim a trip for generation and return the new generation ID
+
+    Returns None when the trip doesn't exist or another request already
+    claimed it (processing) or finished it (completed). A successful claim
+    notifies generation_status listeners. Pass conn to claim inside the
+    caller's transaction.
+    """
+    if conn is None:
+        async with db_pool.acquire() as conn:
+            return await create_generation_record(trip_id, days_total, conn)
+    
+    generation_id = str(uuid.uuid4())
+    return await conn.fetchval(
+        f"""WITH u AS (
+               UPDATE trips 
+               SET generation_status = 'processing', generation_id = $2, generation_started_at = NOW(),
+                   generation_days_completed = 0, generation_days_total = $3
+               WHERE id = $1
+                 AND COALESCE(generation_status, 'pending') NOT IN ('processing', 'completed')
+               RETURNING id, generation_status, generation_id, generation_started_at,
+                         generation_days_completed, generation_days_total
+           )
+           SELECT u.generation_id::text, {NOTIFY_PAYLOAD_SQL} FROM u""",
+        trip_id, generation_id, days_total
+    )
+
+async def llm_attempt(messages: List[dict], max_tokens: int, estimated_tokens: int, on_day=None,
+                      claim=None) -> Optional[Completion]:
+    """One provider call, re-queued through the rate limiter while throttled
+
+    Its outcome and latency (time to first streamed token, or the whole call)
+    feed the circuit breaker and the hedge policy. A stream that broke part
+    way counts as a breaker failure, though its partial text is still
+    returned for the truncation repair. With claim (a hedged
+    call), streamed days are only forwarded once claim() says this attempt
+    answered first.
+    """
+    stream = on_day is not None and LLM_STREAMING
+    kind = "stream" if stream else "complete"
+    for attempt in range(GROQ_RATE_LIMIT_RETRIES + 1):
+        async with llm_rate_limiter.slot(estimated_tokens) as slot:
+            if slot.waited > 1:
+                logger.info(f"Waited {slot.waited:.1f}s for an LLM rate limit slot")
             
-            logger.info(f"Groq API response status: {response.status_code}")
-            if response.status_code != 200:
-                logger.error(f"Groq API error: {response.status_code} - {response.text}")
-                return None
-                
-            result = response.json()
-            response_text = result["choices"][0]["message"]["content"]
-            logger.info(f"Groq response length: {len(response_text)}")
-            return response_text
+            started = time.monotonic()
+            first_token = None
+            provider_name = llm_provider.name
+            try:
+                if stream:
+                    parser = IncrementalDayParser()
+                    
+                    async def on_delta(delta: str):
+                        nonlocal first_token
+                        if first_token is None:
+                            first_token = time.monotonic() - started
+                        if claim is not None and not claim():
+                            return
+                        for day_key, day_data in parser.feed(delta):
+                            await on_day(day_key, day_data)
+                    
+                    completion = await llm_provider.stream(messages, max_tokens, LLM_TEMPERATURE, on_delta, slot)
+                    if completion is not None:
+                        logger.info(f"Streamed response length: {len(completion.text)}, days streamed: {len(parser.days)}")
+                else:
+                    completion = await llm_provider.complete(messages, max_tokens, LLM_TEMPERATURE, slot)
+                    if completion is not None:
+                        logger.info(f"LLM response length: {len(completion.text)}")
+            except Exception:
+                LLM_LATENCY.labels(provider_name, kind, "error").observe(time.monotonic() - started)
+                llm_breaker.record_failure(time.monotonic() - started)
+                raise
             
-    except Exception as e:
-        logger.error(f"Groq API error: {e}")
-        return None
-
-def clean_and_parse_json(llm_response: str) -> dict:
-    """Enhanced JSON cleaning and parsing with multiple fallback strategies"""
+            elapsed = time.monotonic() - started
+            if slot.throttled:
+                LLM_LATENCY.labels(provider_name, kind, "throttled").observe(elapsed)
+                logger.warning(f"{llm_provider.name} rate limited (attempt {attempt + 1}), re-queueing request")
+                continue
+            latency = first_token if first_token is not None else elapsed
+            if completion is None:
+                LLM_LATENCY.labels(provider_name, kind, "failed").observe(elapsed)
+                llm_breaker.record_failure(latency)
+                return None
+            if completion.finish_reason == FINISH_ERROR:
+                LLM_LATENCY.labels(provider_name, kind, "error").observe(elapsed)
+                llm_breaker.record_failure(latency)
+                return completion
+            slot.record_success()
+            LLM_LATENCY.labels(provider_name, kind, "ok").observe(elapsed)
+            if first_token is not None:
+                LLM_FIRST_TOKEN.labels(provider_name).observe(first_token)
+            llm_breaker.record_success(latency)
+            llm_hedge_policy.observe(kind, latency)
+            return completion
     
-    try:
-        # Strategy 1: Try parsing as-is first
-        return json.loads(llm_response.strip())
-    except:
-        pass
+    logger.error(f"{llm_provider.name} still rate limited after {GROQ_RATE_LIMIT_RETRIES + 1} attempts")
+    return None
+
+async def generate_with_llm(prompt, on_day=None, expected_days: Optional[int] = None,
+                            timing: Optional[GenerationTiming] = None, hedge: bool = False):
+    """Generate text with the configured LLM provider
+
+    When on_day is given the completion is streamed and on_day(day_key, day_data)
+    is awaited as soon as each "Day N" object closes. Calls are admitted by the
+    shared rate limiter; a 429 puts the call back in its queue rather than
+    dropping it. With expected_days, max_tokens is sized to that many days
+    instead of LLM_MAX_TOKENS. Token counts of a successful call are added
+    to timing.
+
+    While the circuit breaker is open this returns None at once, so callers
+    go straight to their fallback. With hedge (interactive requests, when
+    LLM_HEDGING is on) a second request is sent if the first hasn't answered
+    within the recent p95 latency, and the first to answer is used.
+
+    An answer cut off at max_tokens (finish_reason "length") is finished by
+    continuation calls for its missing days; see continue_truncated_completion.
+    """
+    if not llm_provider.is_configured:
+        logger.error(f"No API key for LLM provider '{llm_provider.name}' - check environment variables")
+        return None
     
-    try:
-        # Strategy 2: Extract from code blocks
-        cleaned_response = llm_response.strip()
-        
-        if "```json" in cleaned_response:
-            logger.info("Extracting JSON from code block with json tag")
-            json_str = cleaned_response.split("```json", 1)[1].split("```", 1)[0].strip()
-            cleaned_response = json_str
-        elif "```" in cleaned_response and cleaned_response.count("```") >= 2:
-            logger.info("Extracting JSON from generic code block")
-            json_str = cleaned_response.split("```", 1)[1].split("```", 1)[0].strip()
-            cleaned_response = json_str
-        
-        # Strategy 3: Find JSON boundaries
-        if '{' in cleaned_response:
-            start_pos = cleaned_response.find('{')
-            cleaned_response = cleaned_response[start_pos:]
-        
-        # Strategy 4: Fix malformed keys (Day 1 vs "Day 1")
-        cleaned_response = re.sub(r'"Day\s*(\d+)"', r'"Day \1"', cleaned_response)
-        cleaned_response = re.sub(r'{\s*"(\d+)":', r'{"Day \1":', cleaned_response)
+    system_prompt = "You are a local travel expert with detailed knowledge of specific addresses and locations. You know the exact addresses of popular restaurants, attractions, and landmarks. Always include real, specific addresses in your recommendations."
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt}
+    ]
+    prompt_tokens = estimate_chat_tokens(system_prompt, prompt)
+    context_window = llm_provider.context_window
+    if expected_days:
+        max_tokens = choose_max_tokens(prompt_tokens, expected_days, context_window=context_window,
+                                       ceiling=LLM_MAX_TOKENS, margin=COMPLETION_TOKEN_MARGIN)
+    else:
+        max_tokens = min(LLM_MAX_TOKENS, context_window - prompt_tokens)
+    estimated_tokens = prompt_tokens + max_tokens
         
-        # Strategy 5: Handle truncated JSON by finding last complete day
-        if not cleaned_response.endswith('}'):
-            logger.info("JSON appears truncated, attempting to fix")
-            # Find the last properly closed brace for a complete entry
-            brace_count = 0
-            last_valid_pos = 0
-            
-            for i, char in enumerate(cleaned_response):
-                if char == '{':
-                    brace_count += 1
-                elif char == '}':
-                    brace_count -= 1
-                    if brace_count == 1:  # Back to main object level
-                        last_valid_pos = i
+    try:
+        with llm_breaker.call():
+            logger.info(f"Calling {llm_provider.name} ({llm_provider.model}) with ~{prompt_tokens} prompt tokens, "
+                        f"max_tokens {max_tokens} ({LLM_MAX_TOKENS - max_tokens} below LLM_MAX_TOKENS)")
+            llm_hedge_policy.calls += 1
             
-            if last_valid_pos > 0:
-                cleaned_response = cleaned_response[:last_valid_pos + 1] + '}'
-        
-        if '}' in cleaned_response and not cleaned_response.endswith('}'):
-            end_pos = cleaned_response.rfind('}') + 1
-            cleaned_response = cleaned_response[:end_pos]
-        
-        # Strategy 6: Fix trailing commas
-        cleaned_response = re.sub(r',\s*}', '}', cleaned_response)
-        cleaned_response = re.sub(r',\s*]', ']', cleaned_response)
-        
-        logger.info(f"Attempting to parse cleaned JSON: {cleaned_response[:200]}...")
-        return json.loads(cleaned_response)
+            if hedge and LLM_HEDGING and llm_breaker.allows_extra_load:
+                kind = "stream" if on_day is not None and LLM_STREAMING else "complete"
+                completion, winner = await run_hedged(
+                    lambda index, claim: llm_attempt(messages, max_tokens, estimated_tokens, on_day, claim),
+                    llm_hedge_policy.delay(kind),
+                    lambda: llm_breaker.allows_extra_load and llm_hedge_policy.try_hedge()
+                )
+                if winner:
+                    llm_hedge_policy.hedges_won += 1
+                    logger.info("Hedged LLM request answered first")
+            else:
+                completion = await llm_attempt(messages, max_tokens, estimated_tokens, on_day)
         
+        if completion is None:
+            return None
+        record_llm_tokens(prompt_tokens, completion, timing)
+        if completion.finish_reason == "length" and expected_days and LLM_MAX_CONTINUATIONS:
+            return await continue_truncated_completion(system_prompt, prompt, completion.text, expected_days,
+                                                       on_day=on_day, timing=timing)
+        return completion.text
+    
+    except CircuitOpenError as e:
+        logger.warning(f"Skipping {llm_provider.name} call: {e}")
+        return None
     except Exception as e:
-        logger.error(f"JSON cleaning failed: {e}")
-        logger.error(f"Problematic JSON: {cleaned_response[:500]}...")
+        logger.error(f"{llm_provider.name} API error: {e}")
+        return None
+
+def record_llm_tokens(prompt_tokens: int, completion: Completion, timing: Optional[GenerationTiming] = None):
+    completion_tokens = completion.completion_tokens or estimate_tokens(completion.text)
+    LLM_TOKENS.labels(llm_provider.name, "prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(llm_provider.name, "completion").inc(completion_tokens)
+    if timing is not None:
+        timing.add_call(prompt_tokens, completion_tokens)
+
+def day_number(day_key: str) -> int:
+    match = re.search(r"\d+", day_key)
+    return int(match.group()) if match else 0
+
+async def continue_truncated_completion(system_prompt: str, prompt: str, text: str, expected_days: int,
+                                        on_day=None, timing: Optional[GenerationTiming] = None) -> str:
+    """Finish an answer that was cut off at max_tokens; returns the stitched JSON document
+
+    The days that closed before the cut are kept, and the prompt is sent
+    again asking only for the days from the first missing one, with the
+    districts already used. Each continuation starts when the previous one
+    returns (it needs to know where that one stopped), up to
+    LLM_MAX_CONTINUATIONS. Continued days are renumbered in the order they
+    arrive and streamed to on_day under those numbers. If a continuation
+    fails, the days stitched so far are returned.
+    """
+    days = complete_days(text)
+    if not days:
+        logger.warning("Answer was cut off before its first day closed, nothing to continue from")
+        return text
+    first_day = min(day_number(day_key) for day_key in days)
+    last_day = first_day + expected_days - 1
     
-    # Strategy 7: Smart content extraction - preserve real data from response
-    try:
-        logger.info("Attempting smart content extraction from malformed response")
-        result = {}
-        
-        # Extract any districts/neighborhoods mentioned
-        district_matches = re.findall(r'"district":\s*"([^"]*)"', llm_response)
-        
-        # Extract any place names mentioned  
-        title_matches = re.findall(r'"title":\s*"([^"]*)"', llm_response)
-        
-        # Extract addresses
-        address_matches = re.findall(r'"address":\s*"([^"]*)"', llm_response)
+    for continuation in range(LLM_MAX_CONTINUATIONS):
+        next_day = max(day_number(day_key) for day_key in days) + 1
+        if next_day > last_day:
+            break
+        remaining = last_day - next_day + 1
+        districts = list(dict.fromkeys(day.get("district") for day in days.values() if day.get("district")))
+        span = f"Day {next_day}" if remaining == 1 else f"Day {next_day} to Day {last_day}"
+        follow_up = f"{prompt}\n\nCONTINUATION: Day {first_day} to Day {next_day - 1} are already written"
+        if districts:
+            follow_up += f" (districts: {', '.join(districts)})"
+        follow_up += (f". Return ONLY {span} as one JSON object in the same format, "
+                      f"keyed from \"Day {next_day}\", each in a district not used yet.")
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": follow_up}
+        ]
+        prompt_tokens = estimate_chat_tokens(system_prompt, follow_up)
+        max_tokens = choose_max_tokens(prompt_tokens, remaining, context_window=llm_provider.context_window,
+                                       ceiling=LLM_MAX_TOKENS, margin=COMPLETION_TOKEN_MARGIN)
         
-        # Extract dates
-        date_matches = re.findall(r'"date":\s*"([^"]*)"', llm_response)
+        # The model's own keys are mapped onto next_day.. on first sight, streamed or not
+        numbers: Dict[str, int] = {}
         
-        # Try to group by days using any day indicators
-        day_indicators = re.findall(r'(?:"Day (\d+)"|"(\d+)"|Day (\d+))', llm_response)
+        async def on_continued_day(day_key, day_data):
+            number = numbers.setdefault(day_key, next_day + len(numbers))
+            if number <= last_day:
+                await on_day(f"Day {number}", day_data)
         
-        # Flatten day numbers and get unique ones
-        day_numbers = []
-        for match in day_indicators:
-            for num in match:
-                if num and num not in day_numbers:
-                    day_numbers.append(num)
+        logger.info(f"Answer cut off at max_tokens, continuing with {span} "
+                    f"(continuation {continuation + 1}/{LLM_MAX_CONTINUATIONS})")
+        try:
+            with llm_breaker.call():
+                completion = await llm_attempt(messages, max_tokens, prompt_tokens + max_tokens,
+                                               on_continued_day if on_day is not None else None)
+        except CircuitOpenError as e:
+            logger.warning(f"Skipping continuation: {e}")
+            LLM_CONTINUATIONS.labels("rejected").inc()
+            break
+        except Exception as e:
+            logger.error(f"{llm_provider.name} continuation error: {e}")
+            LLM_CONTINUATIONS.labels("failed").inc()
+            break
+        if completion is None:
+            LLM_CONTINUATIONS.labels("failed").inc()
+            break
+        record_llm_tokens(prompt_tokens, completion, timing)
         
-        if district_matches and title_matches and len(day_numbers) > 0:
-            logger.info(f"Found {len(district_matches)} districts, {len(title_matches)} places, {len(address_matches)} addresses, {len(day_numbers)} days")
-            
-            for i, day_num in enumerate(day_numbers):
-                day_key = f"Day {day_num}"
-                
-                # Get district for this day
-                district_idx = min(i, len(district_matches) - 1)
-                district = district_matches[district_idx] if district_matches else "City Center"
-                
-                # Get date for this day  
-                date_idx = min(i, len(date_matches) - 1)
-                date = date_matches[date_idx] if date_matches else ""
-                
-                # Get titles for this day (5 activities per day)
-                start_title_idx = i * 5
-                day_titles = title_matches[start_title_idx:start_title_idx + 5]
-                day_addresses = address_matches[start_title_idx:start_title_idx + 5] if address_matches else []
-                
-                while len(day_titles) < 5:
-                    day_titles.append(f"Local activity in {district}")
-                while len(day_addresses) < 5:
-                    day_addresses.append(f"{district}, nearby")
-                
-                result[day_key] = {
-                    "date": date,
-                    "district": district,
-                    "09:00": {"type": "breakfast", "title": day_titles[0], "location": district, "address": day_addresses[0]},
-                    "11:00": {"type": "sightseeing", "title": day_titles[1], "location": district, "address": day_addresses[1]},
-                    "13:00": {"type": "lunch", "title": day_titles[2], "location": district, "address": day_addresses[2]},
-                    "15:30": {"type": "activity", "title": day_titles[3], "location": district, "address": day_addresses[3]},
-                    "19:00": {"type": "dinner", "title": day_titles[4], "location": district, "address": day_addresses[4]}
-                }
-            
-            if result:
-                logger.info(f"Smart extraction created {len(result)} days with real place names and addresses")
-                return result
-                
-    except Exception as e:
-        logger.error(f"Smart content extraction failed: {e}")
+        added = 0
+        for day_key, day_data in complete_days(completion.text).items():
+            number = numbers.setdefault(day_key, next_day + len(numbers))
+            if number <= last_day:
+                days[f"Day {number}"] = day_data
+                added += 1
+        if not added:
+            LLM_CONTINUATIONS.labels("empty").inc()
+            break
+        LLM_CONTINUATIONS.labels("ok").inc()
     
-    # Strategy 8: Return None to trigger fallback
-    return None
+    stitched = {day_key: days[day_key] for day_key in sorted(days, key=day_number)}
+    logger.info(f"Stitched {len(stitched)}/{expected_days} days from a cut-off answer and its continuations")
+    return json.dumps(stitched)
 
-def create_geographic_prompt_with_addresses(request: ItineraryRequest, start_date: datetime, end_date: datetime, days_count: int) -> str:
-    """Create a detailed geographic prompt that requests specific addresses"""
+def clean_and_parse_json(llm_response: str) -> dict:
+    """Parse an LLM itinerary answer, repairing fences, day keys, trailing commas and truncation"""
+    result, strategy = parse_itinerary_response(llm_response)
+    PARSE_OUTCOMES.labels(strategy or "failed").inc()
+    if strategy == "truncated":
+        logger.info("JSON appeared truncated, kept complete days only")
+    elif strategy == "extracted":
+        logger.info(f"Smart extraction created {len(result)} days with real place names and addresses")
+    elif strategy is None:
+        logger.error(f"JSON cleaning failed: {llm_response[:500]}...")
+    return result
+
+def _prompt_preamble(request: ItineraryRequest, days_count: int, day_offset: int = 0, total_days: int = None,
+                     avoid_districts: Optional[List[str]] = None) -> str:
+    """Task line, requirements, preferences and address examples shared by both prompt modes"""
+    if total_days and total_days != days_count:
+        span = f"day {day_offset + 1}" if days_count == 1 else f"days {day_offset + 1}-{day_offset + days_count}"
+        prompt = f"""Create {span} of a {total_days}-day {request.destination} itinerary with SPECIFIC ADDRESSES."""
+    else:
+        prompt = f"""Create a {days_count}-day {request.destination} itinerary with SPECIFIC ADDRESSES."""
     
-    prompt = f"""Create a {days_count}-day {request.destination} itinerary with SPECIFIC ADDRESSES.
+    prompt += """
 
 CRITICAL REQUIREMENTS:
 - Each day = ONE neighborhood/district only (walking distance)
 - Include REAL, SPECIFIC street addresses for every location
 - Use actual restaurant names, attraction names, and their real addresses
-- Activities within 2-3km of each other per day
+- Activities within 2-3km of each other per day"""
+    
+    if avoid_districts:
+        prompt += f"\n- Do NOT use these districts, they are covered on other days: {', '.join(avoid_districts)}"
+    
+    prompt += """
 
 PREFERENCES:"""
     
@@ -341,9 +766,32 @@ EXAMPLE ADDRESS FORMAT:
 - "Ristorante Da Valentino, Via del Collegio Romano 20, Rome"
 - "Pantheon, Piazza della Rotonda, Rome" 
 - "Caffè Sant'Eustachio, Piazza di Sant'Eustachio 82, Rome"
+"""
+    return prompt
+
+def _prompt_footer(request: ItineraryRequest) -> str:
+    return f"""
+IMPORTANT: 
+- Use your knowledge of real {request.destination} addresses
+- Include street numbers when possible
+- Restaurants should have real names and addresses
+- Group activities by actual walking-distance neighborhoods
+- Each address should be specific enough for map geocoding
+
+Return ONLY valid JSON with real addresses."""
 
+def create_geographic_prompt_with_addresses(request: ItineraryRequest, start_date: datetime, end_date: datetime, days_count: int,
+                                            day_offset: int = 0, total_days: int = None,
+                                            avoid_districts: Optional[List[str]] = None) -> str:
+    """Create a detailed geographic prompt that requests specific addresses
+
+    day_offset/total_days describe a window of a longer trip (chunked mode);
+    avoid_districts lists neighborhoods already used by other windows.
+    """
+    prompt = _prompt_preamble(request, days_count, day_offset, total_days, avoid_districts)
+    prompt += """
 JSON FORMAT (include real addresses):
-{{"""
+{"""
 
     for i in range(days_count):
         current_date = start_date + timedelta(days=i)
@@ -352,7 +800,7 @@ JSON FORMAT (include real addresses):
             prompt += ","
             
         prompt += f'''
-  "Day {i+1}": {{
+  "Day {day_offset+i+1}": {{
     "date": "{current_date.strftime('%Y-%m-%d')}",
     "district": "Real {request.destination} neighborhood name",
     "09:00": {{
@@ -387,176 +835,648 @@ JSON FORMAT (include real addresses):
     }}
   }}'''
 
+    prompt += """
+}
+"""
+    return prompt + _prompt_footer(request)
+
+def create_compact_prompt(request: ItineraryRequest, start_date: datetime, end_date: datetime, days_count: int,
+                          day_offset: int = 0, total_days: int = None,
+                          avoid_districts: Optional[List[str]] = None) -> str:
+    """Same request as create_geographic_prompt_with_addresses, but the day schema is given once
+
+    Only the day keys and dates are listed per day, so the prompt grows by one
+    short line per day instead of a full five-slot example.
+    """
+    prompt = _prompt_preamble(request, days_count, day_offset, total_days, avoid_districts)
+    prompt += "\nDAYS:"
+    for i in range(days_count):
+        current_date = start_date + timedelta(days=i)
+        prompt += f"\n- Day {day_offset + i + 1}: {current_date.strftime('%Y-%m-%d')}"
+
     prompt += f"""
-}}
 
-IMPORTANT: 
-- Use your knowledge of real {request.destination} addresses
-- Include street numbers when possible
-- Restaurants should have real names and addresses
-- Group activities by actual walking-distance neighborhoods
-- Each address should be specific enough for map geocoding
+JSON FORMAT: one object keyed "Day N" for every day above, each exactly like this (include real addresses):
+{{"Day N": {{"date": "YYYY-MM-DD", "district": "Real {request.destination} neighborhood name",
+  "09:00": {{"type": "breakfast", "title": "Real cafe/restaurant name", "location": "Same district", "address": "Full street address with number and district"}},
+  "11:00": {{"type": "sightseeing", "title": "Real attraction/landmark name", "location": "Same district", "address": "Full street address or piazza name"}},
+  "13:00": {{"type": "lunch", "title": "Real restaurant name", "location": "Same district", "address": "Full street address with number"}},
+  "15:30": {{"type": "activity", "title": "Real museum/activity/park name", "location": "Same district", "address": "Full street address or location"}},
+  "19:00": {{"type": "dinner", "title": "Real restaurant name", "location": "Same district", "address": "Full street address with number"}}}}}}
+"""
+    return prompt + _prompt_footer(request)
 
-Return ONLY valid JSON with real addresses."""
+def build_generation_prompt(request: ItineraryRequest, start_date: datetime, end_date: datetime, days_count: int,
+                            day_offset: int = 0, total_days: int = None,
+                            avoid_districts: Optional[List[str]] = None) -> str:
+    """Prompt in the configured PROMPT_MODE, logging the tokens compact mode saves"""
+    args = (request, start_date, end_date, days_count, day_offset, total_days, avoid_districts)
+    if PROMPT_MODE != "compact":
+        return create_geographic_prompt_with_addresses(*args)
 
+    prompt = create_compact_prompt(*args)
+    compact_tokens = estimate_tokens(prompt)
+    full_tokens = estimate_tokens(create_geographic_prompt_with_addresses(*args))
+    logger.info(f"Compact prompt for {days_count} days: ~{compact_tokens} tokens "
+                f"(saves ~{full_tokens - compact_tokens} vs full prompt)")
     return prompt
 
-async def generate_itinerary_task(trip_id: int, request: ItineraryRequest, generation_id: str):
-    """Background task to generate an itinerary using Groq with address information"""
+def parse_iso_date(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace('Z', '+00:00') if 'Z' in value else value)
+
+def parse_trip_dates(request: ItineraryRequest):
+    """Return (start_date, end_date, days_count) for a request"""
+    start_date = parse_iso_date(request.start_date)
+    end_date = parse_iso_date(request.end_date)
+    days_count = (end_date - start_date).days + 1
+    return start_date, end_date, days_count
+
+def build_fallback_itinerary(request: ItineraryRequest, start_date: datetime, days_count: int, day_offset: int = 0) -> dict:
+    """Template itinerary with sample addresses, used when the LLM gives us nothing usable"""
+    # City-specific fallback data 
+    city_data = {
+        "rome": {
+            "neighborhoods": ["Trastevere", "Centro Storico", "Vatican", "Testaccio", "Monti"],
+            "sample_addresses": [
+                "Via dei Cappuccini 15",
+                "Piazza Navona 25", 
+                "Via del Corso 100",
+                "Via Nazionale 50",
+                "Piazza di Spagna 10"
+            ]
+        },
+        "paris": {
+            "neighborhoods": ["Marais", "Saint-Germain", "Montmartre", "Latin Quarter", "Champs-Élysées"],
+            "sample_addresses": [
+                "Rue de Rivoli 15",
+                "Boulevard Saint-Germain 25",
+                "Place du Tertre 5",
+                "Rue Mouffetard 30",
+                "Avenue des Champs-Élysées 100"
+            ]
+        },
+        "barcelona": {
+            "neighborhoods": ["Gràcia", "Gothic Quarter", "Eixample", "Born", "Barceloneta"],
+            "sample_addresses": [
+                "Carrer Gran de Gràcia 15",
+                "Plaça del Pi 5",
+                "Passeig de Gràcia 100", 
+                "Carrer Montcada 25",
+                "Passeig Marítim 10"
+            ]
+        }
+    }
+    
+    destination_key = request.destination.lower()
+    city_info = city_data.get(destination_key, {
+        "neighborhoods": ["City Center", "Historic District", "Arts Quarter", "Waterfront", "Old Town"],
+        "sample_addresses": ["Main Street 100", "Central Square 25", "Historic Avenue 50", "Riverside Road 75", "Culture Street 30"]
+    })
+    
+    itinerary = {}
+    
+    for i in range(days_count):
+        current_date = start_date + timedelta(days=i)
+        day_key = f"Day {day_offset+i+1}"
+        neighborhood = city_info["neighborhoods"][(day_offset + i) % len(city_info["neighborhoods"])]
+        base_address = city_info["sample_addresses"][(day_offset + i) % len(city_info["sample_addresses"])]
+        
+        itinerary[day_key] = {
+            "date": current_date.strftime("%Y-%m-%d"),
+            "district": neighborhood,
+            "09:00": {
+                "type": "breakfast", 
+                "title": f"Local breakfast café in {neighborhood}", 
+                "location": neighborhood,
+                "address": f"Breakfast Café, {base_address}, {neighborhood}"
+            },
+            "11:00": {
+                "type": "sightseeing", 
+                "title": f"Main attraction in {neighborhood}", 
+                "location": neighborhood,
+                "address": f"Historic Site, {base_address.replace('100', '25')}, {neighborhood}"
+            },
+            "13:00": {
+                "type": "lunch", 
+                "title": f"Traditional restaurant in {neighborhood}", 
+                "location": neighborhood,
+                "address": f"Local Restaurant, {base_address.replace('100', '50')}, {neighborhood}"
+            },
+            "15:30": {
+                "type": "activity", 
+                "title": f"Cultural activity in {neighborhood}", 
+                "location": neighborhood,
+                "address": f"Cultural Center, {base_address.replace('100', '75')}, {neighborhood}"
+            },
+            "19:00": {
+                "type": "dinner", 
+                "title": f"Dinner restaurant in {neighborhood}", 
+                "location": neighborhood,
+                "address": f"Evening Restaurant, {base_address.replace('100', '90')}, {neighborhood}"
+            }
+        }
+    
+    return itinerary
+
+def split_date_windows(start_date: datetime, days_count: int, window_days: int):
+    """Split a trip into (day_offset, window_start, window_days) windows of at most window_days"""
+    windows = []
+    for offset in range(0, days_count, window_days):
+        windows.append((offset, start_date + timedelta(days=offset), min(window_days, days_count - offset)))
+    return windows
+
+def renumber_window_days(days: dict, day_offset: int, window_start: datetime, window_days: int) -> dict:
+    """Force a window's days onto Day {offset+1}.. and the window's dates, in the order returned"""
+    ordered = sorted((item for item in days.items() if isinstance(item[1], dict)), key=lambda item: day_number(item[0]))
+    renumbered = {}
+    for i, (_, day_data) in enumerate(ordered[:window_days]):
+        day_data["date"] = (window_start + timedelta(days=i)).strftime("%Y-%m-%d")
+        renumbered[f"Day {day_offset + i + 1}"] = day_data
+    return renumbered
+
+def effective_generation_days(days_count: int) -> int:
+    """Days generated back to back: chunked windows run concurrently, so count rounds of windows"""
+    if not (GENERATION_CHUNK_DAYS and days_count > GENERATION_CHUNK_DAYS):
+        return days_count
+    windows = -(-days_count // GENERATION_CHUNK_DAYS)
+    rounds = -(-windows // max(1, GENERATION_CHUNK_CONCURRENCY))
+    return min(days_count, rounds * GENERATION_CHUNK_DAYS)
+
+async def generate_chunked_itinerary(request: ItineraryRequest, start_date: datetime, days_count: int, on_day=None,
+                                     timing: Optional[GenerationTiming] = None, hedge: bool = False):
+    """Generate a long trip as concurrent windows of GENERATION_CHUNK_DAYS days and merge them
+
+    Returns (itinerary, complete); itinerary is None if every window failed and
+    complete is False when some windows had to be filled from the template.
+
+    Windows run under a semaphore of GENERATION_CHUNK_CONCURRENCY. Districts
+    returned by finished windows are passed to windows that start later so
+    days don't repeat. A window that fails is filled from the fallback template.
+    Days streamed to on_day are keyed by their absolute day number, whatever
+    numbering the window's model used.
+    """
+    windows = split_date_windows(start_date, days_count, GENERATION_CHUNK_DAYS)
+    semaphore = asyncio.Semaphore(GENERATION_CHUNK_CONCURRENCY)
+    used_districts: List[str] = []
+    
+    async def run_window(day_offset: int, window_start: datetime, window_days: int):
+        async with semaphore:
+            window_end = window_start + timedelta(days=window_days - 1)
+            prompt = build_generation_prompt(
+                request, window_start, window_end, window_days,
+                day_offset=day_offset, total_days=days_count, avoid_districts=list(used_districts)
+            )
+            logger.info(f"Generating days {day_offset + 1}-{day_offset + window_days} of {days_count}")
+            
+            # The model's own keys are mapped onto the window's days on first sight
+            numbers: Dict[str, int] = {}
+            
+            async def on_window_day(day_key, day_data):
+                index = numbers.setdefault(day_key, len(numbers))
+                if index < window_days:
+                    day_data["date"] = (window_start + timedelta(days=index)).strftime("%Y-%m-%d")
+                    await on_day(f"Day {day_offset + index + 1}", day_data)
+            
+            llm_response = await generate_with_llm(prompt, on_day=on_window_day if on_day is not None else None,
+                                                    expected_days=window_days, timing=timing, hedge=hedge)
+            days = clean_and_parse_json(llm_response) if llm_response else None
+            if not days:
+                logger.warning(f"Window starting at day {day_offset + 1} failed, using fallback days")
+                return build_fallback_itinerary(request, window_start, window_days, day_offset), False
+            
+            days = renumber_window_days(days, day_offset, window_start, window_days)
+            for day_data in days.values():
+                district = day_data.get("district")
+                if district and district not in used_districts:
+                    used_districts.append(district)
+            return days, True
+    
+    results = await asyncio.gather(*(run_window(*window) for window in windows))
+    if not any(succeeded for _, succeeded in results):
+        return None, False
+    
+    itinerary = {}
+    for days, _ in results:
+        itinerary.update(days)
+    logger.info(f"Merged {len(windows)} windows into a {len(itinerary)}-day itinerary")
+    return itinerary, all(succeeded for _, succeeded in results)
+
+async def generate_single_day(request: ItineraryRequest, start_date: datetime, days_count: int, day_num: int,
+                              itinerary: dict, timing: Optional[GenerationTiming] = None,
+                              hedge: bool = False) -> Optional[dict]:
+    """Generate just "Day {day_num}" of a trip, or None if the LLM gave nothing usable
+
+    A one-day prompt costs about 1/N of the whole trip's tokens and time.
+    The other days' districts, neighbours first, are listed as ones to avoid
+    so the new day fits between them instead of repeating them.
+    """
+    day_start = start_date + timedelta(days=day_num - 1)
+    neighbours = [f"Day {day_num - 1}", f"Day {day_num + 1}"]
+    others = neighbours + [key for key in itinerary if key not in neighbours and key != f"Day {day_num}"]
+    districts = []
+    for key in others:
+        district = itinerary.get(key, {}).get("district") if isinstance(itinerary.get(key), dict) else None
+        if district and district not in districts:
+            districts.append(district)
+    
+    prompt = build_generation_prompt(request, day_start, day_start, 1, day_offset=day_num - 1,
+                                     total_days=days_count, avoid_districts=districts)
+    llm_response = await generate_with_llm(prompt, expected_days=1, timing=timing, hedge=hedge)
+    days = clean_and_parse_json(llm_response) if llm_response else None
+    if not days:
+        return None
+    days = renumber_window_days(days, day_num - 1, day_start, 1)
+    return days.get(f"Day {day_num}")
+
+async def reask_low_quality_days(request: ItineraryRequest, start_date: datetime, days_count: int, itinerary: dict,
+                                 timing: Optional[GenerationTiming] = None, hedge: bool = False) -> int:
+    """Regenerate the days that fail the quality check, in place; returns how many were replaced"""
+    report = low_quality_days(itinerary)
+    if not report:
+        return 0
+    if len(report) > QUALITY_REASK_MAX_DAYS:
+        logger.warning(f"{len(report)} low-quality days, more than QUALITY_REASK_MAX_DAYS; keeping them")
+        return 0
+    
+    logger.info(f"Re-asking {len(report)} low-quality days: {report}")
+    day_numbers = [int(day_key.split()[1]) for day_key in report]
+    new_days = await asyncio.gather(*(generate_single_day(request, start_date, days_count, number, itinerary,
+                                                          timing=timing, hedge=hedge)
+                                      for number in day_numbers))
+    replaced = 0
+    for day_key, new_day in zip(report, new_days):
+        if new_day is not None and len(day_issues(new_day)) < len(report[day_key]):
+            itinerary[day_key] = new_day
+            replaced += 1
+            DAY_REGENERATIONS.labels("quality", "replaced").inc()
+        else:
+            DAY_REGENERATIONS.labels("quality", "kept").inc()
+    return replaced
+
+async def generate_itinerary_task(trip_id: int, request: ItineraryRequest, generation_id: str, raise_on_error: bool = False,
+                                  interactive: bool = False, serves_followers: bool = False):
+    """Background task to generate an itinerary with address information
+
+    Returns the saved itinerary (None if generation failed). With
+    raise_on_error the exception propagates (so the job queue can retry)
+    instead of marking the trip as failed. Every finished generation records
+    its timing for the ETA model. Interactive generations may hedge their
+    LLM calls. A batch leader (serves_followers) keeps generating when its
+    own trip is cleared, since the result is still owed to its followers.
+    """
+    timing = None
     try:
         logger.info(f"Starting itinerary generation for trip {trip_id}, generation {generation_id}")
         logger.info(f"Date range: {request.start_date} to {request.end_date}")
         
         # Parse dates
-        start_date = datetime.fromisoformat(request.start_date.replace('Z', '+00:00') if 'Z' in request.start_date else request.start_date)
-        end_date = datetime.fromisoformat(request.end_date.replace('Z', '+00:00') if 'Z' in request.end_date else request.end_date)
-        days_count = (end_date - start_date).days + 1
+        start_date, end_date, days_count = parse_trip_dates(request)
         
         logger.info(f"Calculated days_count: {days_count} (from {start_date.date()} to {end_date.date()})")
+        timing = GenerationTiming(days_count, effective_generation_days(days_count))
         
         # Create detailed prompt with address requirements
-        prompt = create_geographic_prompt_with_addresses(request, start_date, end_date, days_count)
+        prompt = build_generation_prompt(request, start_date, end_date, days_count)
         
         logger.info(f"Generated address-enhanced prompt for {days_count} days")
         
-        # Call Groq API
-        logger.info(f"Sending address-enhanced prompt to Groq for trip {trip_id}")
-        llm_response = await generate_with_groq(prompt)
+        # Serve identical destination/length/preference requests from cache
+        if ITINERARY_CACHE_ENABLED:
+            cached_itinerary = await itinerary_cache.get(prompt, start_date)
+            if cached_itinerary:
+                await save_itinerary_to_db(trip_id, cached_itinerary, "completed", generation_id)
+                timing.outcome = "cached"
+                logger.info(f"Served itinerary for trip {trip_id} from cache")
+                return cached_itinerary
+        
+        # Persist each day as soon as the stream closes it
+        streamed_days = {}
+        partials_refused = False
+        
+        async def save_partial_day(day_key, day_data):
+            nonlocal partials_refused
+            streamed_days[day_key] = day_data
+            if partials_refused:
+                return
+            try:
+                if not await save_itinerary_to_db(trip_id, streamed_days, "processing", generation_id,
+                                                  days_total=days_count):
+                    # The trip was cleared or re-claimed behind our back: stop spending tokens on it,
+                    # unless batch followers are still waiting for this generation
+                    partials_refused = True
+                    if not serves_followers:
+                        generation_registry.cancel(generation_id=generation_id)
+                    return
+                logger.info(f"Saved partial itinerary for trip {trip_id}: {len(streamed_days)}/{days_count} days")
+            except Exception as e:
+                logger.error(f"Failed to save partial itinerary for trip {trip_id}: {e}")
         
-        # Parse response with ROBUST JSON handling
-        if llm_response:
-            logger.info(f"Received response from Groq for trip {trip_id}")
+        async def produce_itinerary():
+            if GENERATION_CHUNK_DAYS and days_count > GENERATION_CHUNK_DAYS:
+                # Long trip: generate windows concurrently instead of one giant call
+                logger.info(f"Using chunked generation for trip {trip_id} ({GENERATION_CHUNK_DAYS}-day windows)")
+                return await generate_chunked_itinerary(request, start_date, days_count, on_day=save_partial_day,
+                                                        timing=timing, hedge=interactive)
+            
+            logger.info(f"Sending address-enhanced prompt to {llm_provider.name} for trip {trip_id}")
+            llm_response = await generate_with_llm(prompt, on_day=save_partial_day, expected_days=days_count,
+                                                    timing=timing, hedge=interactive)
+            
+            # Parse response with ROBUST JSON handling
+            if not llm_response:
+                logger.error(f"No response received from {llm_provider.name} for trip {trip_id}")
+                return None, False
+            
+            logger.info(f"Received response from {llm_provider.name} for trip {trip_id}")
             logger.info(f"Raw response preview: {llm_response[:300]}...")
             
             # Use robust JSON parser
-            itinerary_json = clean_and_parse_json(llm_response)
-            
-            if itinerary_json:
-                # Validate that addresses were included
-                has_addresses = False
-                for day_key, day_data in itinerary_json.items():
-                    if isinstance(day_data, dict):
-                        for time_key, activity in day_data.items():
-                            if isinstance(activity, dict) and 'address' in activity:
-                                has_addresses = True
-                                break
-                        if has_addresses:
-                            break
-                
-                if has_addresses:
-                    logger.info(f" Successfully generated itinerary with addresses for trip {trip_id}")
-                else:
-                    logger.warning(f" Generated itinerary lacks address information for trip {trip_id}")
-                
-                # Save to database
-                await save_itinerary_to_db(trip_id, itinerary_json, "completed", generation_id)
-                logger.info(f"Successfully generated and saved itinerary for trip {trip_id}")
-                return
-            else:
+            parsed = clean_and_parse_json(llm_response)
+            if not parsed:
                 logger.error("All JSON parsing strategies failed")
-        else:
-            logger.error(f"No response received from Groq for trip {trip_id}")
-        
-        # fallback: Create template itinerary with sample addresses
-        logger.info(f"Using enhanced fallback template itinerary with sample addresses for trip {trip_id}")
-        
-        # City-specific fallback data 
-        city_data = {
-            "rome": {
-                "neighborhoods": ["Trastevere", "Centro Storico", "Vatican", "Testaccio", "Monti"],
-                "sample_addresses": [
-                    "Via dei Cappuccini 15",
-                    "Piazza Navona 25", 
-                    "Via del Corso 100",
-                    "Via Nazionale 50",
-                    "Piazza di Spagna 10"
-                ]
-            },
-            "paris": {
-                "neighborhoods": ["Marais", "Saint-Germain", "Montmartre", "Latin Quarter", "Champs-Élysées"],
-                "sample_addresses": [
-                    "Rue de Rivoli 15",
-                    "Boulevard Saint-Germain 25",
-                    "Place du Tertre 5",
-                    "Rue Mouffetard 30",
-                    "Avenue des Champs-Élysées 100"
-                ]
-            },
-            "barcelona": {
-                "neighborhoods": ["Gràcia", "Gothic Quarter", "Eixample", "Born", "Barceloneta"],
-                "sample_addresses": [
-                    "Carrer Gran de Gràcia 15",
-                    "Plaça del Pi 5",
-                    "Passeig de Gràcia 100", 
-                    "Carrer Montcada 25",
-                    "Passeig Marítim 10"
-                ]
-            }
-        }
+            return parsed, True
         
-        destination_key = request.destination.lower()
-        city_info = city_data.get(destination_key, {
-            "neighborhoods": ["City Center", "Historic District", "Arts Quarter", "Waterfront", "Old Town"],
-            "sample_addresses": ["Main Street 100", "Central Square 25", "Historic Avenue 50", "Riverside Road 75", "Culture Street 30"]
-        })
+        async def produce_geocoded_itinerary():
+            # Checked, geocoded and route-ordered before sharing and caching, so followers and cache hits get it all
+            itinerary_json, cacheable = await produce_itinerary()
+            if itinerary_json and QUALITY_REASK_MAX_DAYS:
+                await reask_low_quality_days(request, start_date, days_count, itinerary_json, timing=timing,
+                                             hedge=interactive)
+            if itinerary_json and GEOCODE_ACTIVITIES:
+                await activity_geocoder.annotate(itinerary_json, request.destination)
+            if itinerary_json and OPTIMIZE_ROUTES:
+                route_optimizer.optimize(itinerary_json)
+            return itinerary_json, cacheable
         
-        itinerary = {}
+        # Identical in-flight prompts (same destination, span and preferences) share one call
+        (itinerary_json, cacheable), shared = await llm_single_flight.do(make_cache_key(prompt),
+                                                                         produce_geocoded_itinerary)
+        if shared and itinerary_json:
+            logger.info(f"Trip {trip_id} shared an in-flight generation with an identical prompt")
+            itinerary_json = redate_itinerary(itinerary_json, start_date)
         
-        for i in range(days_count):
-            current_date = start_date + timedelta(days=i)
-            day_key = f"Day {i+1}"
-            neighborhood = city_info["neighborhoods"][i % len(city_info["neighborhoods"])]
-            base_address = city_info["sample_addresses"][i % len(city_info["sample_addresses"])]
+        if itinerary_json:
+            # Validate that addresses were included
+            has_addresses = False
+            for day_key, day_data in itinerary_json.items():
+                if isinstance(day_data, dict):
+                    for time_key, activity in day_data.items():
+                        if isinstance(activity, dict) and 'address' in activity:
+                            has_addresses = True
+                            break
+                    if has_addresses:
+                        break
             
-            itinerary[day_key] = {
-                "date": current_date.strftime("%Y-%m-%d"),
-                "district": neighborhood,
-                "09:00": {
-                    "type": "breakfast", 
-                    "title": f"Local breakfast café in {neighborhood}", 
-                    "location": neighborhood,
-                    "address": f"Breakfast Café, {base_address}, {neighborhood}"
-                },
-                "11:00": {
-                    "type": "sightseeing", 
-                    "title": f"Main attraction in {neighborhood}", 
-                    "location": neighborhood,
-                    "address": f"Historic Site, {base_address.replace('100', '25')}, {neighborhood}"
-                },
-                "13:00": {
-                    "type": "lunch", 
-                    "title": f"Traditional restaurant in {neighborhood}", 
-                    "location": neighborhood,
-                    "address": f"Local Restaurant, {base_address.replace('100', '50')}, {neighborhood}"
-                },
-                "15:30": {
-                    "type": "activity", 
-                    "title": f"Cultural activity in {neighborhood}", 
-                    "location": neighborhood,
-                    "address": f"Cultural Center, {base_address.replace('100', '75')}, {neighborhood}"
-                },
-                "19:00": {
-                    "type": "dinner", 
-                    "title": f"Dinner restaurant in {neighborhood}", 
-                    "location": neighborhood,
-                    "address": f"Evening Restaurant, {base_address.replace('100', '90')}, {neighborhood}"
-                }
-            }
+            if has_addresses:
+                logger.info(f" Successfully generated itinerary with addresses for trip {trip_id}")
+            else:
+                logger.warning(f" Generated itinerary lacks address information for trip {trip_id}")
+            
+            # Save to database
+            await save_itinerary_to_db(trip_id, itinerary_json, "completed", generation_id)
+            timing.outcome = "shared" if shared else "generated"
+            if ITINERARY_CACHE_ENABLED and has_addresses and cacheable:
+                await itinerary_cache.put(prompt, itinerary_json)
+            logger.info(f"Successfully generated and saved itinerary for trip {trip_id}")
+            return itinerary_json
+        
+        # fallback: Create template itinerary with sample addresses
+        logger.info(f"Using enhanced fallback template itinerary with sample addresses for trip {trip_id}")
+        itinerary = build_fallback_itinerary(request, start_date, days_count)
         
         # Save fallback itinerary with addresses
         await save_itinerary_to_db(trip_id, itinerary, "completed", generation_id)
+        timing.outcome = "fallback"
         logger.info(f"Generated and saved enhanced fallback itinerary with addresses for trip {trip_id}")
+        return itinerary
         
     except Exception as e:
         logger.error(f"Error generating itinerary for trip {trip_id}: {str(e)}")
+        if raise_on_error:
+            raise
         # Mark as failed in database
         try:
             await save_itinerary_to_db(trip_id, {"error": str(e)}, "failed", generation_id)
         except:
             pass
+    finally:
+        if timing is not None and timing.outcome:
+            GENERATION_LATENCY.labels(timing.outcome).observe(timing.wall_seconds)
+            try:
+                await eta_model.record(trip_id, generation_id, timing)
+            except Exception as e:
+                logger.error(f"Failed to record generation timing for trip {trip_id}: {e}")
+
+async def run_generation_job(job):
+    """Job queue handler: run one queued generation
+
+    Batch jobs carry "batch_followers": other trips with the same prompt,
+    which receive this job's itinerary re-dated to their own start dates.
+    Jobs from a single /generate call are marked "interactive".
+    """
+    payload = dict(job.payload)
+    followers = payload.pop("batch_followers", None) or []
+    interactive = bool(payload.pop("interactive", False))
+    request = ItineraryRequest(**payload)
+    # A batch leader's generation also serves its followers, so clearing the leader's trip
+    # alone doesn't stop it (its own write is still refused); only clearing everything does
+    try:
+        itinerary = await generation_registry.run(
+            None if followers else job.trip_id, job.generation_id,
+            generate_itinerary_task(job.trip_id, request, job.generation_id, raise_on_error=True,
+                                    interactive=interactive, serves_followers=bool(followers)))
+    except GenerationCancelled:
+        logger.info(f"Job {job.id} for trip {job.trip_id} cancelled")
+        return
+    if followers and itinerary:
+        entries = [(follower["trip_id"], redate_itinerary(itinerary, parse_iso_date(follower["start_date"])),
+                    follower["generation_id"])
+                   for follower in followers]
+        await save_itineraries_bulk(entries)
+        logger.info(f"Job {job.id} also completed {len(entries)} batch trips with the same prompt")
+
+async def mark_generation_failed(job, error: str):
+    """Job queue give-up hook: the trip's generation (and its batch followers) ran out of attempts"""
+    await save_itinerary_to_db(job.trip_id, {"error": error}, "failed", job.generation_id)
+    followers = job.payload.get("batch_followers") or []
+    if followers:
+        await save_itineraries_bulk([(follower["trip_id"], {"error": error}, follower["generation_id"])
+                                     for follower in followers], "failed")
+
+job_queue = JobQueue(
+    run_generation_job,
+    on_give_up=mark_generation_failed,
+    concurrency=GENERATION_WORKERS,
+    max_attempts=GENERATION_MAX_ATTEMPTS,
+    visibility_timeout=GENERATION_VISIBILITY_TIMEOUT,
+    backoff_base=GENERATION_RETRY_BACKOFF,
+)
+
+def prompt_fingerprint(request: ItineraryRequest, start_date: datetime, end_date: datetime, days_count: int) -> str:
+    """Cache key of the prompt a request will be generated from (start date excluded)"""
+    builder = create_compact_prompt if PROMPT_MODE == "compact" else create_geographic_prompt_with_addresses
+    return make_cache_key(builder(request, start_date, end_date, days_count))
+
+def group_batch_by_prompt(trips: List[BatchTripRequest]) -> List[tuple]:
+    """Group batch trips that would send the same prompt: [(leader, [followers...]), ...] in request order"""
+    groups: Dict[str, tuple] = {}
+    for trip in trips:
+        start_date, end_date, days_count = parse_trip_dates(trip)
+        key = prompt_fingerprint(trip, start_date, end_date, days_count)
+        if key in groups:
+            groups[key][1].append(trip)
+        else:
+            groups[key] = (trip, [])
+    return list(groups.values())
+
+@app.post("/generate/batch", status_code=202)
+async def start_batch_generation(batch: BatchGenerateRequest):
+    """Start generating itineraries for many trips at once
+
+    All trips are claimed, recorded and enqueued in one transaction. Trips
+    that would send the same prompt share one generation. Batch jobs queue
+    behind single-trip requests; poll GET /generate/batch/{batch_id}.
+    """
+    if not batch.trips:
+        raise HTTPException(status_code=400, detail="Batch contains no trips")
+    if len(batch.trips) > GENERATION_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds {GENERATION_BATCH_MAX} trips")
+    
+    trip_ids = [trip.trip_id for trip in batch.trips]
+    if len(set(trip_ids)) != len(trip_ids):
+        raise HTTPException(status_code=400, detail="Batch contains duplicate trip IDs")
+    
+    days_totals = []
+    for trip in batch.trips:
+        try:
+            days_totals.append(parse_trip_dates(trip)[2])
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid dates for trip {trip.trip_id}")
+    
+    generation_ids = [str(uuid.uuid4()) for _ in batch.trips]
+    batch_id = str(uuid.uuid4())
+    
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            # One statement claims every trip that isn't already processing/completed
+            rows = await conn.fetch(
+                f"""WITH u AS (
+                       UPDATE trips AS t
+                       SET generation_status = 'processing', generation_id = b.generation_id,
+                           generation_started_at = NOW(), generation_days_completed = 0,
+                           generation_days_total = b.days_total
+                       FROM UNNEST($1::int[], $2::uuid[], $3::int[]) AS b(id, generation_id, days_total)
+                       WHERE t.id = b.id
+                         AND COALESCE(t.generation_status, 'pending') NOT IN ('processing', 'completed')
+                       RETURNING t.id, t.generation_status, t.generation_id, t.generation_started_at,
+                                 t.generation_days_completed, t.generation_days_total
+                   )
+                   SELECT u.id, u.generation_id::text AS generation_id, {NOTIFY_PAYLOAD_SQL} FROM u""",
+                trip_ids, generation_ids, days_totals
+            )
+            claimed = {row["id"]: row["generation_id"] for row in rows}
+            
+            skipped = []
+            if len(claimed) < len(trip_ids):
+                existing = await conn.fetch(
+                    "SELECT id, generation_status FROM trips WHERE id = ANY($1::int[])",
+                    [trip_id for trip_id in trip_ids if trip_id not in claimed]
+                )
+                statuses = {row["id"]: row["generation_status"] for row in existing}
+                for trip_id in trip_ids:
+                    if trip_id in claimed:
+                        continue
+                    if trip_id not in statuses:
+                        reason = "Trip not found"
+                    elif statuses[trip_id] == "completed":
+                        reason = "Itinerary already exists"
+                    else:
+                        reason = "Itinerary generation in progress"
+                    skipped.append({"trip_id": trip_id, "reason": reason})
+            
+            groups = group_batch_by_prompt([trip for trip in batch.trips if trip.trip_id in claimed])
+            if claimed:
+                await conn.execute(
+                    "INSERT INTO generation_batches (id, total, unique_prompts) VALUES ($1, $2, $3)",
+                    batch_id, len(claimed), len(groups)
+                )
+                await conn.execute(
+                    """INSERT INTO generation_batch_items (batch_id, trip_id, generation_id)
+                       SELECT $1, b.trip_id, b.generation_id
+                       FROM UNNEST($2::int[], $3::uuid[]) AS b(trip_id, generation_id)""",
+                    batch_id, list(claimed), list(claimed.values())
+                )
+            
+            jobs = []
+            for leader, followers in groups:
+                payload = leader.model_dump(exclude={"trip_id"})
+                if followers:
+                    payload["batch_followers"] = [
+                        {"trip_id": follower.trip_id, "generation_id": claimed[follower.trip_id],
+                         "start_date": follower.start_date}
+                        for follower in followers
+                    ]
+                jobs.append((leader.trip_id, claimed[leader.trip_id], payload))
+            await job_queue.enqueue_many(jobs, priority=GENERATION_BATCH_PRIORITY, conn=conn)
+    
+    logger.info(f"Batch {batch_id}: {len(claimed)} trips claimed as {len(jobs)} jobs, {len(skipped)} skipped")
+    return {
+        "batch_id": batch_id if claimed else None,
+        "accepted": len(claimed),
+        "unique_prompts": len(jobs),
+        "skipped": skipped,
+    }
+
+@app.get("/generate/batch/{batch_id}")
+async def get_batch_progress(batch_id: str):
+    """Aggregate progress of a batch (trips regenerated or cleared since count as superseded)"""
+    try:
+        batch_uuid = uuid.UUID(batch_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Batch ID must be a UUID")
+    
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(
+            """SELECT i.trip_id, t.generation_status,
+                      (t.generation_id IS NOT DISTINCT FROM i.generation_id) AS current,
+                      t.generation_days_completed, t.generation_days_total
+               FROM generation_batch_items i
+               LEFT JOIN trips t ON t.id = i.trip_id
+               WHERE i.batch_id = $1
+               ORDER BY i.trip_id""",
+            batch_uuid
+        )
+    if not rows:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    
+    counts = {"processing": 0, "completed": 0, "failed": 0, "superseded": 0}
+    days_completed = days_total = 0
+    trips = []
+    for row in rows:
+        status = row["generation_status"] if row["current"] else "superseded"
+        if status not in counts:
+            status = "failed"
+        counts[status] += 1
+        trip_days_total = row["generation_days_total"] or 0
+        trip_days_completed = trip_days_total if status == "completed" else (row["generation_days_completed"] or 0)
+        days_completed += min(trip_days_completed, trip_days_total)
+        days_total += trip_days_total
+        trips.append({"trip_id": row["trip_id"], "status": status,
+                      "days_completed": trip_days_completed, "days_total": trip_days_total})
+    
+    return {
+        "batch_id": batch_id,
+        "total": len(rows),
+        **counts,
+        "days_completed": days_completed,
+        "days_total": days_total,
+        "progress": round(days_completed / days_total, 4) if days_total else 0.0,
+        "done": counts["processing"] == 0,
+        "trips": trips,
+    }
 
 @app.post("/generate/{trip_id}", status_code=202)
-async def start_itinerary_generation(trip_id: str, request: ItineraryRequest, background_tasks: BackgroundTasks):
+async def start_itinerary_generation(trip_id: str, request: ItineraryRequest):
     """Start generating a personalized travel itinerary with addresses"""
     
     try:
@@ -564,22 +1484,156 @@ async def start_itinerary_generation(trip_id: str, request: ItineraryRequest, ba
     except ValueError:
         raise HTTPException(status_code=400, detail="Trip ID must be an integer")
     
-    # Check if itinerary already exists
-    existing = await get_itinerary_from_db(trip_id_int)
-    if existing and existing['generation_status'] == 'completed':
-        return {"message": "Itinerary already exists", "itinerary_id": trip_id}
+    try:
+        _, _, days_total = parse_trip_dates(request)
+    except ValueError:
+        days_total = None
     
-    # Check if generation is already in progress
-    if existing and existing['generation_status'] == 'processing':
+    # Claim the trip in one statement so double-clicks and retries can't both start,
+    # and enqueue in the same transaction so a claimed trip always has a job
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            generation_id = await create_generation_record(trip_id_int, days_total, conn=conn)
+            if generation_id is not None:
+                # Hand the work to the job queue; workers may live in another process
+                await job_queue.enqueue(trip_id_int, generation_id, {**request.model_dump(), "interactive": True},
+                                        conn=conn)
+    
+    if generation_id is None:
+        existing = await get_itinerary_from_db(trip_id_int)
+        if not existing:
+            raise HTTPException(status_code=404, detail="Trip not found")
+        
+        # Check if itinerary already exists
+        if existing['generation_status'] == 'completed':
+            return {"message": "Itinerary already exists", "itinerary_id": trip_id}
+        
+        # Generation is already in progress
         return {"message": "Itinerary generation in progress", "itinerary_id": trip_id}
     
-    # Create new generation record
-    generation_id = await create_generation_record(trip_id_int)
+    return {"message": "Itinerary generation started", "itinerary_id": trip_id}
+
+async def load_trip_for_regeneration(trip_id: int):
+    """Trip fields and the stored itinerary needed to regenerate one of its days"""
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow(
+            """SELECT destination, start_date, end_date, itinerary, itinerary_hash,
+                      generation_status, generation_id::text AS generation_id
+               FROM trips WHERE id = $1""",
+            trip_id
+        )
+    if row is None:
+        return None
+    result = dict(row)
+    if isinstance(result["itinerary"], str):
+        result["itinerary"] = json.loads(result["itinerary"])
+    return result
+
+@app.post("/regenerate/{trip_id}/day/{day_num}")
+async def regenerate_day(trip_id: int, day_num: int, request: Optional[ItineraryRequest] = None):
+    """Regenerate one day of a completed itinerary and splice it in place
+
+    The body is the trip's generation request; without one the destination
+    and dates are read from the trip (no preferences). Other days are left
+    untouched, and a concurrent change to the itinerary is merged by
+    re-reading it rather than overwritten.
+    """
+    trip = await load_trip_for_regeneration(trip_id)
+    if trip is None:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    if trip["generation_status"] != "completed" or not isinstance(trip["itinerary"], dict):
+        raise HTTPException(status_code=409, detail="Only a completed itinerary can have a day regenerated")
     
-    # Start background task
-    background_tasks.add_task(generate_itinerary_task, trip_id_int, request, generation_id)
+    if request is None:
+        request = ItineraryRequest(destination=trip["destination"], start_date=trip["start_date"].isoformat(),
+                                   end_date=trip["end_date"].isoformat())
+    start_date, _, days_count = parse_trip_dates(request)
+    if not 1 <= day_num <= days_count:
+        raise HTTPException(status_code=400, detail=f"Day must be between 1 and {days_count}")
     
-    return {"message": "Itinerary generation started", "itinerary_id": trip_id}
+    day_key = f"Day {day_num}"
+    previous_issues = day_issues(trip["itinerary"].get(day_key))
+    started = time.monotonic()
+    new_day = await generate_single_day(request, start_date, days_count, day_num, trip["itinerary"], hedge=True)
+    if new_day is None:
+        DAY_REGENERATIONS.labels("request", "failed").inc()
+        raise HTTPException(status_code=502, detail=f"{llm_provider.name} did not return a usable day")
+    
+    if GEOCODE_ACTIVITIES:
+        await activity_geocoder.annotate({day_key: new_day}, request.destination)
+    if OPTIMIZE_ROUTES:
+        route_optimizer.optimize({day_key: new_day})
+    
+    for _ in range(3):
+        itinerary = {**trip["itinerary"], day_key: new_day}
+        if await save_itinerary_to_db(trip_id, itinerary, "completed", trip["generation_id"],
+                                      expected_hash=trip["itinerary_hash"]):
+            break
+        trip = await load_trip_for_regeneration(trip_id)
+        if trip is None or trip["generation_status"] != "completed" or not isinstance(trip["itinerary"], dict):
+            raise HTTPException(status_code=409, detail="The itinerary was cleared or regenerated meanwhile")
+    else:
+        raise HTTPException(status_code=409, detail="The itinerary kept changing; try again")
+    
+    DAY_REGENERATIONS.labels("request", "replaced").inc()
+    logger.info(f"Regenerated {day_key} of trip {trip_id} in {time.monotonic() - started:.1f}s")
+    return {"day": day_key, "itinerary": {day_key: new_day},
+            "previous_issues": previous_issues, "issues": day_issues(new_day)}
+
+def describe_generation_status(status: str, started_at: Optional[float] = None, days_completed: Optional[int] = None,
+                               days_total: Optional[int] = None) -> dict:
+    """StatusResponse body for a trip's generation state (started_at is a Unix timestamp)"""
+    if status == 'processing':
+        elapsed = time.time() - started_at if started_at else 0
+        days_completed = days_completed or 0
+        eta = eta_model.remaining_seconds(effective_generation_days(days_total or 1), elapsed,
+                                          days_completed, days_total)
+        message = "Itinerary generation in progress"
+        if days_total:
+            message += f" ({days_completed}/{days_total} days)"
+        return {"status": "processing", "message": message, "eta": eta,
+                "days_completed": days_completed, "days_total": days_total}
+    elif status == 'completed':
+        return {"status": "completed", "message": "Itinerary generation completed"}
+    else:
+        return {"status": "failed", "message": "Itinerary generation failed"}
+
+async def load_generation_status(trip_id: int) -> Optional[dict]:
+    """Current status of a trip read from the database, or None if it doesn't exist"""
+    itinerary_data = await get_itinerary_from_db(trip_id)
+    if not itinerary_data:
+        return None
+    started_at = itinerary_data['generation_started_at']
+    return describe_generation_status(
+        itinerary_data['generation_status'],
+        started_at.timestamp() if hasattr(started_at, 'timestamp') else None,
+        itinerary_data['generation_days_completed'],
+        itinerary_data['generation_days_total'],
+    )
+
+async def follow_generation_status(trip_id: int, queue: asyncio.Queue, snapshot: dict):
+    """Yield the snapshot, then every pushed status change until the generation finishes
+
+    Yields None when STATUS_STREAM_HEARTBEAT seconds pass without a change, so
+    the caller can keep its connection alive (and notice a vanished client).
+    """
+    current = snapshot
+    yield current
+    while current["status"] == "processing":
+        try:
+            event = await asyncio.wait_for(queue.get(), timeout=STATUS_STREAM_HEARTBEAT)
+        except asyncio.TimeoutError:
+            yield None
+            continue
+        if event is RESYNC:
+            # The LISTEN connection was re-established; changes may have been missed
+            current = await load_generation_status(trip_id)
+            if current is None:
+                return
+        else:
+            current = describe_generation_status(event.get("status"), event.get("started_at"),
+                                                 event.get("days_completed"), event.get("days_total"))
+        yield current
 
 @app.get("/status/{trip_id}", response_model=StatusResponse)
 async def get_generation_status_endpoint(trip_id: str):
@@ -589,64 +1643,132 @@ async def get_generation_status_endpoint(trip_id: str):
     except ValueError:
         raise HTTPException(status_code=400, detail="Trip ID must be an integer")
     
-    itinerary_data = await get_itinerary_from_db(trip_id_int)
+    status = await load_generation_status(trip_id_int)
     
-    if not itinerary_data:
+    if status is None:
+        raise HTTPException(status_code=404, detail="No generation task found for this trip")
+    
+    return status
+
+@app.get("/status/{trip_id}/events")
+async def stream_generation_status(trip_id: str):
+    """Server-sent events: the current status, then each change until completed or failed"""
+    try:
+        trip_id_int = int(trip_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Trip ID must be an integer")
+    
+    # Subscribe before reading the snapshot so no change can slip in between
+    queue = status_broadcaster.open(trip_id_int)
+    snapshot = await load_generation_status(trip_id_int)
+    if snapshot is None:
+        status_broadcaster.close(trip_id_int, queue)
         raise HTTPException(status_code=404, detail="No generation task found for this trip")
     
-    status = itinerary_data['generation_status']
+    async def event_stream():
+        try:
+            async for update in follow_generation_status(trip_id_int, queue, snapshot):
+                if update is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield f"event: status\ndata: {json.dumps(update)}\n\n"
+        finally:
+            status_broadcaster.close(trip_id_int, queue)
     
-    if status == 'processing':
-        creation_time = itinerary_data.get('generation_started_at', datetime.now())
-        if hasattr(creation_time, 'timestamp'):
-            elapsed = time.time() - creation_time.timestamp()
-        else:
-            elapsed = 0
-        eta = max(1, int(15 - elapsed)) 
-        return {"status": "processing", "message": "Itinerary generation in progress", "eta": eta}
-    elif status == 'completed':
-        return {"status": "completed", "message": "Itinerary generation completed"}
-    else:
-        return {"status": "failed", "message": "Itinerary generation failed"}
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.websocket("/ws/status/{trip_id}")
+async def status_websocket(websocket: WebSocket, trip_id: str):
+    """WebSocket variant of /status/{trip_id}/events: one JSON message per status change"""
+    try:
+        trip_id_int = int(trip_id)
+    except ValueError:
+        await websocket.close(code=1008)
+        return
+    
+    queue = status_broadcaster.open(trip_id_int)
+    try:
+        snapshot = await load_generation_status(trip_id_int)
+        await websocket.accept()
+        if snapshot is None:
+            await websocket.send_json({"status": "not_found", "message": "No generation task found for this trip"})
+            await websocket.close(code=4404)
+            return
+        
+        async for update in follow_generation_status(trip_id_int, queue, snapshot):
+            await websocket.send_json(update if update is not None else {"type": "heartbeat"})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        status_broadcaster.close(trip_id_int, queue)
 
 @app.get("/itinerary/{trip_id}", response_model=ItineraryResponse)
-async def get_itinerary(trip_id: str):
-    """Get a generated itinerary with addresses"""
+async def get_itinerary(trip_id: str, partial: bool = False, if_none_match: Optional[str] = Header(None)):
+    """Get a generated itinerary with addresses (partial=true returns the days streamed so far)
+
+    The stored body is returned as-is with its hash as ETag; a matching
+    If-None-Match gets 304 without the body leaving the database.
+    """
     try:
         trip_id_int = int(trip_id)
     except ValueError:
         raise HTTPException(status_code=400, detail="Trip ID must be an integer")
     
-    itinerary_data = await get_itinerary_from_db(trip_id_int)
+    itinerary_data = await load_itinerary_body(trip_id_int, parse_if_none_match(if_none_match))
     
     if not itinerary_data:
         raise HTTPException(status_code=404, detail="Itinerary not found")
     
     if itinerary_data['generation_status'] == 'processing':
-        raise HTTPException(status_code=202, detail="Itinerary generation in progress")
+        if not (partial and itinerary_data['generation_days_completed']):
+            raise HTTPException(status_code=202, detail="Itinerary generation in progress")
     
     if itinerary_data['generation_status'] == 'failed':
         raise HTTPException(status_code=500, detail="Itinerary generation failed")
     
-    # Parse JSON content
-    try:
-        content = json.loads(itinerary_data['itinerary']) if isinstance(itinerary_data['itinerary'], str) else itinerary_data['itinerary']
-    except:
-        content = itinerary_data['itinerary']
+    if not itinerary_data['itinerary_hash']:
+        raise HTTPException(status_code=404, detail="Itinerary not found")
     
-    return {"itinerary": content}
+    headers = {"ETag": make_etag(itinerary_data['itinerary_hash']), "Cache-Control": "no-cache"}
+    if itinerary_data['body'] is None:
+        return Response(status_code=304, headers=headers)
+    return Response(content=itinerary_data['body'], media_type="application/json", headers=headers)
 
 @app.get("/{trip_id}", response_model=ItineraryResponse)
-async def get_itinerary_root(trip_id: str):
-    return await get_itinerary(trip_id)
+async def get_itinerary_root(trip_id: str, if_none_match: Optional[str] = Header(None)):
+    return await get_itinerary(trip_id, if_none_match=if_none_match)
 
 @app.get("/itinerary/itinerary/{trip_id}", response_model=ItineraryResponse)
-async def get_itinerary_alternate(trip_id: str):
-    return await get_itinerary(trip_id)
+async def get_itinerary_alternate(trip_id: str, if_none_match: Optional[str] = Header(None)):
+    return await get_itinerary(trip_id, if_none_match=if_none_match)
+
+async def cancel_generations(conn, trip_id: Optional[int] = None, generation_id: Optional[str] = None) -> int:
+    """Drop pending jobs and stop running generations for a trip (or for every trip)
+
+    Jobs are marked 'cancelled' so no worker claims or retries them, and a
+    cancellation is published for workers in any process; call it in the
+    transaction that clears or deletes the trip. A batch job that also serves
+    other trips is only cancelled when everything is. Returns jobs cancelled.
+    """
+    result = await conn.execute(
+        """UPDATE generation_jobs
+           SET status = 'cancelled', locked_until = NULL, updated_at = NOW()
+           WHERE status IN ('queued', 'running')
+             AND ($1::int IS NULL OR (trip_id = $1 AND NOT (payload ? 'batch_followers')))
+             AND ($2::uuid IS NULL OR generation_id = $2::uuid)""",
+        trip_id, generation_id
+    )
+    await notify_cancel(conn, trip_id, generation_id)
+    return int(result.split()[-1])
 
 @app.delete("/clear/{trip_id}")
 async def clear_itinerary(trip_id: str):
-    """Clear itinerary for a specific trip - Fixed version"""
+    """Clear itinerary for a specific trip, cancelling its generation if one is running"""
     try:
         trip_id_int = int(trip_id)
     except ValueError:
@@ -654,24 +1776,30 @@ async def clear_itinerary(trip_id: str):
     
     try:
         async with db_pool.acquire() as conn:
-            # First check if the trip exists 
-            trip_exists = await conn.fetchval(
-                "SELECT EXISTS(SELECT 1 FROM trips WHERE id = $1)",
-                trip_id_int
-            )
-            
-            if not trip_exists:
-                logger.info(f"Trip {trip_id} not found, but clearing is idempotent")
-                return {"message": f"Cleared itinerary for trip {trip_id} (trip not found, but operation successful)"}
-            
-            # Clear the itinerary
-            result = await conn.execute(
-                """UPDATE trips 
-                   SET itinerary = NULL, generation_status = 'pending', generation_id = NULL, 
-                       generation_started_at = NULL, generation_updated_at = NULL 
-                   WHERE id = $1""", 
-                trip_id_int
-            )
+            async with conn.transaction():
+                # First check if the trip exists (and lock it, so no new claim slips in)
+                row = await conn.fetchrow(
+                    "SELECT generation_id::text AS generation_id FROM trips WHERE id = $1 FOR UPDATE",
+                    trip_id_int
+                )
+                
+                if row is None:
+                    logger.info(f"Trip {trip_id} not found, but clearing is idempotent")
+                    return {"message": f"Cleared itinerary for trip {trip_id} (trip not found, but operation successful)"}
+                
+                # Clear the itinerary
+                await conn.execute(
+                    """UPDATE trips 
+                       SET itinerary = NULL, itinerary_body = NULL, itinerary_hash = NULL,
+                           generation_status = 'pending', generation_id = NULL, 
+                           generation_started_at = NULL, generation_updated_at = NULL 
+                       WHERE id = $1""", 
+                    trip_id_int
+                )
+                if row["generation_id"] is not None:
+                    await cancel_generations(conn, trip_id_int, row["generation_id"])
+            if row["generation_id"] is not None:
+                generation_registry.cancel(trip_id_int, row["generation_id"])
             
             logger.info(f"Successfully cleared itinerary for trip {trip_id}")
             return {"message": f"Cleared itinerary for trip {trip_id}"}
@@ -680,15 +1808,29 @@ async def clear_itinerary(trip_id: str):
         logger.error(f"Error clearing itinerary for trip {trip_id}: {e}")
         return {"message": f"Cleared itinerary for trip {trip_id} (with warning: {str(e)})"}
 
+@app.delete("/generation/{trip_id}")
+async def cancel_trip_generation(trip_id: int):
+    """Stop any queued or running generation for a trip, e.g. because the backend deleted it"""
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            jobs = await cancel_generations(conn, trip_id)
+    generation_registry.cancel(trip_id)
+    logger.info(f"Cancelled generation work for trip {trip_id} ({jobs} jobs)")
+    return {"message": f"Cancelled generation for trip {trip_id}", "jobs_cancelled": jobs}
+
 @app.delete("/clear-all")
 async def clear_all_itineraries():
     """Clear all itineraries (for testing)"""
     async with db_pool.acquire() as conn:
-        await conn.execute(
-            """UPDATE trips 
-               SET itinerary = NULL, generation_status = 'pending', generation_id = NULL,
-                   generation_started_at = NULL, generation_updated_at = NULL"""
-        )
+        async with conn.transaction():
+            await conn.execute(
+                """UPDATE trips 
+                   SET itinerary = NULL, itinerary_body = NULL, itinerary_hash = NULL,
+                       generation_status = 'pending', generation_id = NULL,
+                       generation_started_at = NULL, generation_updated_at = NULL"""
+            )
+            await cancel_generations(conn)
+    generation_registry.cancel()
     
     return {"message": "Cleared all itineraries"}
 
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("itinerary-service")
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at capacity per 60 seconds"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay_for(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 if they are now)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimitSlot:
+    """Handle for one admitted request; tells the limiter how it went"""
+
+    def __init__(self, tokens: int, waited: float):
+        self.tokens = tokens
+        self.waited = waited
+        self.throttled = False
+        self.ok = False
+        self.retry_after: Optional[float] = None
+        self.actual_tokens: Optional[int] = None
+
+    def record_throttle(self, retry_after: Optional[float] = None):
+        """The provider answered 429 (optionally with a retry-after delay)"""
+        self.throttled = True
+        self.retry_after = retry_after
+
+    def record_success(self):
+        """The call produced a usable answer (errors, 5xx and timeouts leave this unset)"""
+        self.ok = True
+
+    def record_usage(self, total_tokens: Optional[int]):
+        """Actual token usage reported by the provider"""
+        self.actual_tokens = total_tokens
+
+
+class AdaptiveRateLimiter:
+    """Requests/minute + tokens/minute buckets with an AIMD concurrency limit.
+
+    Callers wait in FIFO order until both buckets have room and fewer than
+    `limit` requests are in flight. Every success (slot.record_success())
+    raises the limit by 1/limit (about +1 per round-trip); failures leave it
+    alone; a 429 halves it and pauses admission for the provider's
+    retry-after. Set rpm/tpm to 0 to disable a bucket.
+    """
+
+    def __init__(self,
+                 rpm: float = 30,
+                 tpm: float = 0,
+                 max_concurrency: int = 8,
+                 min_concurrency: int = 1,
+                 decrease_factor: float = 0.5,
+                 default_retry_after: float = 2.0):
+        self.request_bucket = TokenBucket(rpm) if rpm else None
+        self.token_bucket = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.decrease_factor = decrease_factor
+        self.default_retry_after = default_retry_after
+        self.limit = float(max_concurrency)
+
+        self._cond = asyncio.Condition()
+        self._queue: deque = deque()
+        self._in_flight = 0
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._waits: deque = deque(maxlen=500)
+
+        self.admitted = 0
+        self.throttled = 0
+
+    def _delay_needed(self, tokens: int) -> float:
+        delay = max(0.0, self._blocked_until - time.monotonic())
+        if self.request_bucket is not None:
+            delay = max(delay, self.request_bucket.delay_for(1))
+        if self.token_bucket is not None:
+            delay = max(delay, self.token_bucket.delay_for(tokens))
+        return delay
+
+    async def acquire(self, tokens: int) -> RateLimitSlot:
+        """Wait (FIFO) until a request estimated at `tokens` may be sent"""
+        ticket = object()
+        enqueued = time.monotonic()
+        async with self._cond:
+            self._queue.append(ticket)
+            try:
+                while True:
+                    timeout = None
+                    if self._queue[0] is ticket:
+                        delay = self._delay_needed(tokens)
+                        if delay <= 0 and self._in_flight < int(self.limit):
+                            break
+                        if delay > 0:
+                            timeout = delay
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+            if self.request_bucket is not None:
+                self.request_bucket.consume(1)
+            if self.token_bucket is not None:
+                self.token_bucket.consume(tokens)
+            self._in_flight += 1
+            self.admitted += 1
+
+        waited = time.monotonic() - enqueued
+        self._waits.append(waited)
+        return RateLimitSlot(tokens, waited)
+
+    async def release(self, slot: RateLimitSlot):
+        """Return a slot and adapt the concurrency limit to how it went"""
+        async with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if slot.throttled:
+                self.throttled += 1
+                retry_after = slot.retry_after if slot.retry_after is not None else self.default_retry_after
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+                # One decrease per throttling episode, not one per rejected request
+                if now - self._last_decrease > retry_after:
+                    self.limit = max(float(self.min_concurrency), self.limit * self.decrease_factor)
+                    self._last_decrease = now
+                    logger.warning(f"LLM provider throttled us; concurrency limit now {int(self.limit)}, pausing {retry_after:.1f}s")
+            else:
+                if slot.ok:
+                    self.limit = min(float(self.max_concurrency), self.limit + 1.0 / max(self.limit, 1.0))
+                if self.token_bucket is not None and slot.actual_tokens is not None and slot.actual_tokens < slot.tokens:
+                    self.token_bucket.refund(slot.tokens - slot.actual_tokens)
+            self._cond.notify_all()
+
+    @asynccontextmanager
+    async def slot(self, tokens: int):
+        """async with limiter.slot(tokens) as slot: ... (released on exit)"""
+        slot = await self.acquire(tokens)
+        try:
+            yield slot
+        finally:
+            await self.release(slot)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+
+        def percentile(p):
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 3)
+
+        return {
+            "concurrency_limit": int(self.limit),
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._in_flight,
+            "queue_depth": len(self._queue),
+            "rpm_limit": self.request_bucket.capacity if self.request_bucket else None,
+            "rpm_available": round(self.request_bucket.tokens, 1) if self.request_bucket else None,
+            "tpm_limit": self.token_bucket.capacity if self.token_bucket else None,
+            "tpm_available": round(self.token_bucket.tokens, 1) if self.token_bucket else None,
+            "paused_for": round(max(0.0, self._blocked_until - time.monotonic()), 3),
+            "admitted": self.admitted,
+            "throttled": self.throttled,
+            "wait_p50": percentile(0.5),
+            "wait_p95": percentile(0.95),
+            "wait_max": round(waits[-1], 3) if waits else 0.0,
+        }
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds from a retry-after header (delta-seconds form only)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
@@ -0,0 +1,181 @@
+import copy
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("itinerary-service")
+
+_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+_WS_RE = re.compile(r"\s+")
+_DAY_KEY_RE = re.compile(r"^Day\s*(\d+)$")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Strip the parts of a prompt that don't change the answer's content.
+
+    Concrete dates are replaced with a placeholder so two trips to the same
+    place with the same length and preferences share a key regardless of
+    when they start; whitespace and case are folded.
+    """
+    normalized = _DATE_RE.sub("<date>", prompt)
+    normalized = _WS_RE.sub(" ", normalized)
+    return normalized.strip().lower()
+
+
+def make_cache_key(prompt: str) -> str:
+    """Content-addressed key for a generation prompt"""
+    return hashlib.sha256(normalize_prompt(prompt).encode("utf-8")).hexdigest()
+
+
+def redate_itinerary(itinerary: Dict[str, Any], start_date: datetime) -> Dict[str, Any]:
+    """Return a copy of a cached itinerary with each "Day N" moved onto start_date + N-1"""
+    redated = copy.deepcopy(itinerary)
+    for day_key, day_data in redated.items():
+        match = _DAY_KEY_RE.match(day_key)
+        if not match or not isinstance(day_data, dict):
+            continue
+        day_date = start_date + timedelta(days=int(match.group(1)) - 1)
+        day_data["date"] = day_date.strftime("%Y-%m-%d")
+    return redated
+
+
+class ItineraryCache:
+    """Two-tier cache of parsed LLM itineraries.
+
+    Tier one is an in-process LRU; tier two is the itinerary_cache table,
+    whose rows expire after ttl_seconds. Entries are looked up by the hash of
+    the normalized prompt and re-dated to the caller's start date on a hit.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: int = 7 * 24 * 3600, purge_interval: int = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.purge_interval = purge_interval
+        self.pool = None
+
+        self._lru: "OrderedDict[str, tuple]" = OrderedDict()
+        self._last_purge = 0.0
+
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.evictions = 0
+        self.expired_purged = 0
+        self.errors = 0
+
+    def attach_pool(self, pool):
+        """Use the given asyncpg pool for the persistent tier"""
+        self.pool = pool
+
+    def _memory_get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._lru.get(key)
+        if entry is None:
+            return None
+        itinerary, expires_at = entry
+        if expires_at < time.time():
+            del self._lru[key]
+            return None
+        self._lru.move_to_end(key)
+        return itinerary
+
+    def _memory_put(self, key: str, itinerary: Dict[str, Any], expires_at: float):
+        self._lru[key] = (itinerary, expires_at)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, prompt: str, start_date: datetime) -> Optional[Dict[str, Any]]:
+        """Look up a prompt; returns a re-dated itinerary or None"""
+        key = make_cache_key(prompt)
+
+        itinerary = self._memory_get(key)
+        if itinerary is not None:
+            self.memory_hits += 1
+            return redate_itinerary(itinerary, start_date)
+
+        if self.pool is not None:
+            try:
+                async with self.pool.acquire() as conn:
+                    row = await conn.fetchrow(
+                        """UPDATE itinerary_cache
+                           SET hit_count = hit_count + 1, last_hit_at = NOW()
+                           WHERE cache_key = $1 AND expires_at > NOW()
+                           RETURNING itinerary, EXTRACT(EPOCH FROM expires_at) AS expires_at""",
+                        key
+                    )
+                if row:
+                    itinerary = json.loads(row["itinerary"]) if isinstance(row["itinerary"], str) else row["itinerary"]
+                    self._memory_put(key, itinerary, float(row["expires_at"]))
+                    self.db_hits += 1
+                    return redate_itinerary(itinerary, start_date)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Itinerary cache lookup failed: {e}")
+
+        self.misses += 1
+        return None
+
+    async def put(self, prompt: str, itinerary: Dict[str, Any]):
+        """Store a freshly generated itinerary in both tiers"""
+        key = make_cache_key(prompt)
+        expires_at = time.time() + self.ttl_seconds
+        self._memory_put(key, copy.deepcopy(itinerary), expires_at)
+        self.puts += 1
+
+        if self.pool is None:
+            return
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(
+                    """INSERT INTO itinerary_cache (cache_key, itinerary, created_at, expires_at)
+                       VALUES ($1, $2, NOW(), NOW() + make_interval(secs => $3))
+                       ON CONFLICT (cache_key) DO UPDATE
+                       SET itinerary = EXCLUDED.itinerary, created_at = NOW(), expires_at = EXCLUDED.expires_at""",
+                    key, json.dumps(itinerary), float(self.ttl_seconds)
+                )
+            if time.time() - self._last_purge > self.purge_interval:
+                await self.purge_expired()
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Itinerary cache store failed: {e}")
+
+    async def purge_expired(self) -> int:
+        """Delete expired rows from the persistent tier"""
+        self._last_purge = time.time()
+        now = time.time()
+        for key in [k for k, (_, expires_at) in self._lru.items() if expires_at < now]:
+            del self._lru[key]
+
+        if self.pool is None:
+            return 0
+        async with self.pool.acquire() as conn:
+            result = await conn.execute("DELETE FROM itinerary_cache WHERE expires_at <= NOW()")
+        purged = int(result.split()[-1]) if result else 0
+        self.expired_purged += purged
+        if purged:
+            logger.info(f"Purged {purged} expired itinerary cache entries")
+        return purged
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.memory_hits + self.db_hits
+        lookups = hits + self.misses
+        return {
+            "entries_in_memory": len(self._lru),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "puts": self.puts,
+            "evictions": self.evictions,
+            "expired_purged": self.expired_purged,
+            "errors": self.errors,
+        }
@@ -0,0 +1,144 @@
+import itertools
+import logging
+import re
+import time
+from functools import lru_cache
+from typing import Any, Dict, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("itinerary-service")
+
+EARTH_RADIUS_M = 6_371_000.0
+
+# Meals keep their time slot; everything else may move between the free slots
+PINNED_TYPES = frozenset({"breakfast", "lunch", "dinner"})
+
+_SLOT_RE = re.compile(r"^\d{2}:\d{2}$")
+
+
+def haversine_matrix(lat: Sequence[float], lng: Sequence[float]) -> np.ndarray:
+    """Pairwise great-circle distances in metres between all points, in one vectorized call"""
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lng = np.radians(np.asarray(lng, dtype=float))
+    half_dlat = (lat[:, None] - lat[None, :]) / 2
+    half_dlng = (lng[:, None] - lng[None, :]) / 2
+    a = np.sin(half_dlat) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(half_dlng) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+@lru_cache(maxsize=None)
+def _permutations(k: int) -> np.ndarray:
+    return np.array(list(itertools.permutations(range(k))), dtype=np.intp).reshape(-1, k)
+
+
+@lru_cache(maxsize=64)
+def _candidate_orders(pinned: Tuple[bool, ...]) -> np.ndarray:
+    """Every stop order that keeps pinned stops in place, original order first"""
+    free = np.array([i for i, is_pinned in enumerate(pinned) if not is_pinned], dtype=np.intp)
+    permutations = _permutations(len(free))
+    orders = np.tile(np.arange(len(pinned), dtype=np.intp), (len(permutations), 1))
+    orders[:, free] = free[permutations]
+    return orders
+
+
+def best_orders(blocks: np.ndarray, pinned: Sequence[bool]) -> np.ndarray:
+    """Shortest open path through each day's stops, for days sharing one pinned pattern
+
+    `blocks` is (days, n, n). Exact: every arrangement of the free stops of
+    every day is scored in one fancy-indexing gather, which beats a solver
+    for the handful of free stops in a day. Ties keep the original order.
+    """
+    orders = _candidate_orders(tuple(pinned))
+    lengths = blocks[:, orders[:, :-1], orders[:, 1:]].sum(axis=2)
+    return orders[np.argmin(lengths, axis=1)]
+
+
+class RouteOptimizer:
+    """Reorders each day's activities to shorten the walk between them.
+
+    Runs inline after generation on itineraries whose activities carry
+    lat/lng. All stops of the trip go into one distance matrix; each day is
+    then solved exactly on its block of it. Days with a stop lacking
+    coordinates, or more than `max_free_stops` movable stops, are left alone.
+    """
+
+    def __init__(self, max_free_stops: int = 7):
+        self.max_free_stops = max_free_stops
+
+        self.itineraries = 0
+        self.days_checked = 0
+        self.days_reordered = 0
+        self.meters_saved = 0.0
+        self.seconds_total = 0.0
+
+    def optimize(self, itinerary: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+        """Reorder in place; returns {day: {"distance_m", "saved_m"}} for every day that was checked"""
+        started = time.perf_counter()
+        days = []
+        for day_key, day_data in itinerary.items():
+            if not isinstance(day_data, dict):
+                continue
+            slots = sorted(key for key, value in day_data.items() if _SLOT_RE.match(key) and isinstance(value, dict))
+            activities = [day_data[slot] for slot in slots]
+            if len(activities) < 3 or not all(_has_coordinates(activity) for activity in activities):
+                continue
+            pinned = [str(activity.get("type", "")).lower() in PINNED_TYPES for activity in activities]
+            if len(pinned) - sum(pinned) > self.max_free_stops:
+                continue
+            days.append((day_key, day_data, slots, activities, pinned))
+        if not days:
+            return {}
+
+        stops = [activity for _, _, _, activities, _ in days for activity in activities]
+        distances = haversine_matrix([stop["lat"] for stop in stops], [stop["lng"] for stop in stops])
+
+        # Days with the same stop count and pinned slots are solved together
+        groups: Dict[Tuple[bool, ...], list] = {}
+        offset = 0
+        for day in days:
+            groups.setdefault(tuple(day[4]), []).append((day, offset))
+            offset += len(day[3])
+
+        report: Dict[str, Dict[str, int]] = {}
+        for pinned, members in groups.items():
+            n = len(pinned)
+            index = np.array([[start + i for i in range(n)] for _, start in members], dtype=np.intp)
+            blocks = distances[index[:, :, None], index[:, None, :]]
+            orders = best_orders(blocks, pinned)
+            rows = np.arange(len(members))[:, None]
+            before = blocks[rows, np.arange(n - 1), np.arange(1, n)].sum(axis=1)
+            after = blocks[rows, orders[:, :-1], orders[:, 1:]].sum(axis=1)
+            for ((day_key, day_data, slots, activities, _), _), order, length, shortest in zip(members, orders, before, after):
+                saved = float(length - shortest)
+                if saved >= 1.0:
+                    for slot, stop in zip(slots, order):
+                        day_data[slot] = activities[stop]
+                    self.days_reordered += 1
+                    self.meters_saved += saved
+                else:
+                    shortest, saved = length, 0.0
+                report[day_key] = {"distance_m": round(float(shortest)), "saved_m": round(saved)}
+        report = {day_key: report[day_key] for day_key, *_ in days}
+
+        elapsed = time.perf_counter() - started
+        self.itineraries += 1
+        self.days_checked += len(days)
+        self.seconds_total += elapsed
+        total_saved = sum(day["saved_m"] for day in report.values())
+        logger.info(f"Route ordering saved {total_saved} m over {len(report)} days in {elapsed * 1000:.1f} ms: "
+                    + ", ".join(f"{day} -{info['saved_m']} m" for day, info in report.items() if info["saved_m"]))
+        return report
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "itineraries": self.itineraries,
+            "days_checked": self.days_checked,
+            "days_reordered": self.days_reordered,
+            "meters_saved": round(self.meters_saved),
+            "avg_ms": round(self.seconds_total * 1000 / self.itineraries, 3) if self.itineraries else 0.0,
+        }
+
+
+def _has_coordinates(activity: Dict[str, Any]) -> bool:
+    return isinstance(activity.get("lat"), (int, float)) and isinstance(activity.get("lng"), (int, float))
@@ -0,0 +1,62 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class _LeaderCancelled(Exception):
+    """The call a follower was waiting on was cancelled; the follower retries"""
+
+
+class SingleFlight:
+    """Process-wide de-duplication of concurrent identical calls.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight await the same result (or exception) instead of starting
+    their own. If the leading call is cancelled, a waiting caller takes over.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, Tuple[asyncio.Future, list]] = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Run fn() once per key; returns (result, shared) where shared means another caller ran it"""
+        while True:
+            call = self._calls.get(key)
+            if call is None:
+                break
+            future, waiters = call
+            waiters.append(None)
+            self.shared += 1
+            try:
+                return await asyncio.shield(future), True
+            except _LeaderCancelled:
+                self.shared -= 1
+                continue
+
+        future = asyncio.get_running_loop().create_future()
+        waiters: list = []
+        self._calls[key] = (future, waiters)
+        self.leaders += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            if waiters:
+                future.set_exception(_LeaderCancelled())
+            raise
+        except Exception as e:
+            if waiters:
+                future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            if self._calls.get(key, (None,))[0] is future:
+                del self._calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": self.in_flight(), "leaders": self.leaders, "shared": self.shared}
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional, Set
+
+import asyncpg
+
+logger = logging.getLogger("itinerary-service")
+
+STATUS_CHANNEL = "generation_status"
+
+# SQL fragment producing the NOTIFY payload for an updated trips row `u`.
+# Kept small (no itinerary body) to stay far below Postgres' 8000 byte limit.
+NOTIFY_PAYLOAD_SQL = f"""pg_notify('{STATUS_CHANNEL}', json_build_object(
+        'trip_id', u.id,
+        'status', u.generation_status,
+        'generation_id', u.generation_id,
+        'started_at', EXTRACT(EPOCH FROM u.generation_started_at),
+        'days_completed', u.generation_days_completed,
+        'days_total', u.generation_days_total
+    )::text)"""
+
+# Queued to every subscriber after the LISTEN connection was re-established;
+# events may have been missed, so consumers should re-read the row
+RESYNC = {"type": "resync"}
+
+
+class StatusBroadcaster:
+    """One shared LISTEN connection fanned out to per-trip subscriber queues.
+
+    Status changes are published by the UPDATE statements themselves (pg_notify
+    runs at commit), so every API process and worker sees every change without
+    polling. Each subscriber gets a small queue; a slow consumer only loses
+    intermediate states, never the latest one.
+    """
+
+    def __init__(self, dsn: Optional[str] = None, queue_size: int = 16, reconnect_delay: float = 1.0,
+                 reconnect_max: float = 30.0):
+        self.dsn = dsn
+        self.queue_size = queue_size
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max = reconnect_max
+
+        self._conn: Optional[asyncpg.Connection] = None
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = defaultdict(set)
+        self._supervisor: Optional[asyncio.Task] = None
+        self._lost = asyncio.Event()
+
+        self.events_received = 0
+        self.events_delivered = 0
+        self.events_dropped = 0
+        self.reconnects = 0
+
+    @property
+    def is_listening(self) -> bool:
+        return self._conn is not None and not self._conn.is_closed()
+
+    async def _connect(self):
+        conn = await asyncpg.connect(self.dsn)
+        conn.add_termination_listener(lambda _conn: self._lost.set())
+        await conn.add_listener(STATUS_CHANNEL, self._on_notify)
+        self._conn = conn
+        self._lost.clear()
+        logger.info(f"Listening for '{STATUS_CHANNEL}' notifications")
+
+    async def _supervise(self):
+        delay = self.reconnect_delay
+        while True:
+            await self._lost.wait()
+            self._conn = None
+            logger.warning("Status LISTEN connection lost, reconnecting")
+            while True:
+                try:
+                    await self._connect()
+                    break
+                except Exception as e:
+                    logger.error(f"Failed to re-establish LISTEN connection: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(self.reconnect_max, delay * 2)
+            delay = self.reconnect_delay
+            self.reconnects += 1
+            for trip_id in list(self._subscribers):
+                self._publish(trip_id, RESYNC)
+
+    async def start(self):
+        """Open the LISTEN connection (retried in the background if it fails)"""
+        if self._supervisor is not None:
+            return
+        try:
+            await self._connect()
+        except Exception as e:
+            logger.error(f"Failed to open LISTEN connection: {e}")
+            self._lost.set()
+        self._supervisor = asyncio.create_task(self._supervise())
+
+    async def stop(self):
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            await asyncio.gather(self._supervisor, return_exceptions=True)
+            self._supervisor = None
+        if self._conn is not None:
+            try:
+                await self._conn.close()
+            except Exception as e:
+                logger.error(f"Error closing LISTEN connection: {e}")
+            self._conn = None
+
+    def _on_notify(self, connection, pid, channel, payload: str):
+        try:
+            event = json.loads(payload)
+            trip_id = int(event["trip_id"])
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Ignoring malformed status notification {payload!r}: {e}")
+            return
+        self.events_received += 1
+        self._publish(trip_id, event)
+
+    def _publish(self, trip_id: int, event: Dict[str, Any]):
+        for queue in self._subscribers.get(trip_id, ()):
+            if queue.full():
+                # Only the newest state matters; make room for it
+                queue.get_nowait()
+                self.events_dropped += 1
+            queue.put_nowait(event)
+            self.events_delivered += 1
+
+    def open(self, trip_id: int) -> asyncio.Queue:
+        """Start receiving status events for a trip; pair with close()"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[trip_id].add(queue)
+        return queue
+
+    def close(self, trip_id: int, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(trip_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[trip_id]
+
+    @asynccontextmanager
+    async def subscribe(self, trip_id: int):
+        """async with broadcaster.subscribe(trip_id) as queue: event = await queue.get()"""
+        queue = self.open(trip_id)
+        try:
+            yield queue
+        finally:
+            self.close(trip_id, queue)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "listening": self.is_listening,
+            "trips_watched": len(self._subscribers),
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+            "events_received": self.events_received,
+            "events_delivered": self.events_delivered,
+            "events_dropped": self.events_dropped,
+            "reconnects": self.reconnects,
+        }
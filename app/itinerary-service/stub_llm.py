@@ -0,0 +1,278 @@
+"""Deterministic OpenAI-compatible stand-in for the LLM, for load tests.
+
+Answers POST /v1/chat/completions (plain or streamed) with an itinerary
+built from the days and destination named in the prompt. Each answer is
+valid, malformed (fences, prose, trailing commas), garbage, truncated, a
+500 or a 429, picked by configurable weights. It is delivered after a
+time-to-first-token drawn from a configurable distribution, then at a
+fixed token rate. The random choices are seeded from the prompt, so the
+same prompt always gets the same answer and timing.
+
+    python stub_llm.py --port 8099 --modes valid=0.8,malformed=0.1,truncated=0.1 \
+        --ttft lognormal:0.8,0.5 --tokens-per-second 250
+
+Point the service at it with LLM_PROVIDER=stub (LLM_BASE_URL if not on
+localhost:8099). GET/PUT /stub/config changes the behaviour at runtime and
+GET /stub/stats counts the answers given.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import time
+from collections import Counter
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import Body, FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from token_budget import estimate_tokens
+
+MODES = ("valid", "malformed", "garbage", "truncated", "error", "rate_limited")
+
+_DISTRICTS = ["Old Town", "Harbour", "University Quarter", "Market District", "Riverside", "Castle Hill",
+              "Arts Quarter", "Station District"]
+_STREETS = ["Main", "Church", "Market", "Mill", "Bridge", "Garden", "Castle", "River", "Station", "Park"]
+_SLOTS = [("09:00", "breakfast", "Cafe"), ("11:00", "sightseeing", "Museum"), ("13:00", "lunch", "Trattoria"),
+          ("15:30", "activity", "Gallery"), ("19:00", "dinner", "Bistro")]
+
+_DAY_RE = re.compile(r"Day (\d+)\D{0,40}?(\d{4}-\d{2}-\d{2})")
+_DESTINATION_RE = re.compile(r"Create (?:a \d+-day|days \d+-\d+ of a \d+-day) (.+?) itinerary")
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """fixed:S | uniform:LOW,HIGH | normal:MEAN,SD | lognormal:MEDIAN,SIGMA | exponential:MEAN (seconds)"""
+    kind, _, args = spec.partition(":")
+    values = [float(value) for value in args.split(",") if value.strip()]
+    kind = kind.strip().lower()
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal" and len(values) == 2:
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1]) if values[0] > 0 else 0.0
+    if kind == "exponential" and len(values) == 1:
+        return lambda rng: rng.expovariate(1.0 / values[0]) if values[0] > 0 else 0.0
+    raise ValueError(f"Unsupported latency spec '{spec}'")
+
+
+def parse_modes(spec: str) -> Dict[str, float]:
+    """'valid=0.8,truncated=0.2' -> weights per mode"""
+    weights = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        mode, _, weight = part.partition("=")
+        mode = mode.strip()
+        if mode not in MODES:
+            raise ValueError(f"Unknown stub mode '{mode}' (expected one of {', '.join(MODES)})")
+        weights[mode] = float(weight or 1)
+    if not weights or sum(weights.values()) <= 0:
+        raise ValueError("At least one stub mode needs a positive weight")
+    return weights
+
+
+class StubConfig:
+    def __init__(self, modes: str = "valid=1", ttft: str = "fixed:0.5", tokens_per_second: float = 250.0,
+                 seed: int = 0, retry_after: float = 1.0):
+        self.update(modes=modes, ttft=ttft, tokens_per_second=tokens_per_second, seed=seed, retry_after=retry_after)
+
+    @classmethod
+    def from_env(cls) -> "StubConfig":
+        return cls(
+            modes=os.getenv("STUB_MODES", "valid=1"),
+            ttft=os.getenv("STUB_TTFT", "fixed:0.5"),
+            tokens_per_second=float(os.getenv("STUB_TOKENS_PER_SECOND", "250")),
+            seed=int(os.getenv("STUB_SEED", "0")),
+            retry_after=float(os.getenv("STUB_RETRY_AFTER", "1")),
+        )
+
+    def update(self, **changes):
+        # Validate everything before applying anything
+        modes = parse_modes(changes["modes"]) if "modes" in changes else None
+        ttft = parse_latency(changes["ttft"]) if "ttft" in changes else None
+        if modes is not None:
+            self.modes_spec, self.modes = changes["modes"], modes
+        if ttft is not None:
+            self.ttft_spec, self.ttft = changes["ttft"], ttft
+        if "tokens_per_second" in changes:
+            self.tokens_per_second = float(changes["tokens_per_second"])
+        if "seed" in changes:
+            self.seed = int(changes["seed"])
+        if "retry_after" in changes:
+            self.retry_after = float(changes["retry_after"])
+
+    def describe(self) -> Dict[str, Any]:
+        return {"modes": self.modes_spec, "ttft": self.ttft_spec, "tokens_per_second": self.tokens_per_second,
+                "seed": self.seed, "retry_after": self.retry_after}
+
+
+def request_rng(seed: int, messages: List[Dict[str, Any]]) -> random.Random:
+    digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()
+    return random.Random(f"{seed}:{digest}")
+
+
+def prompt_days(prompt: str) -> Tuple[str, List[Tuple[int, str]]]:
+    """Destination and (day number, date) pairs requested by an itinerary prompt"""
+    match = _DESTINATION_RE.search(prompt)
+    destination = match.group(1) if match else "Stub City"
+    days = {}
+    for number, day_date in _DAY_RE.findall(prompt):
+        days.setdefault(int(number), day_date)
+    if not days:
+        days = {1: date.today().isoformat()}
+    return destination, sorted(days.items())
+
+
+def build_itinerary(destination: str, days: List[Tuple[int, str]], rng: random.Random) -> Dict[str, Any]:
+    itinerary = {}
+    for number, day_date in days:
+        district = rng.choice(_DISTRICTS)
+        day: Dict[str, Any] = {"date": day_date, "district": district}
+        for slot, slot_type, venue in _SLOTS:
+            street = rng.choice(_STREETS)
+            day[slot] = {
+                "type": slot_type,
+                "title": f"{district} {venue} {rng.randint(1, 99)}",
+                "location": district,
+                "address": f"{street} Street {rng.randint(1, 250)}, {district}, {destination}",
+            }
+        itinerary[f"Day {number}"] = day
+    return itinerary
+
+
+def render_answer(mode: str, itinerary: Dict[str, Any], rng: random.Random) -> Tuple[str, str]:
+    """Answer text and finish_reason for a content-bearing mode"""
+    text = json.dumps(itinerary, indent=2, ensure_ascii=False)
+    if mode == "malformed":
+        # The kinds of damage the service's parser is expected to repair
+        text = re.sub(r'("address": "[^"]*")\n', r"\1,\n", text)
+        text = f"Here is your itinerary:\n```json\n{text}\n```\nEnjoy your trip!"
+    elif mode == "garbage":
+        text = "I'm sorry, but I can't produce an itinerary for those dates. " * rng.randint(1, 4)
+    elif mode == "truncated":
+        return text[:int(len(text) * rng.uniform(0.3, 0.95))], "length"
+    return text, "stop"
+
+
+def fit_max_tokens(text: str, finish_reason: str, max_tokens: Optional[int]) -> Tuple[str, str, int]:
+    """Cut the answer where a real model would run out of max_tokens"""
+    tokens = estimate_tokens(text)
+    if max_tokens and tokens > max_tokens:
+        text = text[:int(len(text) * max_tokens / tokens)]
+        return text, "length", estimate_tokens(text)
+    return text, finish_reason, tokens
+
+
+config = StubConfig.from_env()
+stats: Counter = Counter()
+app = FastAPI(title="Stub LLM", description="Deterministic OpenAI-compatible itinerary generator for load tests")
+
+
+def _completion_body(model: str, text: str, finish_reason: str, prompt_tokens: int, completion_tokens: int) -> dict:
+    return {
+        "id": f"stub-{int(time.time() * 1000)}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish_reason}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+
+def _chunk(model: str, delta: Dict[str, Any], finish_reason: Optional[str] = None, usage: Optional[dict] = None) -> str:
+    chunk = {"object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+             "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+    if usage:
+        chunk["usage"] = usage
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Dict[str, Any] = Body(...)):
+    messages = request.get("messages") or []
+    model = request.get("model", "stub-itinerary")
+    prompt = "\n".join(str(message.get("content", "")) for message in messages)
+    prompt_tokens = estimate_tokens(prompt)
+
+    rng = request_rng(config.seed, messages)
+    mode = rng.choices(list(config.modes), weights=list(config.modes.values()))[0]
+    ttft = config.ttft(rng)
+    stats[mode] += 1
+
+    if mode == "rate_limited":
+        return JSONResponse(status_code=429, headers={"retry-after": str(config.retry_after)},
+                            content={"error": {"message": "Rate limit reached (stub)", "type": "rate_limit"}})
+    if mode == "error":
+        await asyncio.sleep(ttft)
+        return JSONResponse(status_code=500, content={"error": {"message": "Internal error (stub)"}})
+
+    destination, days = prompt_days(prompt)
+    text, finish_reason = render_answer(mode, build_itinerary(destination, days, rng), rng)
+    text, finish_reason, completion_tokens = fit_max_tokens(text, finish_reason, request.get("max_tokens"))
+    per_token = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+
+    if not request.get("stream"):
+        await asyncio.sleep(ttft + completion_tokens * per_token)
+        return _completion_body(model, text, finish_reason, prompt_tokens, completion_tokens)
+
+    async def events():
+        await asyncio.sleep(ttft)
+        yield _chunk(model, {"role": "assistant", "content": ""})
+        # ~4 characters per token; send a few tokens per chunk like real servers do
+        step = 16
+        for start in range(0, len(text), step):
+            piece = text[start:start + step]
+            if per_token:
+                await asyncio.sleep(estimate_tokens(piece) * per_token)
+            yield _chunk(model, {"content": piece})
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        yield _chunk(model, {}, finish_reason, usage)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/stub/config")
+async def get_config():
+    return config.describe()
+
+
+@app.put("/stub/config")
+async def put_config(changes: Dict[str, Any] = Body(...)):
+    try:
+        config.update(**{key: value for key, value in changes.items()
+                         if key in ("modes", "ttft", "tokens_per_second", "seed", "retry_after")})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+    return config.describe()
+
+
+@app.get("/stub/stats")
+async def get_stats():
+    return {"answers": dict(stats), "total": sum(stats.values())}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Deterministic OpenAI-compatible LLM stub")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--modes", default=config.modes_spec, help="mode weights, e.g. valid=0.8,truncated=0.2")
+    parser.add_argument("--ttft", default=config.ttft_spec, help="time-to-first-token distribution, e.g. lognormal:0.8,0.5")
+    parser.add_argument("--tokens-per-second", type=float, default=config.tokens_per_second,
+                        help="output rate after the first token (0 = instant)")
+    parser.add_argument("--seed", type=int, default=config.seed)
+    args = parser.parse_args()
+    config.update(modes=args.modes, ttft=args.ttft, tokens_per_second=args.tokens_per_second, seed=args.seed)
+    uvicorn.run(app, host=args.host, port=args.port)
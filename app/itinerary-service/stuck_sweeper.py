@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from itinerary_body import dumps, serialize_itinerary
+from status_events import NOTIFY_PAYLOAD_SQL
+
+logger = logging.getLogger("itinerary-service")
+
+# pg_try_advisory_xact_lock key: one replica sweeps at a time, the others skip that round
+SWEEP_LOCK_KEY = 7_274_301_955_118_213_118
+
+FAILED_ERROR = "Generation stopped responding and could not be retried"
+REQUEUED_ERROR = "Requeued by the stuck-generation sweeper"
+
+# A trip is stuck when it has been 'processing' without progress for longer than the
+# deadline and no job is working on it: its own job is not queued and not running under
+# a live lock, and no queued or running batch job lists it as a follower. Its newest
+# job is put back in the queue if it has attempts left; otherwise the trip is failed.
+# Requeueing skips a job that a worker claimed after the snapshot was taken.
+SWEEP_SQL = f"""
+WITH stuck AS (
+    SELECT t.id, t.generation_id FROM trips t
+    WHERE t.generation_status = 'processing'
+      AND GREATEST(t.generation_started_at, t.generation_updated_at) < NOW() - make_interval(secs => $1)
+      AND NOT EXISTS (
+          SELECT 1 FROM generation_jobs j
+          WHERE j.status IN ('queued', 'running')
+            AND ((j.generation_id = t.generation_id AND (j.status = 'queued' OR j.locked_until >= NOW()))
+                 OR j.payload->'batch_followers' @> jsonb_build_array(
+                        jsonb_build_object('generation_id', t.generation_id::text)))
+      )
+    ORDER BY t.id
+    LIMIT $2
+    FOR UPDATE OF t SKIP LOCKED
+),
+retry AS (
+    SELECT DISTINCT ON (s.id) s.id AS trip_id, j.id AS job_id
+    FROM stuck s JOIN generation_jobs j ON j.trip_id = s.id AND j.generation_id = s.generation_id
+    WHERE j.status IN ('running', 'done', 'failed') AND j.attempts < j.max_attempts
+    ORDER BY s.id, j.id DESC
+),
+requeued AS (
+    UPDATE generation_jobs j
+    SET status = 'queued', run_after = NOW(), locked_until = NULL, locked_by = NULL,
+        last_error = $3, updated_at = NOW()
+    FROM retry r
+    WHERE j.id = r.job_id AND (j.status <> 'running' OR j.locked_until < NOW())
+    RETURNING j.id
+),
+u AS (
+    UPDATE trips t
+    SET generation_status = CASE WHEN r.job_id IS NULL THEN 'failed' ELSE 'processing' END,
+        generation_started_at = CASE WHEN r.job_id IS NULL THEN t.generation_started_at ELSE NOW() END,
+        generation_updated_at = NOW(),
+        generation_days_completed = CASE WHEN r.job_id IS NULL THEN 0 ELSE t.generation_days_completed END,
+        itinerary = CASE WHEN r.job_id IS NULL THEN $4::jsonb ELSE t.itinerary END,
+        itinerary_body = CASE WHEN r.job_id IS NULL THEN $5::bytea ELSE t.itinerary_body END,
+        itinerary_hash = CASE WHEN r.job_id IS NULL THEN $6::text ELSE t.itinerary_hash END
+    FROM stuck s LEFT JOIN retry r ON r.trip_id = s.id
+    WHERE t.id = s.id
+    RETURNING t.id, t.generation_status, t.generation_id, t.generation_started_at,
+              t.generation_days_completed, t.generation_days_total
+)
+SELECT u.id, u.generation_status, {NOTIFY_PAYLOAD_SQL} FROM u
+"""
+
+
+class StuckGenerationSweeper:
+    """Recovers trips left 'processing' by a crashed process.
+
+    Every `interval` seconds one batched UPDATE (see SWEEP_SQL) finds trips
+    through idx_trips_generation_status that have made no progress for
+    `deadline` seconds and have no live job, and either re-enqueues their
+    job or marks them failed so they can be started again. The sweep runs
+    in a transaction holding an advisory lock; replicas that don't get the
+    lock skip the round, so only one sweeps at a time.
+    """
+
+    def __init__(self, deadline: float = 900.0, batch_size: int = 500):
+        self.deadline = deadline
+        self.batch_size = batch_size
+        self.pool = None
+
+        self._task: Optional[asyncio.Task] = None
+
+        self.sweeps = 0
+        self.sweeps_skipped = 0
+        self.requeued = 0
+        self.failed = 0
+        self.last_sweep_at: Optional[float] = None
+
+    def attach_pool(self, pool):
+        self.pool = pool
+
+    async def sweep(self) -> Optional[Dict[str, int]]:
+        """Run one sweep; returns {"requeued", "failed"} counts, or None if another replica holds the lock"""
+        error = {"error": FAILED_ERROR}
+        body, content_hash = serialize_itinerary(error)
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                if not await conn.fetchval("SELECT pg_try_advisory_xact_lock($1)", SWEEP_LOCK_KEY):
+                    self.sweeps_skipped += 1
+                    return None
+                rows = await conn.fetch(SWEEP_SQL, float(self.deadline), self.batch_size, REQUEUED_ERROR,
+                                        dumps(error), body, content_hash)
+
+        requeued = [row["id"] for row in rows if row["generation_status"] == "processing"]
+        failed = [row["id"] for row in rows if row["generation_status"] == "failed"]
+        self.sweeps += 1
+        self.requeued += len(requeued)
+        self.failed += len(failed)
+        self.last_sweep_at = time.time()
+        if rows:
+            logger.warning(f"Recovered {len(rows)} stuck generations: {len(requeued)} requeued, {len(failed)} failed "
+                           f"(trips {sorted(row['id'] for row in rows)[:20]})")
+        return {"requeued": len(requeued), "failed": len(failed)}
+
+    async def _sweep_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Stuck-generation sweep failed: {e}")
+
+    async def start(self, interval: float = 60.0):
+        """Sweep every `interval` seconds (0 disables)"""
+        if self._task is None and interval > 0 and self.pool is not None:
+            self._task = asyncio.create_task(self._sweep_loop(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "deadline_seconds": self.deadline,
+            "sweeps": self.sweeps,
+            "sweeps_skipped": self.sweeps_skipped,
+            "requeued": self.requeued,
+            "failed": self.failed,
+            "last_sweep_at": self.last_sweep_at,
+        }
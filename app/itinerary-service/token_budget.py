@@ -0,0 +1,87 @@
+import json
+import math
+import re
+
+# Pre-tokenizer in the spirit of the tiktoken-style BPE used by Llama 3:
+# contractions, letter runs (with one leading non-letter), 1-3 digit groups,
+# punctuation runs and whitespace. Each piece is then costed with a rough
+# merge rate instead of a real vocabulary, which keeps this dependency-free.
+_PIECE_RE = re.compile(
+    r"'(?:[sdmt]|ll|ve|re)|[^\r\n\w]?[^\W\d_]+|\d{1,3}| ?[^\s\w]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"
+)
+
+# Letter runs up to this length (leading space included) are costed as one
+# token, as most English words are; longer runs - typically street and place
+# names that BPE splits - cost one token per _CHARS_PER_WORD_TOKEN chars
+_WHOLE_WORD_CHARS = 8
+_CHARS_PER_WORD_TOKEN = 4
+# Per-message overhead of the chat template (role headers, separators)
+CHAT_MESSAGE_OVERHEAD = 8
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate Llama 3 token count of text without a tokenizer vocabulary"""
+    if not text:
+        return 0
+    tokens = 0
+    for piece in _PIECE_RE.findall(text):
+        if piece.isspace():
+            tokens += 1
+        elif piece[-1].isalpha():
+            if piece.isascii():
+                if len(piece) <= _WHOLE_WORD_CHARS:
+                    tokens += 1
+                else:
+                    tokens += math.ceil(len(piece) / _CHARS_PER_WORD_TOKEN)
+            else:
+                # Accented / non-Latin letters merge far less; cost by UTF-8 bytes
+                tokens += max(1, math.ceil(len(piece.encode("utf-8")) / 3))
+        elif piece.isdigit():
+            tokens += 1
+        else:
+            # Punctuation pairs such as '":' or '},' are usually single tokens
+            tokens += max(1, math.ceil(len(piece.strip()) / 2))
+    return tokens
+
+
+def estimate_chat_tokens(*messages: str) -> int:
+    """Prompt tokens for a chat request made of the given message contents"""
+    return sum(estimate_tokens(message) + CHAT_MESSAGE_OVERHEAD for message in messages)
+
+
+# A representative generated day (five slots, real-length names and addresses),
+# rendered the way the model answers: indented JSON.
+_SAMPLE_DAY = {
+    "Day 10": {
+        "date": "2025-06-10",
+        "district": "Centro Storico",
+        "09:00": {"type": "breakfast", "title": "Caffè Sant'Eustachio", "location": "Centro Storico",
+                  "address": "Piazza di Sant'Eustachio 82, 00186 Roma RM, Italy"},
+        "11:00": {"type": "sightseeing", "title": "Galleria Doria Pamphilj", "location": "Centro Storico",
+                  "address": "Via del Corso 305, 00186 Roma RM, Italy"},
+        "13:00": {"type": "lunch", "title": "Armando al Pantheon", "location": "Centro Storico",
+                  "address": "Salita dei Crescenzi 31, 00186 Roma RM, Italy"},
+        "15:30": {"type": "activity", "title": "Basilica di Santa Maria sopra Minerva", "location": "Centro Storico",
+                  "address": "Piazza della Minerva 42, 00186 Roma RM, Italy"},
+        "19:00": {"type": "dinner", "title": "Ristorante Da Valentino", "location": "Centro Storico",
+                  "address": "Via del Collegio Romano 20, 00186 Roma RM, Italy"},
+    }
+}
+TOKENS_PER_DAY = estimate_tokens(json.dumps(_SAMPLE_DAY, indent=2, ensure_ascii=False)[1:-1] + ",")
+
+
+def estimate_completion_tokens(days_count: int, margin: float = 0.3) -> int:
+    """Tokens a days_count-day JSON answer needs, with a safety margin"""
+    return math.ceil((days_count * TOKENS_PER_DAY + 16) * (1.0 + margin))
+
+
+def choose_max_tokens(prompt_tokens: int,
+                      days_count: int,
+                      context_window: int = 8192,
+                      ceiling: int = 6000,
+                      floor: int = 512,
+                      margin: float = 0.3) -> int:
+    """max_tokens sized to the answer, capped by what the context window leaves"""
+    wanted = max(floor, estimate_completion_tokens(days_count, margin))
+    available = context_window - prompt_tokens - 32
+    return max(1, min(wanted, ceiling, available))
@@ -0,0 +1,1230 @@
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import uuid
+from datetime import datetime
+
+import asyncpg
+import pytest
+
+# The shared migrations package lives next to this service in the source tree
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import (
+    ItineraryRequest,
+    build_fallback_itinerary,
+    create_compact_prompt,
+    create_geographic_prompt_with_addresses,
+    generate_chunked_itinerary,
+    split_date_windows,
+)
+import main
+from itinerary_parser import IncrementalDayParser, parse_itinerary_response
+from rate_limiter import AdaptiveRateLimiter, TokenBucket
+from singleflight import SingleFlight
+from result_cache import ItineraryCache, make_cache_key, redate_itinerary
+from token_budget import TOKENS_PER_DAY, choose_max_tokens, estimate_tokens
+from status_events import StatusBroadcaster
+from eta_model import EtaModel
+from migrations import apply_migrations, ensure_schema, load_migrations
+from itinerary_body import make_etag, parse_if_none_match, serialize_itinerary
+from llm_providers import FINISH_ERROR, Completion, LLMProvider, OpenAICompatibleProvider
+from circuit_breaker import CircuitBreaker
+from http_pool import PooledHTTPClient
+from hedging import run_hedged
+from geocoding import ActivityGeocoder
+from route_optimizer import RouteOptimizer, haversine_matrix
+from generation_registry import GenerationRegistry
+from stuck_sweeper import FAILED_ERROR, SWEEP_LOCK_KEY, StuckGenerationSweeper
+from job_queue import EXPIRED_ERROR, JobQueue
+from day_quality import day_issues, low_quality_days
+from itinerary_parser import extract_itinerary_fields
+from metrics import REGISTRY, Counter, Gauge, Histogram, MetricsMiddleware, Registry
+import httpx
+import stub_llm
+
+# Optional scratch database for tests that need real Postgres behaviour (triggers)
+TEST_DATABASE_URL = os.getenv("ITINERARY_TEST_DATABASE_URL")
+
+
+def build_prompt(destination="Rome", start="2025-06-01", end="2025-06-03", preferences=None):
+    request = ItineraryRequest(
+        destination=destination,
+        start_date=start,
+        end_date=end,
+        preferences=preferences or [{"category": "Food", "value": "Pasta", "weight": 8}],
+    )
+    start_date = datetime.fromisoformat(start)
+    end_date = datetime.fromisoformat(end)
+    days_count = (end_date - start_date).days + 1
+    return create_geographic_prompt_with_addresses(request, start_date, end_date, days_count)
+
+
+def sample_itinerary():
+    return {
+        "Day 1": {"date": "2025-06-01", "district": "Trastevere",
+                  "09:00": {"type": "breakfast", "title": "Bar San Calisto", "address": "Piazza di San Calisto 3, Rome"}},
+        "Day 2": {"date": "2025-06-02", "district": "Monti",
+                  "09:00": {"type": "breakfast", "title": "Ciuri Ciuri", "address": "Via Leonina 18, Rome"}},
+    }
+
+# Result cache tests
+def test_cache_key_ignores_start_date():
+    """Same destination, span and preferences share a key whatever the start date"""
+    assert make_cache_key(build_prompt()) == make_cache_key(build_prompt(start="2025-09-10", end="2025-09-12"))
+
+def test_cache_key_depends_on_preferences_and_span():
+    """Different preferences or trip lengths produce different keys"""
+    base = make_cache_key(build_prompt())
+    assert base != make_cache_key(build_prompt(preferences=[{"value": "Museums", "weight": 9}]))
+    assert base != make_cache_key(build_prompt(end="2025-06-04"))
+
+def test_redate_itinerary():
+    """Cached days are moved onto the new start date without touching the original"""
+    original = sample_itinerary()
+    redated = redate_itinerary(original, datetime(2025, 12, 30))
+    assert redated["Day 1"]["date"] == "2025-12-30"
+    assert redated["Day 2"]["date"] == "2025-12-31"
+    assert original["Day 1"]["date"] == "2025-06-01"
+
+def test_memory_tier_hit_and_eviction():
+    """The in-process tier serves hits and evicts least recently used entries"""
+    cache = ItineraryCache(max_entries=1)
+    prompt_a, prompt_b = build_prompt("Rome"), build_prompt("Paris")
+
+    async def scenario():
+        assert await cache.get(prompt_a, datetime(2025, 7, 1)) is None
+        await cache.put(prompt_a, sample_itinerary())
+        hit = await cache.get(prompt_a, datetime(2025, 7, 1))
+        await cache.put(prompt_b, sample_itinerary())
+        miss = await cache.get(prompt_a, datetime(2025, 7, 1))
+        return hit, miss
+
+    hit, miss = asyncio.run(scenario())
+    assert hit["Day 2"]["date"] == "2025-07-02"
+    assert miss is None
+    stats = cache.stats()
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["evictions"] == 1
+
+# Streaming parser tests
+def test_incremental_parser_emits_days_as_they_close():
+    """Days are emitted chunk by chunk, ignoring fences and braces inside strings"""
+    text = (
+        '```json\n{"Day 1": {"date": "2025-06-01", "district": "Monti {old}", '
+        '"09:00": {"title": "Cafe \\"Roma\\"", "address": "Via Leonina 18"}},\n'
+        '"2": {"date": "2025-06-02", "district": "Prati",}, "Day 3": {"date": "2025'
+    )
+    parser = IncrementalDayParser()
+    emitted = []
+    for start in range(0, len(text), 7):
+        emitted.extend(parser.feed(text[start:start + 7]))
+
+    assert [day_key for day_key, _ in emitted] == ["Day 1", "Day 2"]
+    assert emitted[0][1]["district"] == "Monti {old}"
+    assert emitted[0][1]["09:00"]["title"] == 'Cafe "Roma"'
+    assert emitted[1][1]["district"] == "Prati"
+    assert parser.text == text
+
+# Chunked generation tests
+def test_split_date_windows():
+    """A 10-day trip splits into 4+4+2 day windows"""
+    windows = split_date_windows(datetime(2025, 6, 1), 10, 4)
+    assert [(offset, days) for offset, _, days in windows] == [(0, 4), (4, 4), (8, 2)]
+    assert windows[2][1] == datetime(2025, 6, 9)
+
+def test_chunked_generation_merges_windows(monkeypatch):
+    """Windows are renumbered, merged in order, and failed windows use the template"""
+    request = ItineraryRequest(destination="Rome", start_date="2025-06-01", end_date="2025-06-07")
+    prompts = []
+
+    async def fake_generate(prompt, on_day=None, expected_days=None, timing=None, hedge=False):
+        prompts.append(prompt)
+        if "days 5-7" in prompt:
+            return None
+        # The model restarts numbering at Day 1 for every window
+        return json.dumps({f"Day {i + 1}": {"date": "", "district": f"D{len(prompts)}-{i}", "09:00": {"address": "x"}}
+                           for i in range(4)})
+
+    monkeypatch.setattr(main, "GENERATION_CHUNK_DAYS", 4)
+    monkeypatch.setattr(main, "GENERATION_CHUNK_CONCURRENCY", 1)
+    monkeypatch.setattr(main, "generate_with_llm", fake_generate)
+    itinerary, complete = asyncio.run(generate_chunked_itinerary(request, datetime(2025, 6, 1), 7))
+
+    assert list(itinerary) == [f"Day {i}" for i in range(1, 8)]
+    assert itinerary["Day 4"]["date"] == "2025-06-04"
+    assert itinerary["Day 5"] == build_fallback_itinerary(request, datetime(2025, 6, 5), 3, 4)["Day 5"]
+    assert not complete
+    # The second window was told which districts the first one used
+    assert "D1-0" in prompts[1]
+
+def test_chunked_generation_streams_days_under_absolute_keys(monkeypatch):
+    """A window that restarts at Day 1 streams its days as Day offset+1.. so earlier partials survive"""
+    request = ItineraryRequest(destination="Rome", start_date="2025-06-01", end_date="2025-06-06")
+    streamed = {}
+
+    async def fake_generate(prompt, on_day=None, expected_days=None, timing=None, hedge=False):
+        offset = 3 if "days 4-6" in prompt else 0
+        days = {f"Day {i + 1}": {"date": "", "district": f"D{offset + i}", "09:00": {"address": "x"}} for i in range(3)}
+        for day_key, day_data in days.items():
+            await on_day(day_key, dict(day_data))
+        # A retried attempt streams its first day again
+        await on_day("Day 1", dict(days["Day 1"]))
+        return json.dumps(days)
+
+    async def on_day(day_key, day_data):
+        streamed[day_key] = day_data
+
+    monkeypatch.setattr(main, "GENERATION_CHUNK_DAYS", 3)
+    monkeypatch.setattr(main, "GENERATION_CHUNK_CONCURRENCY", 1)
+    monkeypatch.setattr(main, "generate_with_llm", fake_generate)
+    itinerary, complete = asyncio.run(generate_chunked_itinerary(request, datetime(2025, 6, 1), 6, on_day=on_day))
+
+    assert complete and list(streamed) == [f"Day {i}" for i in range(1, 7)]
+    assert [day["district"] for day in streamed.values()] == [f"D{i}" for i in range(6)]
+    assert streamed["Day 5"]["date"] == "2025-06-05"
+    assert {key: day["district"] for key, day in streamed.items()} == \
+        {key: day["district"] for key, day in itinerary.items()}
+
+# Token budget tests
+def test_compact_prompt_lists_dates_and_stays_small():
+    """The compact prompt names every day once and grows far slower than the full one"""
+    request = ItineraryRequest(destination="Rome", start_date="2025-06-01", end_date="2025-06-07")
+    args = (request, datetime(2025, 6, 1), datetime(2025, 6, 7), 7)
+    compact = create_compact_prompt(*args, day_offset=4, total_days=11)
+    assert "days 5-11" in compact
+    assert "- Day 5: 2025-06-01" in compact and "- Day 11: 2025-06-07" in compact
+    assert estimate_tokens(create_compact_prompt(*args)) * 3 < estimate_tokens(create_geographic_prompt_with_addresses(*args))
+
+def test_choose_max_tokens_fits_context_window():
+    """max_tokens scales with the days requested but never overflows the context window"""
+    assert choose_max_tokens(800, 2) < choose_max_tokens(800, 4) < 6000
+    assert choose_max_tokens(800, 4) > 4 * TOKENS_PER_DAY
+    assert choose_max_tokens(800, 40) == 6000
+    assert choose_max_tokens(5000, 40, context_window=8192) <= 8192 - 5000
+
+# Batch generation tests
+def test_batch_groups_identical_prompts():
+    """Trips with the same destination, length and preferences share one generation"""
+    def trip(trip_id, destination, start, end):
+        return main.BatchTripRequest(trip_id=trip_id, destination=destination, start_date=start, end_date=end)
+
+    groups = main.group_batch_by_prompt([
+        trip(1, "Rome", "2025-06-01", "2025-06-03"),
+        trip(2, "Paris", "2025-06-01", "2025-06-03"),
+        trip(3, "Rome", "2025-09-10", "2025-09-12"),
+        trip(4, "Rome", "2025-06-01", "2025-06-04"),
+    ])
+    assert [(leader.trip_id, [f.trip_id for f in followers]) for leader, followers in groups] == [(1, [3]), (2, []), (4, [])]
+
+def test_batch_job_completes_followers(monkeypatch):
+    """A batch job saves its itinerary re-dated for every follower in one bulk write"""
+    saved = []
+
+    async def fake_task(trip_id, request, generation_id, raise_on_error=False, interactive=False,
+                        serves_followers=False):
+        assert serves_followers
+        return sample_itinerary()
+
+    async def fake_bulk(entries, status="completed"):
+        saved.append((entries, status))
+
+    monkeypatch.setattr(main, "generate_itinerary_task", fake_task)
+    monkeypatch.setattr(main, "save_itineraries_bulk", fake_bulk)
+    payload = {"destination": "Rome", "start_date": "2025-06-01", "end_date": "2025-06-02",
+               "batch_followers": [{"trip_id": 9, "generation_id": "g9", "start_date": "2025-10-05"}]}
+    job = type("Job", (), {"id": 1, "trip_id": 1, "generation_id": "g1", "payload": payload})()
+    asyncio.run(main.run_generation_job(job))
+
+    [(entries, status)] = saved
+    assert status == "completed"
+    assert entries[0][0] == 9
+    assert entries[0][1]["Day 2"]["date"] == "2025-10-06"
+
+# LLM provider tests
+def test_stub_provider_round_trip_is_deterministic():
+    """The stub answers the prompt's days; the same prompt always gets the same answer"""
+    stub_llm.config.update(modes="valid=1", ttft="fixed:0", tokens_per_second=0)
+    messages = [{"role": "user", "content": build_prompt()}]
+
+    async def run():
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=stub_llm.app))
+        provider = OpenAICompatibleProvider("stub", "http://stub/v1", "stub-itinerary", client, requires_key=False)
+        deltas = []
+
+        async def on_delta(delta):
+            deltas.append(delta)
+
+        try:
+            plain = await provider.complete(messages, 4000, 0.3)
+            streamed = await provider.stream(messages, 4000, 0.3, on_delta)
+            stub_llm.config.update(modes="truncated=1")
+            truncated = await provider.complete(messages, 4000, 0.3)
+        finally:
+            stub_llm.config.update(modes="valid=1")
+            await client.aclose()
+        return plain, streamed, "".join(deltas), truncated
+
+    plain, streamed, joined, truncated = asyncio.run(run())
+    result, strategy = parse_itinerary_response(plain.text)
+    assert strategy == "direct" and list(result) == ["Day 1", "Day 2", "Day 3"]
+    assert result["Day 3"]["date"] == "2025-06-03"
+    assert streamed.text == joined == plain.text
+    assert truncated.finish_reason == "length" and len(truncated.text) < len(plain.text)
+
+def test_stream_broken_part_way_returns_its_text_but_counts_as_a_failure(monkeypatch):
+    """A dropped stream keeps the days that arrived, marked FINISH_ERROR, and the breaker records a failure"""
+    chunks = [json.dumps({"choices": [{"delta": {"content": text}}]}) for text in ('{"Day 1": {"district": ', '"Monti"}, ')]
+
+    async def body():
+        for chunk in chunks:
+            yield f"data: {chunk}\n\n".encode()
+        raise httpx.ReadError("connection reset")
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=body())))
+    provider = OpenAICompatibleProvider("fake", "http://llm/v1", "fake", client, requires_key=False)
+    breaker = CircuitBreaker(window=10, min_calls=1, failure_rate=0.5, open_seconds=60)
+    streamed = []
+
+    async def on_day(day_key, day_data):
+        streamed.append((day_key, day_data["district"]))
+
+    monkeypatch.setattr(main, "llm_provider", provider)
+    monkeypatch.setattr(main, "llm_breaker", breaker)
+    monkeypatch.setattr(main, "llm_rate_limiter", AdaptiveRateLimiter(rpm=0, tpm=0, max_concurrency=4))
+    monkeypatch.setattr(main, "LLM_STREAMING", True)
+    completion = asyncio.run(main.llm_attempt([{"role": "user", "content": "prompt"}], 100, 100, on_day))
+
+    assert completion.finish_reason == FINISH_ERROR
+    assert completion.text == '{"Day 1": {"district": "Monti"}, '
+    assert streamed == [("Day 1", "Monti")]
+    assert breaker.state == "open"
+
+def test_llm_provider_is_abstract():
+    """A provider has to implement both complete() and stream()"""
+    class CompleteOnly(LLMProvider):
+        async def complete(self, messages, max_tokens, temperature, slot=None):
+            return None
+
+    try:
+        CompleteOnly()
+    except TypeError as e:
+        assert "stream" in str(e)
+    else:
+        raise AssertionError("LLMProvider subclass without stream() was instantiated")
+
+def test_cut_off_answer_is_continued_from_first_missing_day(monkeypatch):
+    """A "length" finish triggers a follow-up for the missing days, stitched and streamed under the right keys"""
+    day = lambda district: {"date": "2025-06-01", "district": district, "09:00": {"title": f"{district} walk"}}
+    first = json.dumps({"Day 1": day("Trastevere"), "Day 2": day("Monti"), "Day 3": day("Prati")})
+    answers = [
+        Completion(first[:first.index('"Day 3"') + 20], 6000, None, "length"),
+        Completion(json.dumps({"Day 1": day("Testaccio"), "Day 2": day("Esquilino")}), 900, None, "stop"),
+    ]
+    calls, streamed = [], []
+
+    async def fake_attempt(messages, max_tokens, estimated_tokens, on_day=None, claim=None):
+        calls.append(messages[-1]["content"])
+        completion = answers.pop(0)
+        if on_day is not None and len(calls) > 1:
+            for day_key, day_data in json.loads(completion.text).items():
+                await on_day(day_key, day_data)
+        return completion
+
+    async def on_day(day_key, day_data):
+        streamed.append((day_key, day_data["district"]))
+
+    class Provider:
+        name, model, context_window, is_configured = "fake", "fake", 8192, True
+
+    monkeypatch.setattr(main, "llm_provider", Provider())
+    monkeypatch.setattr(main, "llm_attempt", fake_attempt)
+    monkeypatch.setattr(main, "llm_breaker", CircuitBreaker())
+    text = asyncio.run(main.generate_with_llm("prompt", on_day=on_day, expected_days=4))
+
+    result, strategy = parse_itinerary_response(text)
+    assert strategy == "direct" and list(result) == ["Day 1", "Day 2", "Day 3", "Day 4"]
+    assert [result[key]["district"] for key in result] == ["Trastevere", "Monti", "Testaccio", "Esquilino"]
+    assert len(calls) == 2 and "Return ONLY Day 3 to Day 4" in calls[1] and "Trastevere, Monti" in calls[1]
+    assert streamed == [("Day 3", "Testaccio"), ("Day 4", "Esquilino")]
+
+# Circuit breaker and hedging tests
+def test_circuit_breaker_opens_and_probes(monkeypatch):
+    """Failing calls open the circuit; calls then skip the provider until a probe succeeds"""
+    calls = []
+
+    class FailingProvider:
+        name, model, context_window, is_configured = "fake", "fake", 8192, True
+
+        async def complete(self, messages, max_tokens, temperature, slot=None):
+            calls.append(1)
+            return None
+
+    breaker = CircuitBreaker(window=10, min_calls=3, failure_rate=0.5, open_seconds=60)
+    monkeypatch.setattr(main, "llm_provider", FailingProvider())
+    monkeypatch.setattr(main, "llm_breaker", breaker)
+    monkeypatch.setattr(main, "llm_rate_limiter", AdaptiveRateLimiter(rpm=0, tpm=0, max_concurrency=4))
+    for _ in range(5):
+        assert asyncio.run(main.generate_with_llm("prompt")) is None
+    assert len(calls) == 3
+    assert breaker.state == "open" and breaker.calls_rejected == 2
+
+    breaker._opened_at -= 61
+    with breaker.call():
+        breaker.record_success(1.0)
+    assert breaker.state == "closed"
+
+
+def test_hedged_request_takes_first_answer():
+    """A backup request sent after the delay wins when the primary is stuck"""
+    started = []
+
+    async def attempt(index, claim):
+        started.append(index)
+        await asyncio.sleep(0.3 if index == 0 else 0.01)
+        return f"answer {index}"
+
+    result, winner = asyncio.run(run_hedged(attempt, 0.05, lambda: True))
+    assert (result, winner) == ("answer 1", 1)
+    assert started == [0, 1]
+
+    result, winner = asyncio.run(run_hedged(attempt, 0.05, lambda: False))
+    assert started[-1] == 0 and winner == 0
+
+# Conditional GET tests
+def test_itinerary_served_as_stored_bytes_with_etag(monkeypatch):
+    """A completed itinerary is returned verbatim; a matching If-None-Match gets 304"""
+    body, content_hash = serialize_itinerary(sample_itinerary())
+    assert json.loads(body) == {"itinerary": sample_itinerary()}
+    assert parse_if_none_match(f'W/"abc", {make_etag(content_hash)}') == ["abc", content_hash]
+
+    async def fake_load(trip_id, known_hashes):
+        return {"generation_status": "completed", "generation_days_completed": 2, "itinerary_hash": content_hash,
+                "body": None if content_hash in known_hashes else body}
+
+    monkeypatch.setattr(main, "load_itinerary_body", fake_load)
+    response = asyncio.run(main.get_itinerary("7", if_none_match=None))
+    assert response.status_code == 200
+    assert response.body == body
+    assert response.headers["etag"] == make_etag(content_hash)
+
+    response = asyncio.run(main.get_itinerary("7", if_none_match=response.headers["etag"]))
+    assert response.status_code == 304
+    assert response.body == b""
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="set ITINERARY_TEST_DATABASE_URL to a scratch Postgres")
+def test_itinerary_written_outside_the_service_gets_a_new_etag(monkeypatch):
+    """A direct write to trips.itinerary (as the backend does) drops the stored body, so the old ETag stops matching"""
+    edited = sample_itinerary()
+    edited["Day 2"]["district"] = "Testaccio"
+    schema = f"etag_test_{uuid.uuid4().hex[:8]}"
+
+    async def run():
+        admin = await asyncpg.connect(TEST_DATABASE_URL)
+        await admin.execute(f"CREATE SCHEMA {schema}")
+        pool = await asyncpg.create_pool(TEST_DATABASE_URL, min_size=1, max_size=2,
+                                         server_settings={"search_path": schema})
+        try:
+            async with pool.acquire() as conn:
+                await apply_migrations(conn)
+                trip_id = await conn.fetchval(
+                    """INSERT INTO trips (title, destination, start_date, end_date, owner_id)
+                       VALUES ('Rome', 'Rome', '2025-06-01', '2025-06-02', 1) RETURNING id"""
+                )
+            monkeypatch.setattr(main, "db_pool", pool)
+            assert await main.save_itinerary_to_db(trip_id, sample_itinerary())
+            first = await main.get_itinerary(str(trip_id), if_none_match=None)
+
+            # The backend's update_trip sets the JSONB column through the ORM
+            async with pool.acquire() as conn:
+                await conn.execute("UPDATE trips SET itinerary = $2::jsonb WHERE id = $1", trip_id, json.dumps(edited))
+            second = await main.get_itinerary(str(trip_id), if_none_match=first.headers["etag"])
+            return first, second
+        finally:
+            await pool.close()
+            await admin.execute(f"DROP SCHEMA {schema} CASCADE")
+            await admin.close()
+
+    first, second = asyncio.run(run())
+    assert first.headers["etag"] == make_etag(serialize_itinerary(sample_itinerary())[1])
+    assert second.status_code == 200
+    assert second.headers["etag"] != first.headers["etag"]
+    assert json.loads(second.body) == {"itinerary": edited}
+
+# Rate limiter tests
+def test_token_bucket_delay():
+    """An empty bucket reports how long until enough tokens refill"""
+    bucket = TokenBucket(60)
+    bucket.consume(60)
+    assert 0.9 < bucket.delay_for(1) <= 1.0
+    assert bucket.delay_for(1000) <= 60.0
+
+def test_rate_limiter_queues_and_backs_off():
+    """Requests over the concurrency limit wait, and a 429 halves the limit"""
+    limiter = AdaptiveRateLimiter(rpm=0, tpm=0, max_concurrency=2)
+
+    async def scenario():
+        first = await limiter.acquire(100)
+        second = await limiter.acquire(100)
+        third = asyncio.create_task(limiter.acquire(100))
+        await asyncio.sleep(0.01)
+        assert not third.done()
+        assert limiter.stats()["queue_depth"] == 1
+
+        first.record_throttle(retry_after=0.05)
+        await limiter.release(first)
+        assert limiter.stats()["concurrency_limit"] == 1
+        await limiter.release(second)
+        admitted = await asyncio.wait_for(third, timeout=1)
+        assert admitted.waited >= 0.04
+        await limiter.release(admitted)
+
+    asyncio.run(scenario())
+    stats = limiter.stats()
+    assert stats["throttled"] == 1
+    assert stats["admitted"] == 3
+
+def test_rate_limiter_only_grows_on_successful_calls():
+    """Failed calls leave the concurrency limit alone but still refund unused tokens"""
+    limiter = AdaptiveRateLimiter(rpm=0, tpm=6000, max_concurrency=8)
+    limiter.limit = 2.0
+
+    async def call(ok):
+        async with limiter.slot(1000) as slot:
+            slot.record_usage(200)
+            if ok:
+                slot.record_success()
+
+    async def scenario():
+        for _ in range(5):
+            await call(ok=False)
+        failed_limit = limiter.limit
+        await call(ok=True)
+        return failed_limit
+
+    failed_limit = asyncio.run(scenario())
+    assert failed_limit == 2.0 and limiter.limit == 2.5
+    # Each call consumed 1000 tokens and got 800 back
+    assert 4700 < limiter.token_bucket.tokens <= 4802
+
+# Single-flight tests
+def test_single_flight_shares_one_call():
+    """Concurrent callers with the same key get the leader's result"""
+    flight = SingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "itinerary"
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do("key", fn) for _ in range(3)))
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True]
+    assert all(result == "itinerary" for result, _ in results)
+
+def test_single_flight_follower_takes_over_after_cancel():
+    """If the leading call is cancelled a waiting caller runs the function itself"""
+    flight = SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(10)
+
+    async def fast():
+        return "mine"
+
+    async def scenario():
+        leader = asyncio.create_task(flight.do("key", slow))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("key", fast))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(scenario()) == ("mine", False)
+
+# Tolerant parser tests
+def test_parser_repairs_fences_keys_and_trailing_commas():
+    """Fenced answers get day keys normalized and trailing commas dropped, but strings are untouched"""
+    text = 'Here it is:\n```json\n{"1": {"title": "Bar, }", "tags": ["a", "b",],},\n "Day2": {"title": "X"},}\n```'
+    result, strategy = parse_itinerary_response(text)
+    assert strategy == "repaired"
+    assert result == {"Day 1": {"title": "Bar, }", "tags": ["a", "b"]}, "Day 2": {"title": "X"}}
+
+def test_parser_normalizes_numeric_keys_of_valid_json():
+    """Unfenced valid JSON gets the same "Day N" keys as the fenced answer would"""
+    text = '{"1": {"district": "Monti"}, "Day2": {"district": "Prati"}}'
+    result, strategy = parse_itinerary_response(text)
+    assert strategy == "direct"
+    assert list(result) == ["Day 1", "Day 2"]
+    assert result == parse_itinerary_response(f"```json\n{text}\n```")[0]
+    assert main.count_itinerary_days(result) == 2
+
+def test_parser_recovers_last_complete_day():
+    """A truncated answer keeps every day that closed before the cut"""
+    text = '{"Day 1": {"district": "Monti", "09:00": {"title": "A {x}"}}, "Day 2": {"district": "Pra'
+    result, strategy = parse_itinerary_response(text)
+    assert strategy == "truncated"
+    assert result == {"Day 1": {"district": "Monti", "09:00": {"title": "A {x}"}}}
+
+def test_parser_corpus_recovery():
+    """Every checked-in benchmark response still yields its expected days"""
+    from benchmarks.parse_bench import count_days, load_corpus
+
+    for case in load_corpus():
+        result, _ = parse_itinerary_response(case["text"])
+        assert count_days(result) >= case["expected_days"], case["file"]
+
+# ETA model tests
+def test_eta_model_uses_prior_then_learns():
+    """Without data the prior line is used; with data the fitted per-day cost takes over"""
+    model = EtaModel(min_samples=5)
+    assert model.expected_seconds(3) == 8.0 + 2.5 * 3
+
+    for _ in range(10):
+        for days in (1, 2, 4, 8):
+            model.observe(days, 5.0 + 10.0 * days)
+    assert abs(model.expected_seconds(6) - 65.0) < 0.5
+    assert model.remaining_seconds(6, elapsed=60) == 5
+    # Running late: fall back to the pace of streamed days
+    assert model.remaining_seconds(6, elapsed=90, days_completed=3, days_total=6) == 90
+
+def test_eta_model_tracks_recent_latency():
+    """Recent samples outweigh old ones when provider latency shifts"""
+    model = EtaModel(half_life=10)
+    for _ in range(50):
+        model.observe(2, 10.0)
+    for _ in range(50):
+        model.observe(2, 30.0)
+    assert 28.0 < model.expected_seconds(2) <= 30.5
+
+# Migration tests
+def test_migrations_are_ordered_and_split_concurrent_indexes():
+    migrations = load_migrations()
+    versions = [migration.version for migration in migrations]
+    assert versions == sorted(versions) and len(set(versions)) == len(versions)
+
+    concurrent = [migration for migration in migrations if not migration.transactional]
+    assert concurrent
+    for migration in concurrent:
+        for statement in migration.statements():
+            assert "CONCURRENTLY" in statement and ";" not in statement
+
+
+def test_ensure_schema_is_a_version_read_when_current():
+    latest = load_migrations()[-1].version
+
+    class FakeConn:
+        def __init__(self):
+            self.queries = []
+
+        async def fetchval(self, query, *args):
+            self.queries.append(query)
+            return True if "to_regclass" in query else latest
+
+        async def execute(self, query, *args):
+            raise AssertionError(f"unexpected statement {query}")
+
+    conn = FakeConn()
+    assert asyncio.run(ensure_schema(conn)) == latest
+    assert len(conn.queries) == 2
+
+
+# Status push tests
+def test_status_events_fan_out_until_completed(monkeypatch):
+    """Notifications reach only the trip's subscribers and the stream ends on completion"""
+    broadcaster = StatusBroadcaster(queue_size=2)
+    monkeypatch.setattr(main, "STATUS_STREAM_HEARTBEAT", 0.01)
+
+    def notify(trip_id, status, days_completed):
+        payload = {"trip_id": trip_id, "status": status, "started_at": None,
+                   "days_completed": days_completed, "days_total": 3}
+        broadcaster._on_notify(None, 0, "generation_status", json.dumps(payload))
+
+    async def scenario():
+        queue = broadcaster.open(7)
+        other = broadcaster.open(8)
+        snapshot = main.describe_generation_status("processing", None, 0, 3)
+        updates = []
+
+        async def consume():
+            async for update in main.follow_generation_status(7, queue, snapshot):
+                updates.append(update)
+
+        consumer = asyncio.create_task(consume())
+        await asyncio.sleep(0.02)
+        notify(7, "processing", 1)
+        notify(9, "processing", 1)
+        await asyncio.sleep(0)
+        notify(7, "completed", 3)
+        await asyncio.wait_for(consumer, timeout=1)
+        broadcaster.close(7, queue)
+        return updates, other.qsize()
+
+    updates, other_pending = asyncio.run(scenario())
+    statuses = [update for update in updates if update is not None]
+    assert None in updates  # heartbeat while idle
+    assert [update["status"] for update in statuses] == ["processing", "processing", "completed"]
+    assert statuses[1]["message"].endswith("(1/3 days)")
+    assert other_pending == 0
+    assert broadcaster.stats()["subscribers"] == 1
+
+
+# Geocoding tests
+def test_geocoder_dedups_addresses_and_caches_results():
+    """One batch per itinerary with each address once; a repeat itinerary needs no request"""
+    requests_seen = []
+
+    def map_service(request):
+        body = json.loads(request.content)
+        requests_seen.append(body)
+        results = [{"address": address, "lat": None, "lng": None} if "Nowhere" in address
+                   else {"address": address, "lat": 41.9, "lng": 12.49}
+                   for address in body["addresses"]]
+        return httpx.Response(200, json={"results": results})
+
+    def itinerary():
+        return {
+            "Day 1": {"date": "2025-06-01",
+                      "09:00": {"title": "Cafe", "address": "Via Roma 1"},
+                      "11:00": {"title": "Cafe again", "address": "via  roma 1"},
+                      "13:00": {"title": "Lost", "address": "Nowhere 5"}},
+            "Day 2": {"date": "2025-06-02", "09:00": {"title": "Walk", "address": "?"}},
+        }
+
+    async def run():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(map_service))
+        geocoder = ActivityGeocoder("http://map", client)
+        first, second = itinerary(), itinerary()
+        try:
+            counts = (await geocoder.annotate(first, "Rome"), await geocoder.annotate(second, "Rome"))
+        finally:
+            await client.aclose()
+        return geocoder, first, counts
+
+    geocoder, first, counts = asyncio.run(run())
+    assert counts == (2, 2)
+    assert requests_seen == [{"addresses": ["Via Roma 1", "Nowhere 5"], "near": "Rome"}]
+    assert first["Day 1"]["11:00"]["lat"] == 41.9 and first["Day 1"]["11:00"]["lng"] == 12.49
+    assert "lat" not in first["Day 1"]["13:00"] and "lat" not in first["Day 2"]["09:00"]
+    assert geocoder.stats()["cache_hits"] == 2
+
+# Route ordering tests
+def test_route_optimizer_removes_zig_zag_and_keeps_meals():
+    """Free stops are reordered into the shortest walk; meals stay in their slots"""
+    def stop(kind, title, lng):
+        return {"type": kind, "title": title, "address": "somewhere", "lat": 41.9, "lng": lng}
+
+    def day(date):
+        # west -> far east -> west -> near east -> east: the two sights are swapped
+        return {"date": date,
+                "09:00": stop("breakfast", "Breakfast", 12.40),
+                "11:00": stop("sightseeing", "Far", 12.46),
+                "13:00": stop("lunch", "Lunch", 12.42),
+                "15:30": stop("activity", "Near", 12.41),
+                "19:00": stop("dinner", "Dinner", 12.47)}
+
+    itinerary = {"Day 1": day("2025-06-01"), "Day 2": day("2025-06-02"),
+                 "Day 3": {"date": "2025-06-03", "09:00": {"title": "No coordinates"}}}
+    report = RouteOptimizer().optimize(itinerary)
+
+    titles = [itinerary["Day 1"][slot]["title"] for slot in ("09:00", "11:00", "13:00", "15:30", "19:00")]
+    assert titles == ["Breakfast", "Near", "Lunch", "Far", "Dinner"]
+    assert list(report) == ["Day 1", "Day 2"]
+    metres_per_step = haversine_matrix([41.9, 41.9], [12.40, 12.41])[0, 1]  # ~830 m
+    assert abs(report["Day 1"]["distance_m"] - 7 * metres_per_step) < 2
+    assert abs(report["Day 1"]["saved_m"] - 10 * metres_per_step) < 2
+
+# Cancellation tests
+def test_cancel_notification_stops_only_that_generation(monkeypatch):
+    """A cancel for one trip aborts its generation mid-call and the job ends quietly; shutdown still propagates"""
+    registry = GenerationRegistry()
+    monkeypatch.setattr(main, "generation_registry", registry)
+    aborted = []
+
+    async def slow_task(trip_id, request, generation_id, raise_on_error=False, interactive=False,
+                        serves_followers=False):
+        try:
+            await asyncio.sleep(30)  # stands in for the LLM request
+        except asyncio.CancelledError:
+            aborted.append(generation_id)
+            raise
+
+    monkeypatch.setattr(main, "generate_itinerary_task", slow_task)
+    payload = {"destination": "Rome", "start_date": "2025-06-01", "end_date": "2025-06-02"}
+    job = type("Job", (), {"id": 1, "trip_id": 1, "generation_id": "g1", "payload": payload})()
+
+    async def scenario():
+        cancelled_job = asyncio.create_task(main.run_generation_job(job))
+        other = asyncio.create_task(registry.run(2, "g2", slow_task(2, None, "g2")))
+        await asyncio.sleep(0.01)
+        registry._on_notify(None, 0, "generation_cancel", json.dumps({"trip_id": 1, "generation_id": "g1"}))
+        await asyncio.wait_for(cancelled_job, timeout=1)
+        other_running = registry.is_running("g2")
+        other.cancel()
+        try:
+            await other
+        except asyncio.CancelledError:
+            return other_running, "propagated"
+        return other_running, "swallowed"
+
+    other_running, shutdown = asyncio.run(scenario())
+    assert aborted == ["g1", "g2"]
+    assert other_running and shutdown == "propagated"
+    assert registry.stats()["generations_cancelled"] == 1 and registry.stats()["running"] == 0
+
+def test_batch_leader_keeps_streaming_for_followers_after_its_trip_is_cleared(monkeypatch):
+    """A refused partial save on a cleared leader trip doesn't cancel the generation its followers wait for"""
+    registry = GenerationRegistry()
+    monkeypatch.setattr(main, "generation_registry", registry)
+    monkeypatch.setattr(main, "eta_model", EtaModel())
+    monkeypatch.setattr(main, "ITINERARY_CACHE_ENABLED", False)
+    monkeypatch.setattr(main, "QUALITY_REASK_MAX_DAYS", 0)
+    monkeypatch.setattr(main, "GEOCODE_ACTIVITIES", False)
+    days = {"Day 1": full_day("2025-06-01", "Trastevere", "A"), "Day 2": full_day("2025-06-02", "Monti", "B")}
+    partial_saves, bulk_saves = [], []
+
+    async def cleared_trip_save(trip_id, content, status="completed", generation_id=None, **kwargs):
+        partial_saves.append(status)
+        return False  # the leader's trip was cleared
+
+    async def bulk_save(entries, status="completed"):
+        bulk_saves.extend(entries)
+
+    async def streaming_llm(prompt, on_day=None, expected_days=None, timing=None, hedge=False):
+        for day_key, day_data in days.items():
+            await on_day(day_key, day_data)
+            await asyncio.sleep(0)
+        return json.dumps(days)
+
+    monkeypatch.setattr(main, "save_itinerary_to_db", cleared_trip_save)
+    monkeypatch.setattr(main, "save_itineraries_bulk", bulk_save)
+    monkeypatch.setattr(main, "generate_with_llm", streaming_llm)
+    payload = {"destination": "Rome", "start_date": "2025-06-01", "end_date": "2025-06-02",
+               "batch_followers": [{"trip_id": 2, "generation_id": "g2", "start_date": "2025-07-01"}]}
+    job = type("Job", (), {"id": 1, "trip_id": 1, "generation_id": "g1", "payload": payload})()
+
+    asyncio.run(main.run_generation_job(job))
+    assert partial_saves == ["processing", "completed"]  # later partials are skipped once refused
+    assert registry.stats()["generations_cancelled"] == 0
+    [(trip_id, itinerary, generation_id)] = bulk_saves
+    assert (trip_id, generation_id) == (2, "g2") and itinerary["Day 2"]["date"] == "2025-07-02"
+
+# Day quality tests
+def full_day(date, district, prefix):
+    slots = [("09:00", "breakfast"), ("11:00", "sightseeing"), ("13:00", "lunch"), ("15:30", "activity"), ("19:00", "dinner")]
+    day = {"date": date, "district": district}
+    for i, (slot, kind) in enumerate(slots):
+        day[slot] = {"type": kind, "title": f"{prefix} place {i}", "location": district,
+                     "address": f"Via {prefix} {i + 1}, {district}, Rome"}
+    return day
+
+def test_low_quality_day_is_reasked_alone(monkeypatch):
+    """Extraction placeholders are flagged and only that day is regenerated, with its neighbours as context"""
+    padded = extract_itinerary_fields('"Day 2" "district": "Monti" "title": "Ciuri Ciuri" "address": "Via Leonina 18"')
+    itinerary = {"Day 1": full_day("2025-06-01", "Trastevere", "A"), "Day 2": padded["Day 2"],
+                 "Day 3": full_day("2025-06-03", "Testaccio", "C")}
+    assert day_issues(itinerary["Day 1"]) == []
+    assert list(low_quality_days(itinerary)) == ["Day 2"]
+    assert "11:00: placeholder title" in low_quality_days(itinerary)["Day 2"]
+
+    prompts = []
+
+    async def fake_llm(prompt, on_day=None, expected_days=None, timing=None, hedge=False):
+        prompts.append((prompt, expected_days))
+        return json.dumps({"Day 1": full_day("2099-01-01", "Esquilino", "B")})
+
+    monkeypatch.setattr(main, "generate_with_llm", fake_llm)
+    monkeypatch.setattr(main, "QUALITY_REASK_MAX_DAYS", 2)
+    request = main.ItineraryRequest(destination="Rome", start_date="2025-06-01", end_date="2025-06-03")
+    replaced = asyncio.run(main.reask_low_quality_days(request, datetime(2025, 6, 1), 3, itinerary))
+
+    assert replaced == 1
+    [(prompt, expected_days)] = prompts
+    assert expected_days == 1 and "Create day 2 of a 3-day Rome itinerary" in prompt
+    assert "Trastevere, Testaccio" in prompt
+    assert itinerary["Day 2"]["district"] == "Esquilino" and itinerary["Day 2"]["date"] == "2025-06-02"
+    assert itinerary["Day 1"]["district"] == "Trastevere"
+
+# Stuck-generation sweeper tests
+def test_sweeper_skips_when_locked_and_counts_recoveries():
+    """Only the replica holding the advisory lock sweeps; returned rows are split into requeued and failed"""
+    lock = {"held_elsewhere": True}
+    statements = []
+
+    class FakeConn:
+        @contextlib.asynccontextmanager
+        async def transaction(self):
+            yield
+
+        async def fetchval(self, query, *args):
+            assert "pg_try_advisory_xact_lock" in query and args == (SWEEP_LOCK_KEY,)
+            return not lock["held_elsewhere"]
+
+        async def fetch(self, query, *args):
+            statements.append((query, args))
+            return [{"id": 7, "generation_status": "processing"}, {"id": 9, "generation_status": "failed"},
+                    {"id": 12, "generation_status": "failed"}]
+
+    class FakePool:
+        @contextlib.asynccontextmanager
+        async def acquire(self):
+            yield FakeConn()
+
+    sweeper = StuckGenerationSweeper(deadline=600, batch_size=50)
+    sweeper.attach_pool(FakePool())
+    assert asyncio.run(sweeper.sweep()) is None and statements == []
+
+    lock["held_elsewhere"] = False
+    assert asyncio.run(sweeper.sweep()) == {"requeued": 1, "failed": 2}
+    [(query, args)] = statements
+    assert "t.generation_status = 'processing'" in query and "pg_notify" in query
+    assert args[:2] == (600.0, 50)
+    assert args[4:] == serialize_itinerary({"error": FAILED_ERROR})
+    stats = sweeper.stats()
+    assert (stats["sweeps"], stats["sweeps_skipped"], stats["requeued"], stats["failed"]) == (1, 1, 1, 2)
+
+# Graceful shutdown tests
+def test_shutdown_drains_finishing_jobs_and_requeues_the_rest():
+    """stop() lets a job that finishes within the drain deadline complete and releases the one that doesn't"""
+    rows = [{"id": job_id, "trip_id": job_id, "generation_id": uuid.uuid4(), "payload": "{}", "attempts": 1,
+             "max_attempts": 3} for job_id in (1, 2)]
+    completed, released, interrupted = [], [], []
+
+    class FakeConn:
+        async def execute(self, query, *args):
+            if "status = 'done'" in query:
+                completed.append(args[0])
+
+        async def fetch(self, query, *args):
+            if "FOR UPDATE SKIP LOCKED" in query:
+                return [{**rows.pop(0), "claimed": True}] if rows else []
+            released.append((args[0], "attempts - 1" in query))
+            return [{"id": job_id} for job_id in args[0]]
+
+    class FakePool:
+        @contextlib.asynccontextmanager
+        async def acquire(self):
+            yield FakeConn()
+
+    async def handler(job):
+        try:
+            await asyncio.sleep(0.05 if job.id == 1 else 30)
+        except asyncio.CancelledError:
+            interrupted.append(job.id)
+            raise
+
+    async def run():
+        queue = JobQueue(handler, concurrency=2, poll_interval=0.01)
+        queue.attach_pool(FakePool())
+        queue.start()
+        await asyncio.sleep(0.02)
+        await queue.stop(drain_timeout=0.3)
+        return queue
+
+    queue = asyncio.run(run())
+    assert completed == [1] and interrupted == [2]
+    assert released == [([2], True)]
+    assert (queue.jobs_drained, queue.jobs_released, queue.in_flight) == (1, 1, 0)
+
+# Job queue tests
+def test_generation_claim_and_enqueue_share_one_transaction(monkeypatch):
+    """The trip claim and its job insert commit together; a failed enqueue rolls the claim back"""
+    events = []
+
+    class FakeConn:
+        @contextlib.asynccontextmanager
+        async def transaction(self):
+            events.append("begin")
+            try:
+                yield
+            except Exception:
+                events.append("rollback")
+                raise
+            events.append("commit")
+
+        async def fetchval(self, query, *args):
+            if "UPDATE trips" in query:
+                events.append("claim")
+                return args[1]
+            if events[-1] == "claim" and fail["enqueue"]:
+                raise RuntimeError("insert failed")
+            events.append("enqueue")
+            return 1
+
+    class FakePool:
+        @contextlib.asynccontextmanager
+        async def acquire(self):
+            yield FakeConn()
+
+    fail = {"enqueue": False}
+    monkeypatch.setattr(main, "db_pool", FakePool())
+    monkeypatch.setattr(main, "job_queue", JobQueue(lambda job: None))
+    request = ItineraryRequest(destination="Rome", start_date="2025-06-01", end_date="2025-06-03", preferences=[])
+
+    result = asyncio.run(main.start_itinerary_generation("5", request))
+    assert result["message"] == "Itinerary generation started"
+    assert events == ["begin", "claim", "enqueue", "commit"]
+
+    events.clear()
+    fail["enqueue"] = True
+    try:
+        asyncio.run(main.start_itinerary_generation("5", request))
+    except RuntimeError as e:
+        assert str(e) == "insert failed"
+    assert events == ["begin", "claim", "rollback"]
+
+def test_claim_gives_up_expired_jobs_that_are_out_of_attempts():
+    """A lapsed lock is only re-claimed with attempts left; exhausted jobs are failed through on_give_up"""
+    queries = []
+    given_up = []
+
+    def row(job_id, attempts, claimed):
+        return {"id": job_id, "trip_id": job_id * 10, "generation_id": uuid.uuid4(), "payload": "{}",
+                "attempts": attempts, "max_attempts": 3, "claimed": claimed}
+
+    class FakeConn:
+        async def fetch(self, query, *args):
+            queries.append((query, args))
+            return [row(4, 3, False), row(5, 2, True)]
+
+    class FakePool:
+        @contextlib.asynccontextmanager
+        async def acquire(self):
+            yield FakeConn()
+
+    async def on_give_up(job, error):
+        given_up.append((job.id, job.trip_id, error))
+
+    queue = JobQueue(lambda job: None, on_give_up=on_give_up)
+    queue.attach_pool(FakePool())
+    job = asyncio.run(queue.claim())
+
+    assert (job.id, job.attempts) == (5, 2)
+    assert given_up == [(4, 40, EXPIRED_ERROR)]
+    [(query, args)] = queries
+    assert "locked_until < NOW() AND attempts < max_attempts" in query
+    assert "locked_until < NOW() AND attempts >= max_attempts" in query
+    assert args[2] == EXPIRED_ERROR
+    assert (queue.jobs_claimed, queue.jobs_failed) == (1, 1)
+
+def test_failed_job_backs_off_exponentially_then_gives_up(monkeypatch):
+    """Failures requeue with base * 2^(attempt-1) delays until the last attempt, which goes to on_give_up"""
+    monkeypatch.setattr("job_queue.random.uniform", lambda low, high: 1.0)
+    updates = []
+    given_up = []
+
+    class FakeConn:
+        async def execute(self, query, *args):
+            updates.append((query, args))
+            return "UPDATE 0" if args[0] == 99 else "UPDATE 1"
+
+    class FakePool:
+        @contextlib.asynccontextmanager
+        async def acquire(self):
+            yield FakeConn()
+
+    async def handler(job):
+        raise RuntimeError(f"boom {job.attempts}")
+
+    async def on_give_up(job, error):
+        given_up.append((job.id, error))
+
+    def job(job_id, attempts):
+        return type("Job", (), {"id": job_id, "trip_id": 1, "attempts": attempts, "max_attempts": 3})()
+
+    async def run():
+        queue = JobQueue(handler, on_give_up=on_give_up, backoff_base=5.0, backoff_max=8.0)
+        queue.attach_pool(FakePool())
+        for attempts in (1, 2, 3):
+            await queue.run_job(job(7, attempts))
+        # A row cancelled while running is left alone
+        await queue.run_job(job(99, 1))
+        return queue
+
+    queue = asyncio.run(run())
+    retries = [args[:3] for query, args in updates if "status = 'queued'" in query]
+    assert retries == [(7, "boom 1", 5.0), (7, "boom 2", 8.0), (99, "boom 1", 5.0)]
+    assert [args[:2] for query, args in updates if "status = 'failed'" in query] == [(7, "boom 3")]
+    assert given_up == [(7, "boom 3")]
+    assert (queue.jobs_retried, queue.jobs_failed, queue.jobs_succeeded, queue.in_flight) == (2, 1, 0, 0)
+
+def test_worker_whose_lock_lapsed_does_not_record_a_reclaimed_job():
+    """Once another worker has re-claimed a job, the first worker can neither complete nor retry it"""
+    row = {"status": "running", "locked_by": "worker-b", "attempts": 2}
+
+    class FakeConn:
+        async def execute(self, query, *args):
+            # Every outcome UPDATE must be guarded on the owning worker
+            assert "locked_by = $" in query
+            if row["status"] != "running" or row["locked_by"] != args[-1]:
+                return "UPDATE 0"
+            row["status"] = "done" if "status = 'done'" in query else "queued"
+            return "UPDATE 1"
+
+    class FakePool:
+        @contextlib.asynccontextmanager
+        async def acquire(self):
+            yield FakeConn()
+
+    async def fails(job):
+        raise RuntimeError("boom")
+
+    async def run():
+        stale = [JobQueue(handler) for handler in (lambda job: asyncio.sleep(0), fails)]
+        for queue in stale:
+            queue.attach_pool(FakePool())
+            await queue.run_job(type("Job", (), {"id": 1, "trip_id": 1, "attempts": 1, "max_attempts": 3})())
+        return stale
+
+    succeeded, failed = asyncio.run(run())
+    assert row == {"status": "running", "locked_by": "worker-b", "attempts": 2}
+    assert (succeeded.jobs_succeeded, failed.jobs_retried, failed.jobs_failed) == (0, 0, 0)
+
+def test_lock_is_extended_while_the_handler_runs():
+    """The heartbeat pushes locked_until forward every third of the visibility timeout, then stops"""
+    extensions = []
+    completed = []
+
+    class FakeConn:
+        async def execute(self, query, *args):
+            if "status = 'done'" in query:
+                completed.append(args[0])
+            else:
+                extensions.append(args)
+
+    class FakePool:
+        @contextlib.asynccontextmanager
+        async def acquire(self):
+            yield FakeConn()
+
+    async def handler(job):
+        await asyncio.sleep(0.1)
+
+    async def run():
+        queue = JobQueue(handler, visibility_timeout=0.06)
+        queue.attach_pool(FakePool())
+        await queue.run_job(type("Job", (), {"id": 3, "trip_id": 1, "attempts": 1, "max_attempts": 3})())
+        during = len(extensions)
+        await asyncio.sleep(0.05)
+        return queue, during
+
+    queue, during = asyncio.run(run())
+    assert during >= 3 and len(extensions) == during
+    assert all(args == (3, 0.06, queue.worker_name) for args in extensions)
+    assert completed == [3]
+
+# HTTP pool tests
+def test_http_pool_counts_reuse_only_for_requests_that_got_a_response():
+    """Keep-alive requests count as reused; a request that fails on a reused connection doesn't"""
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                if b"/drop" in head.split(b"\r\n")[0]:
+                    break
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        base = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+        pool = PooledHTTPClient()
+        try:
+            for path in ("/a", "/b", "/c"):
+                assert (await pool.get(base + path)).text == "ok"
+            try:
+                await pool.get(base + "/drop")
+            except httpx.HTTPError:
+                pass
+            async with pool.stream("GET", base + "/d") as response:
+                assert await response.aread() == b"ok"
+            return pool.stats()
+        finally:
+            await pool.close()
+            server.close()
+
+    stats = asyncio.run(run())
+    # /b and /c reused the first connection; /drop broke it, so /d opened a second one
+    assert (stats["requests_total"], stats["errors_total"], stats["connections_opened"]) == (5, 1, 2)
+    assert stats["connections_reused"] == 2 and stats["reuse_ratio"] == 0.5
+
+def test_http_pool_limits_concurrent_requests_per_host():
+    """max_connections_per_host caps in-flight requests to one host without holding back others"""
+    active = {}
+    peak = {}
+
+    async def handler(request):
+        host = request.url.host
+        active[host] = active.get(host, 0) + 1
+        peak[host] = max(peak.get(host, 0), active[host])
+        await asyncio.sleep(0.02)
+        active[host] -= 1
+        return httpx.Response(200, json={})
+
+    async def run():
+        pool = PooledHTTPClient(max_connections_per_host=2)
+        pool._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        urls = ["http://groq.test/v1"] * 6 + ["http://maps.test/geocode"] * 3
+        await asyncio.gather(*(pool.get(url) for url in urls))
+        await pool.close()
+
+    asyncio.run(run())
+    assert peak == {"groq.test": 2, "maps.test": 2}
+
+def test_http_pool_falls_back_to_http1_without_h2(monkeypatch):
+    """HTTP/2 is only enabled when the h2 package can be imported"""
+    monkeypatch.setitem(sys.modules, "h2", None)
+
+    async def run():
+        pool = PooledHTTPClient(http2=True)
+        await pool.start()
+        stats = pool.stats()
+        await pool.close()
+        return pool, stats
+
+    pool, stats = asyncio.run(run())
+    assert pool.http2 and not pool.http2_enabled and stats["http2"] is False
+
+# Metrics tests
+def test_metrics_render_and_label_by_route_template():
+    """Exposition format is valid and requests are labelled by route template, not raw path"""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    registry = Registry()
+    calls = Counter("calls_total", "Calls", ("kind",), registry=registry)
+    latency = Histogram("work_seconds", "Work", buckets=(0.1, 1.0), registry=registry)
+    Gauge("depth", "Queue depth", ("state",), function=lambda: {"queued": 3, "running": None}, registry=registry)
+    calls.labels("a").inc(2)
+    latency.observe(0.05)
+    latency.observe(5)
+    text = asyncio.run(registry.render()).decode()
+    assert 'calls_total{kind="a"} 2' in text
+    assert 'work_seconds_bucket{le="0.1"} 1' in text
+    assert 'work_seconds_bucket{le="+Inf"} 2' in text
+    assert "work_seconds_count 2" in text
+    assert 'depth{state="queued"} 3' in text and "running" not in text
+
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/things/{thing_id}")
+    async def thing(thing_id: int):
+        return {"id": thing_id}
+
+    client = TestClient(app)
+    for thing_id in (1, 2):
+        client.get(f"/things/{thing_id}")
+    rendered = asyncio.run(REGISTRY.render()).decode()
+    assert 'http_requests_total{method="GET",route="/things/{thing_id}",status="200"} 2' in rendered
+    assert "/things/1" not in rendered
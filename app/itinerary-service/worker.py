@@ -0,0 +1,42 @@
+"""Standalone generation worker.
+
+Runs the itinerary job queue without the HTTP API, so workers can be scaled
+separately from API replicas:
+
+    GENERATION_WORKERS=4 python -m worker
+"""
+import asyncio
+import signal
+
+import main
+from main import logger
+
+
+async def run_worker():
+    await main.init_db_pool()
+    if main.db_pool is None:
+        raise SystemExit("Database pool could not be initialized")
+    await main.llm_client.start()
+    await main.generation_registry.start()
+    await main.stuck_sweeper.start(main.STUCK_SWEEP_INTERVAL)
+    main.job_queue.start(max(1, main.GENERATION_WORKERS))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    logger.info("Generation worker running")
+    await stop.wait()
+
+    logger.info("Generation worker shutting down")
+    await main.job_queue.stop(main.GENERATION_DRAIN_SECONDS)
+    await main.stuck_sweeper.stop()
+    await main.llm_client.close()
+    await main.map_client.close()
+    await main.generation_registry.stop()
+    await main.close_db_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(run_worker())
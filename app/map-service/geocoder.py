@@ -0,0 +1,141 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+
+
+def normalize_query(query: str) -> str:
+    """Cache key for a free-text query: case- and whitespace-insensitive"""
+    return " ".join(query.lower().split())
+
+
+class NominatimGeocoder:
+    """Cached, rate-limited Nominatim lookups for batch geocoding.
+
+    Results (including "not found") are kept in an in-process LRU, misses for
+    `miss_ttl` seconds only. Nominatim's usage policy allows one request per
+    second, so uncached lookups are spaced `min_interval` apart no matter how
+    many batches arrive at once; identical in-flight queries share one call.
+    """
+
+    def __init__(self,
+                 base_url: str = "https://nominatim.openstreetmap.org",
+                 user_agent: str = "TravelPlannerApp/1.0",
+                 min_interval: float = 1.0,
+                 max_entries: int = 10000,
+                 ttl_seconds: int = 30 * 24 * 3600,
+                 miss_ttl: int = 24 * 3600,
+                 timeout: float = 10.0):
+        self.base_url = base_url.rstrip("/")
+        self.user_agent = user_agent
+        self.min_interval = min_interval
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.miss_ttl = miss_ttl
+        self.timeout = timeout
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._pace = asyncio.Lock()
+        self._last_call = 0.0
+
+        self.cache_hits = 0
+        self.lookups = 0
+        self.found = 0
+        self.errors = 0
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout, headers={"User-Agent": self.user_agent})
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _cache_get(self, key: str):
+        entry = self._cache.get(key)
+        if entry is None:
+            return False, None
+        result, expires_at = entry
+        if expires_at < time.time():
+            del self._cache[key]
+            return False, None
+        self._cache.move_to_end(key)
+        return True, result
+
+    def _cache_put(self, key: str, result: Optional[Dict[str, Any]]):
+        ttl = self.ttl_seconds if result is not None else self.miss_ttl
+        self._cache[key] = (result, time.time() + ttl)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def _search(self, query: str) -> Optional[Dict[str, Any]]:
+        await self.start()
+        async with self._pace:
+            wait = self._last_call + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._last_call = time.monotonic()
+            self.lookups += 1
+            response = await self._client.get(f"{self.base_url}/search",
+                                              params={"q": query, "format": "json", "limit": 1})
+        response.raise_for_status()
+        results = response.json()
+        if not results:
+            return None
+        self.found += 1
+        return {
+            "lat": float(results[0]["lat"]),
+            "lng": float(results[0]["lon"]),
+            "display_name": results[0].get("display_name"),
+        }
+
+    async def geocode(self, query: str) -> Optional[Dict[str, Any]]:
+        """First match for the query, or None; lookup errors are not cached"""
+        key = normalize_query(query)
+        hit, result = self._cache_get(key)
+        if hit:
+            self.cache_hits += 1
+            return result
+
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await self._search(query)
+            self._cache_put(key, result)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            self.errors += 1
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        finally:
+            del self._in_flight[key]
+
+    async def geocode_many(self, queries: Iterable[str]) -> List[Optional[Dict[str, Any]]]:
+        """Results in input order; duplicates are looked up once and failures come back as None"""
+        queries = list(queries)
+        unique = {normalize_query(query): query for query in reversed(queries)}
+        outcomes = await asyncio.gather(*(self.geocode(query) for query in unique.values()), return_exceptions=True)
+        by_key = {key: (None if isinstance(outcome, BaseException) else outcome)
+                  for key, outcome in zip(unique.keys(), outcomes)}
+        return [by_key[normalize_query(query)] for query in queries]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cached": len(self._cache),
+            "cache_hits": self.cache_hits,
+            "lookups": self.lookups,
+            "found": self.found,
+            "errors": self.errors,
+        }
@@ -1,13 +1,38 @@
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
+import os
+import time
 import httpx
 
+from geocoder import NominatimGeocoder
+from metrics import Counter, Histogram, MetricsMiddleware, metrics_response
+
 app = FastAPI(
     title="Map Service",
     description="Location data and mapping service using OpenStreetMap",
     version="0.1.0",
 )
+app.add_middleware(MetricsMiddleware)
+
+NOMINATIM_LATENCY = Histogram("nominatim_request_duration_seconds", "Nominatim search latency by HTTP status",
+                              ("status",))
+
+# Batch geocoding (POST /geocode/batch); self-hosted Nominatim can lift the 1 req/s pacing
+GEOCODE_BATCH_MAX = int(os.getenv("GEOCODE_BATCH_MAX", "200"))
+geocoder = NominatimGeocoder(
+    base_url=os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org"),
+    min_interval=float(os.getenv("NOMINATIM_MIN_INTERVAL", "1.0")),
+    max_entries=int(os.getenv("GEOCODE_CACHE_SIZE", "10000")),
+)
+Counter("geocode_queries_total", "Batch geocoding queries by how they were answered", ("result",),
+        function=lambda: {"cache_hit": geocoder.cache_hits, "found": geocoder.found,
+                          "not_found": max(geocoder.lookups - geocoder.found - geocoder.errors, 0),
+                          "error": geocoder.errors})
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await geocoder.close()
 
 class Location(BaseModel):
     name: str
@@ -17,12 +42,27 @@ class Location(BaseModel):
     description: Optional[str] = None
     image_url: Optional[str] = None
 
+class GeocodeBatchRequest(BaseModel):
+    addresses: List[str] = Field(..., min_length=1)
+    near: Optional[str] = None  # destination appended to addresses that don't already name it
+
+class GeocodeResult(BaseModel):
+    address: str
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+    display_name: Optional[str] = None
+
 
 @app.get("/")
 async def read_root():
     """Health check endpoint"""
     return {"status": "healthy", "service": "map-service"}
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    return await metrics_response()
+
 @app.get("/search", response_model=List[Location])
 async def search_locations(query: str, country: Optional[str] = None):
     """Search for locations by name and optionally filter by country"""
@@ -38,11 +78,17 @@ async def search_locations(query: str, country: Optional[str] = None):
             params["country"] = country
             
         async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://nominatim.openstreetmap.org/search",
-                params=params,
-                headers={"User-Agent": "TravelPlannerApp/1.0"}
-            )
+            started = time.perf_counter()
+            try:
+                response = await client.get(
+                    "https://nominatim.openstreetmap.org/search",
+                    params=params,
+                    headers={"User-Agent": "TravelPlannerApp/1.0"}
+                )
+            except httpx.HTTPError:
+                NOMINATIM_LATENCY.labels("error").observe(time.perf_counter() - started)
+                raise
+            NOMINATIM_LATENCY.labels(response.status_code).observe(time.perf_counter() - started)
             
             if response.status_code != 200:
                 raise HTTPException(status_code=500, detail="Failed to search locations")
@@ -64,6 +110,26 @@ async def search_locations(query: str, country: Optional[str] = None):
         raise HTTPException(status_code=500, detail=f"Location search failed: {str(e)}")
 
 
+@app.post("/geocode/batch")
+async def geocode_batch(request: GeocodeBatchRequest):
+    """Geocode many addresses at once; duplicates and cached addresses cost no Nominatim call
+
+    Results come back in request order, with lat/lng null for addresses
+    that could not be found.
+    """
+    if len(request.addresses) > GEOCODE_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {GEOCODE_BATCH_MAX} addresses per batch")
+
+    near = (request.near or "").strip()
+    queries = [address if not near or near.lower() in address.lower() else f"{address}, {near}"
+               for address in request.addresses]
+    matches = await geocoder.geocode_many(queries)
+    return {
+        "results": [GeocodeResult(address=address, **(match or {})) for address, match in zip(request.addresses, matches)],
+        "stats": geocoder.stats(),
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8002, reload=True)
\ No newline at end of file
@@ -0,0 +1,21 @@
+"""Low-overhead in-process Prometheus metrics shared by the backend, itinerary and map services
+
+Counters, gauges and histograms are plain Python objects updated in place;
+nothing is computed until /metrics is scraped, when they are rendered in the
+Prometheus text format. Gauges can read their value from a callback at
+scrape time (pool sizes, queue depth) instead of being kept up to date.
+"""
+from .registry import CONTENT_TYPE_LATEST, DEFAULT_BUCKETS, REGISTRY, Counter, Gauge, Histogram, Registry
+from .asgi import MetricsMiddleware, metrics_response
+
+__all__ = [
+    "CONTENT_TYPE_LATEST",
+    "DEFAULT_BUCKETS",
+    "REGISTRY",
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "MetricsMiddleware",
+    "Registry",
+    "metrics_response",
+]
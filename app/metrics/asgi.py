@@ -0,0 +1,53 @@
+import time
+
+from starlette.responses import Response
+
+from .registry import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route template and status",
+                        ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency by route template",
+                         ("method", "route"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being served")
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware timing every HTTP request.
+
+    Requests are labelled with the matched route's path template (so
+    /itinerary/{trip_id} is one series, not one per trip); unmatched paths
+    share the label "unmatched". WebSockets and `skip_paths` are not timed.
+    """
+
+    def __init__(self, app, skip_paths=("/metrics",)):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope.get("method", "GET")
+            HTTP_LATENCY.labels(method, route).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(method, route, status).inc()
+
+
+async def metrics_response():
+    """GET /metrics body for any of the services"""
+    return Response(await REGISTRY.render(), media_type=CONTENT_TYPE_LATEST)
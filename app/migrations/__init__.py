@@ -0,0 +1,18 @@
+"""Versioned Postgres schema migrations shared by the backend and the itinerary service"""
+from .runner import (
+    MigrationError,
+    apply_migrations,
+    current_version,
+    ensure_schema,
+    latest_version,
+    load_migrations,
+)
+
+__all__ = [
+    "MigrationError",
+    "apply_migrations",
+    "current_version",
+    "ensure_schema",
+    "latest_version",
+    "load_migrations",
+]
@@ -0,0 +1,65 @@
+"""python -m migrations [upgrade|status]
+
+Connects with DATABASE_URL, or POSTGRES_HOST/PORT/USER/PASSWORD/DB.
+"""
+import asyncio
+import logging
+import os
+import sys
+
+import asyncpg
+
+from .runner import apply_migrations, current_version, latest_version, load_migrations
+
+
+def database_url() -> str:
+    url = os.getenv("DATABASE_URL")
+    if url:
+        return url
+    return "postgresql://{user}:{password}@{host}:{port}/{db}".format(
+        user=os.getenv("POSTGRES_USER", "postgres"),
+        password=os.getenv("POSTGRES_PASSWORD", "postgres"),
+        host=os.getenv("POSTGRES_HOST", "postgres-service"),
+        port=os.getenv("POSTGRES_PORT", "5432"),
+        db=os.getenv("POSTGRES_DB", "traveldb"),
+    )
+
+
+async def connect(retries: int = 30, delay: float = 2.0):
+    for attempt in range(retries):
+        try:
+            return await asyncpg.connect(database_url())
+        except (OSError, asyncpg.PostgresError) as e:
+            if attempt == retries - 1:
+                raise
+            logging.getLogger("migrations").info(f"PostgreSQL not ready ({e}), retrying in {delay}s")
+            await asyncio.sleep(delay)
+
+
+async def main(command: str) -> int:
+    conn = await connect()
+    try:
+        if command == "status":
+            version = await current_version(conn)
+            print(f"Database schema version {version}, latest {latest_version()}")
+            for migration in load_migrations():
+                state = "applied" if migration.version <= version else "pending"
+                print(f"  {migration.version:04d}_{migration.name}: {state}")
+            return 0
+        if await current_version(conn) >= latest_version():
+            print(f"Schema is up to date at version {latest_version()}")
+            return 0
+        applied = await apply_migrations(conn, lock_timeout=os.getenv("MIGRATION_LOCK_TIMEOUT", "10s"))
+        print(f"Applied {len(applied)} migrations; schema at version {await current_version(conn)}")
+        return 0
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if command not in ("upgrade", "status"):
+        print(__doc__)
+        sys.exit(2)
+    sys.exit(asyncio.run(main(command)))
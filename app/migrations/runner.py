@@ -0,0 +1,169 @@
+import hashlib
+import logging
+import os
+import re
+import time
+from typing import List, Optional
+
+logger = logging.getLogger("migrations")
+
+VERSIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "versions")
+
+# Any fixed 64-bit key works; every service and replica must use the same one
+MIGRATION_LOCK_KEY = 7_274_301_955_118_213_117
+
+VERSION_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        checksum VARCHAR(64) NOT NULL,
+        duration_ms INTEGER NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+"""
+
+_FILENAME_RE = re.compile(r"^(\d+)_([\w-]+)\.sql$")
+_NO_TRANSACTION_RE = re.compile(r"^\s*--\s*migrate:\s*no-transaction\s*$", re.MULTILINE | re.IGNORECASE)
+_CONCURRENT_INDEX_RE = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\"?[\w.]+\"?)",
+    re.IGNORECASE,
+)
+
+
+class MigrationError(Exception):
+    pass
+
+
+class Migration:
+    """One versions/NNNN_name.sql file"""
+
+    def __init__(self, version: int, name: str, sql: str):
+        self.version = version
+        self.name = name
+        self.sql = sql
+        self.checksum = hashlib.sha256(sql.encode("utf-8")).hexdigest()
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+        self.transactional = not _NO_TRANSACTION_RE.search(sql)
+
+    def statements(self) -> List[str]:
+        """The file split into single statements (no-transaction files must avoid ';' inside literals)"""
+        body = "\n".join(line for line in self.sql.splitlines() if not line.strip().startswith("--"))
+        return [statement.strip() for statement in body.split(";") if statement.strip()]
+
+    def __repr__(self):
+        return f"<Migration {self.version:04d}_{self.name}>"
+
+
+def load_migrations(directory: str = VERSIONS_DIR) -> List[Migration]:
+    """All migrations in version order"""
+    migrations = []
+    seen = set()
+    for filename in sorted(os.listdir(directory)):
+        match = _FILENAME_RE.match(filename)
+        if not match:
+            continue
+        version = int(match.group(1))
+        if version in seen:
+            raise MigrationError(f"Duplicate migration version {version}")
+        seen.add(version)
+        with open(os.path.join(directory, filename), encoding="utf-8") as f:
+            migrations.append(Migration(version, match.group(2), f.read()))
+    return sorted(migrations, key=lambda migration: migration.version)
+
+
+def latest_version(directory: str = VERSIONS_DIR) -> int:
+    migrations = load_migrations(directory)
+    return migrations[-1].version if migrations else 0
+
+
+async def current_version(conn) -> int:
+    """Highest applied version (0 when the version table doesn't exist yet)"""
+    exists = await conn.fetchval("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not exists:
+        return 0
+    return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+
+
+async def _drop_invalid_indexes(conn, migration: Migration):
+    # A failed CONCURRENTLY build leaves an INVALID index that IF NOT EXISTS would then skip
+    for name in _CONCURRENT_INDEX_RE.findall(migration.sql):
+        invalid = await conn.fetchval(
+            """SELECT NOT i.indisvalid FROM pg_index i
+               JOIN pg_class c ON c.oid = i.indexrelid
+               WHERE c.oid = to_regclass($1)""",
+            name.strip('"')
+        )
+        if invalid:
+            logger.warning(f"Dropping invalid index {name} left by an interrupted build")
+            await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+async def _apply(conn, migration: Migration, lock_timeout: str):
+    started = time.monotonic()
+    if migration.transactional:
+        async with conn.transaction():
+            # Fail fast instead of queueing every query on a hot table behind our lock request
+            await conn.execute(f"SET LOCAL lock_timeout = '{lock_timeout}'")
+            await conn.execute(migration.sql)
+            await conn.execute(
+                "INSERT INTO schema_migrations (version, name, checksum, duration_ms) VALUES ($1, $2, $3, $4)",
+                migration.version, migration.name, migration.checksum, int((time.monotonic() - started) * 1000)
+            )
+    else:
+        await _drop_invalid_indexes(conn, migration)
+        for statement in migration.statements():
+            await conn.execute(statement)
+        await conn.execute(
+            "INSERT INTO schema_migrations (version, name, checksum, duration_ms) VALUES ($1, $2, $3, $4)",
+            migration.version, migration.name, migration.checksum, int((time.monotonic() - started) * 1000)
+        )
+    logger.info(f"Applied migration {migration.version:04d}_{migration.name} "
+                f"in {(time.monotonic() - started) * 1000:.0f}ms")
+
+
+async def apply_migrations(conn, directory: str = VERSIONS_DIR, lock_timeout: str = "10s") -> List[int]:
+    """Apply pending migrations under a session advisory lock; returns the versions applied
+
+    Concurrent callers (replicas starting together) wait on the lock and then
+    find nothing left to do. A migration whose file changed after it was
+    applied is reported, not re-run.
+    """
+    migrations = load_migrations(directory)
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_KEY)
+    try:
+        await conn.execute(VERSION_TABLE_DDL)
+        rows = await conn.fetch("SELECT version, checksum FROM schema_migrations")
+        applied = {row["version"]: row["checksum"] for row in rows}
+
+        for migration in migrations:
+            if migration.version in applied and applied[migration.version] != migration.checksum:
+                logger.warning(f"Migration {migration.version:04d}_{migration.name} changed after it was applied")
+
+        pending = [migration for migration in migrations if migration.version not in applied]
+        for migration in pending:
+            try:
+                await _apply(conn, migration, lock_timeout)
+            except Exception as e:
+                raise MigrationError(f"Migration {migration.version:04d}_{migration.name} failed: {e}") from e
+        return [migration.version for migration in pending]
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_KEY)
+
+
+async def ensure_schema(conn, apply: bool = True, directory: str = VERSIONS_DIR,
+                        lock_timeout: str = "10s") -> Optional[int]:
+    """Startup hook: a single version read when the schema is current
+
+    When it is behind, pending migrations are applied (apply=True) or a
+    MigrationError is raised. Returns the schema version in use.
+    """
+    target = latest_version(directory)
+    version = await current_version(conn)
+    if version >= target:
+        return version
+    if not apply:
+        raise MigrationError(f"Database schema is at version {version}, expected {target}; "
+                             f"run `python -m migrations upgrade`")
+    logger.info(f"Database schema at version {version}, migrating to {target}")
+    await apply_migrations(conn, directory, lock_timeout)
+    return await current_version(conn)
@@ -0,0 +1,39 @@
+-- Core tables owned by the backend (previously created by migrate_to_postgres.py
+-- and Base.metadata.create_all). IF NOT EXISTS lets existing databases adopt it.
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    hashed_password TEXT NOT NULL,
+    is_active BOOLEAN NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS locations (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL,
+    country TEXT NOT NULL,
+    description TEXT,
+    lat FLOAT NOT NULL,
+    lng FLOAT NOT NULL,
+    popular BOOLEAN DEFAULT FALSE,
+    image_url TEXT
+);
+
+CREATE TABLE IF NOT EXISTS trips (
+    id SERIAL PRIMARY KEY,
+    title TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    budget FLOAT,
+    description TEXT,
+    itinerary JSONB,
+    owner_id INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS preferences (
+    id SERIAL PRIMARY KEY,
+    category TEXT NOT NULL,
+    value TEXT NOT NULL,
+    weight INTEGER NOT NULL,
+    user_id INTEGER NOT NULL
+);
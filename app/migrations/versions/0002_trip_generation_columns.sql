@@ -0,0 +1,8 @@
+-- Generation state kept on trips by the itinerary service
+ALTER TABLE trips
+    ADD COLUMN IF NOT EXISTS generation_status VARCHAR(20) DEFAULT 'pending',
+    ADD COLUMN IF NOT EXISTS generation_id UUID,
+    ADD COLUMN IF NOT EXISTS generation_started_at TIMESTAMP,
+    ADD COLUMN IF NOT EXISTS generation_updated_at TIMESTAMP,
+    ADD COLUMN IF NOT EXISTS generation_days_completed INTEGER DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS generation_days_total INTEGER;
@@ -0,0 +1,4 @@
+-- migrate: no-transaction
+-- Built without blocking writes to trips
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_trips_generation_id ON trips(generation_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_trips_generation_status ON trips(generation_status);
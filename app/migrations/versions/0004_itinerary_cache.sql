@@ -0,0 +1,9 @@
+CREATE TABLE IF NOT EXISTS itinerary_cache (
+    cache_key VARCHAR(64) PRIMARY KEY,
+    itinerary JSONB NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    expires_at TIMESTAMP NOT NULL,
+    last_hit_at TIMESTAMP,
+    hit_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_itinerary_cache_expires_at ON itinerary_cache(expires_at);
@@ -0,0 +1,14 @@
+CREATE TABLE IF NOT EXISTS generation_timings (
+    id BIGSERIAL PRIMARY KEY,
+    trip_id INTEGER NOT NULL,
+    generation_id UUID,
+    days_count INTEGER NOT NULL,
+    effective_days INTEGER NOT NULL,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    llm_calls INTEGER NOT NULL DEFAULT 0,
+    wall_seconds DOUBLE PRECISION NOT NULL,
+    outcome VARCHAR(20) NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_generation_timings_created_at ON generation_timings(created_at);
@@ -0,0 +1,12 @@
+CREATE TABLE IF NOT EXISTS generation_batches (
+    id UUID PRIMARY KEY,
+    total INTEGER NOT NULL,
+    unique_prompts INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+CREATE TABLE IF NOT EXISTS generation_batch_items (
+    batch_id UUID NOT NULL REFERENCES generation_batches(id) ON DELETE CASCADE,
+    trip_id INTEGER NOT NULL,
+    generation_id UUID NOT NULL,
+    PRIMARY KEY (batch_id, trip_id)
+);
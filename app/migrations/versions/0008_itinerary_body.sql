@@ -0,0 +1,24 @@
+-- Pre-serialized GET /itinerary response body and its SHA-256 (the ETag);
+-- rows saved before this migration are filled in lazily on first read
+ALTER TABLE trips
+    ADD COLUMN IF NOT EXISTS itinerary_body BYTEA,
+    ADD COLUMN IF NOT EXISTS itinerary_hash VARCHAR(64);
+
+-- The backend writes trips.itinerary without touching the body or hash. An
+-- UPDATE that changes the itinerary but not the hash drops both, so the next
+-- read re-serializes it under a new ETag instead of serving the old body.
+CREATE OR REPLACE FUNCTION trips_clear_stale_itinerary_body() RETURNS trigger AS $$
+BEGIN
+    IF NEW.itinerary IS DISTINCT FROM OLD.itinerary
+       AND NEW.itinerary_hash IS NOT DISTINCT FROM OLD.itinerary_hash THEN
+        NEW.itinerary_body := NULL;
+        NEW.itinerary_hash := NULL;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trips_clear_stale_itinerary_body ON trips;
+CREATE TRIGGER trips_clear_stale_itinerary_body
+    BEFORE UPDATE OF itinerary ON trips
+    FOR EACH ROW EXECUTE FUNCTION trips_clear_stale_itinerary_body();